@@ -3,12 +3,13 @@ from setuptools import setup
 setup(
     name='training',
     version='0.1.0',
-    packages=['training', 'training.server', 'training.client', 'training.tests'],
+    packages=['training', 'training.server', 'training.server.migrations', 'training.client', 'training.tests', 'training.benchmarks'],
     include_package_data=True,
     entry_points={
         'console_scripts': [
             'server = training.server.__main__:main',
-            'client = training.client.__main__:main'
+            'client = training.client.__main__:main',
+            'migrate = training.server.migrate:main'
         ]
     }
 )
\ No newline at end of file
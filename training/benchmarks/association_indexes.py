@@ -0,0 +1,118 @@
+"""Time engineer_id and vehicle_id lookups before and after the vehicle_engineers keys and indexes migration.
+
+Builds the schema as it was before the migration in a scratch database, fills it with --rows rows per
+table (including some duplicate assignments), times lookups, runs the migration and times them again.
+
+    python -m training.benchmarks.association_indexes --rows 100000
+"""
+import os
+import random
+import tempfile
+from datetime import date
+from time import perf_counter
+import click
+from sqlalchemy import MetaData, Table, Column, Integer, ForeignKey, create_engine, select, func
+from training.server.base import Base
+from training.server.migrations import m0001_association_keys
+from training.server.model import vehicle_engineer_association, Vehicle, Engineer, Laptop, ContactDetails
+
+def create_old_schema(bind):
+    """The tables as they were before the migration: no association primary key and no engineer_id indexes."""
+    metadata = MetaData()
+    for table in [Vehicle.__table__, Engineer.__table__, Laptop.__table__, ContactDetails.__table__]:
+        table.to_metadata(metadata).indexes.clear()
+    Table("vehicle_engineers", metadata,
+          Column("vehicle_id", Integer, ForeignKey("vehicles.id")),
+          Column("engineer_id", Integer, ForeignKey("engineers.id")))
+    metadata.create_all(bind)
+
+
+def fill(bind, rows):
+    num_vehicles = num_engineers = max(rows // 5, 1)
+    with bind.begin() as connection:
+        connection.execute(Vehicle.__table__.insert(), [
+            {"model": f"Model {i}", "quantity": 1, "in_stock": True, "price": 20000, "manufacture_date": date(2020, 1, 1)}
+            for i in range(num_vehicles)
+        ])
+        connection.execute(Engineer.__table__.insert(), [
+            {"name": f"Engineer {i}", "birthday": date(1990, 1, 1)} for i in range(num_engineers)
+        ])
+        pairs = [{"vehicle_id": 1 + i // 5, "engineer_id": random.randint(1, num_engineers)} for i in range(rows)]
+        # Assignments made before the primary key existed could be duplicated
+        pairs += random.sample(pairs, rows // 100)
+        connection.execute(vehicle_engineer_association.insert(), pairs)
+        connection.execute(Laptop.__table__.insert(), [
+            {"model": "Laptop", "date_loaned": date(2020, 1, 1), "engineer_id": random.randint(1, num_engineers)} for _ in range(rows)
+        ])
+        connection.execute(ContactDetails.__table__.insert(), [
+            {"phone_number": f"{i:012d}", "address": "Address", "engineer_id": random.randint(1, num_engineers)} for i in range(rows)
+        ])
+    return num_vehicles, num_engineers
+
+
+def time_lookups(bind, lookups, num_vehicles, num_engineers):
+    """Average milliseconds per lookup for each kind of lookup."""
+    vehicle_ids = random.sample(range(1, num_vehicles + 1), min(lookups, num_vehicles))
+    engineer_ids = random.sample(range(1, num_engineers + 1), min(lookups, num_engineers))
+    association = vehicle_engineer_association.c
+    queries = {
+        "engineers of a vehicle": lambda id: select(association.engineer_id).where(association.vehicle_id == id),
+        "vehicles of an engineer": lambda id: select(association.vehicle_id).where(association.engineer_id == id),
+        "laptops of an engineer": lambda id: select(Laptop.__table__.c.id).where(Laptop.__table__.c.engineer_id == id),
+        "contacts of an engineer": lambda id: select(ContactDetails.__table__.c.id).where(ContactDetails.__table__.c.engineer_id == id)
+    }
+    timings = {}
+    with bind.connect() as connection:
+        for name, query in queries.items():
+            ids = vehicle_ids if name == "engineers of a vehicle" else engineer_ids
+            start = perf_counter()
+            for id in ids:
+                connection.execute(query(id)).all()
+            timings[name] = (perf_counter() - start) * 1000 / len(ids)
+    return timings
+
+
+def count_assignments(bind):
+    with bind.connect() as connection:
+        return connection.execute(select(func.count()).select_from(vehicle_engineer_association)).scalar()
+
+
+@click.command()
+@click.option("--url", default=None, help="Scratch database to benchmark in, its tables are dropped. Defaults to a temporary SQLite file.")
+@click.option("--rows", type=int, default=100000, help="Rows in vehicle_engineers, laptops and contact_details.")
+@click.option("--lookups", type=int, default=200, help="Lookups timed for each kind of lookup.")
+def main(url, rows, lookups):
+    scratch_file = None
+    if url is None:
+        scratch_file = os.path.join(tempfile.gettempdir(), "association_indexes_benchmark.db")
+        if os.path.exists(scratch_file):
+            os.remove(scratch_file)
+        url = f"sqlite:///{scratch_file}"
+    bind = create_engine(url)
+    try:
+        Base.metadata.drop_all(bind)
+        create_old_schema(bind)
+        num_vehicles, num_engineers = fill(bind, rows)
+        assignments_before = count_assignments(bind)
+        before = time_lookups(bind, lookups, num_vehicles, num_engineers)
+
+        start = perf_counter()
+        with bind.begin() as connection:
+            m0001_association_keys.up(connection)
+        migration_seconds = perf_counter() - start
+        assignments_after = count_assignments(bind)
+        after = time_lookups(bind, lookups, num_vehicles, num_engineers)
+
+        print(f"{rows} rows per table on {bind.dialect.name}, migrated in {migration_seconds:.2f} s")
+        print(f"vehicle_engineers rows: {assignments_before} before, {assignments_after} after dropping duplicates")
+        print(f"{'lookup':<25} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+        for name in before:
+            print(f"{name:<25} {before[name]:>10.3f} {after[name]:>10.3f} {before[name] / after[name]:>7.1f}x")
+    finally:
+        Base.metadata.drop_all(bind)
+        bind.dispose()
+        if scratch_file is not None:
+            os.remove(scratch_file)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Count the statements a bulk insert of laptops sends to the database as the number of laptops grows.
+
+The count should stay the same however many laptops are added, each data type is inserted with one
+executemany and the new laptop ids are found without a query per row. Runs in a small scratch database.
+
+    python -m training.benchmarks.bulk_statements --rows 1 --rows 10 --rows 1000
+"""
+import os
+import tempfile
+from datetime import date
+import click
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from training.server.base import Base
+from training.server.config import create_configured_engine
+from training.server.db_utils import BulkUtils
+from training.server.model import Engineer
+
+def fill(bind):
+    session = Session(bind=bind)
+    session.add(Engineer("Engineer", date(1990, 1, 1)))
+    session.commit()
+    session.close()
+
+
+def count_statements(bind, num_laptops):
+    """Statements sent while adding num_laptops laptops in one bulk insert, which is rolled back after."""
+    records = [("laptop", {"model": f"Laptop {i}", "date_loaned": date(2020, 1, 1), "engineer": "Engineer"}) for i in range(num_laptops)]
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    session = Session(bind=bind)
+    event.listen(bind, "before_cursor_execute", count)
+    try:
+        results = BulkUtils().add_records_db(session, records)
+    finally:
+        event.remove(bind, "before_cursor_execute", count)
+        session.rollback()
+        session.close()
+    if results is None or any(result["status"] != "success" for result in results):
+        raise RuntimeError(f"Bulk insert of {num_laptops} laptops failed: {results}")
+    return len(statements)
+
+
+@click.command()
+@click.option("--url", default=None, help="Scratch database to benchmark in, its tables are dropped. Defaults to a temporary SQLite file.")
+@click.option("--rows", type=int, multiple=True, default=[1, 10, 100, 1000], help="Laptops added in one bulk insert, may be given more than once.")
+def main(url, rows):
+    scratch_file = None
+    if url is None:
+        scratch_file = os.path.join(tempfile.gettempdir(), "bulk_statements_benchmark.db")
+        if os.path.exists(scratch_file):
+            os.remove(scratch_file)
+        url = f"sqlite:///{scratch_file}"
+    bind = create_configured_engine({"url": url})
+    try:
+        Base.metadata.drop_all(bind)
+        Base.metadata.create_all(bind)
+        fill(bind)
+
+        print(f"Bulk laptop inserts on {bind.dialect.name}")
+        print(f"{'laptops':>8} {'statements':>11}")
+        counts = []
+        for num_laptops in rows:
+            counts.append(count_statements(bind, num_laptops))
+            print(f"{num_laptops:>8} {counts[-1]:>11}")
+        if len(set(counts)) > 1:
+            raise SystemExit("The statement count grows with the number of laptops")
+    finally:
+        Base.metadata.drop_all(bind)
+        bind.dispose()
+        if scratch_file is not None:
+            os.remove(scratch_file)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import sys
+import socket
+import threading
+import subprocess
+from time import sleep, perf_counter
+from training.sock_utils import FramedConnection
+
+def start_server(port, *server_args, startup_timeout=30):
+    """Start a server process on port with the given command line options and wait until it accepts connections."""
+    server = subprocess.Popen([sys.executable, "-m", "training.server", str(port), *server_args], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+    waited = 0
+    while waited < startup_timeout:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server with options {server_args} exited with code {server.returncode} before accepting connections")
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return server
+        except OSError:
+            sleep(0.2)
+            waited += 0.2
+    stop_server(server)
+    raise RuntimeError(f"Server with options {server_args} did not accept connections within {startup_timeout} seconds")
+
+
+def stop_server(server):
+    # The server shuts down when "enter" is pressed
+    try:
+        server.stdin.write(b"\n")
+        server.stdin.flush()
+        server.wait(timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        server.kill()
+        server.wait()
+
+
+def request(conn, msg):
+    conn.send(msg)
+    return conn.recv()
+
+
+def run_clients(port, num_clients, client_messages):
+    """Run num_clients concurrent clients, each on its own connection, and time them.
+
+    client_messages(client_index) returns the messages that client sends, one round trip at a time.
+    Returns the elapsed seconds and a count of response statuses.
+    """
+    statuses = {}
+    statuses_lock = threading.Lock()
+    message_lists = [client_messages(i) for i in range(num_clients)]
+    conns = [FramedConnection.connect("localhost", port) for _ in range(num_clients)]
+
+    def run_client(conn, messages):
+        for msg in messages:
+            response = request(conn, msg)
+            status = response.get("status") if response else "closed"
+            with statuses_lock:
+                statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=run_client, args=(conn, messages)) for conn, messages in zip(conns, message_lists)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - start
+    for conn in conns:
+        conn.close()
+    return elapsed, statuses
@@ -0,0 +1,126 @@
+"""Time reading whole tables as JSON through ORM objects and to_json against the Core readers.
+
+Fills a scratch database with --rows rows per table, checks both paths give the same JSON, and
+times each path --repeat times: the Core readers once encoding every row, once reusing the
+rows json_cache encoded on an earlier read, and once reading only a few "fields" of each row.
+
+    python -m training.benchmarks.core_reads --rows 100000
+"""
+import os
+import json
+import random
+import tempfile
+from datetime import date
+from time import perf_counter
+import click
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from training.server.base import Base
+from training.server.cache import json_cache
+from training.server.db_utils import VehicleUtils, EngineerUtils, LaptopUtils, ContactDetailsUtils
+from training.server.model import vehicle_engineer_association, Vehicle, Engineer, Laptop, ContactDetails
+
+def fill(bind, rows):
+    num_engineers = max(rows // 5, 1)
+    with bind.begin() as connection:
+        connection.execute(Vehicle.__table__.insert(), [
+            {"model": f"Model {i}", "quantity": i % 7, "in_stock": i % 7 > 0, "price": 20000 + i % 1000, "manufacture_date": date(2020, 1, 1 + i % 28)}
+            for i in range(rows)
+        ])
+        connection.execute(Engineer.__table__.insert(), [
+            {"name": f"Engineer {i}", "birthday": date(1990, 1 + i % 12, 1)} for i in range(num_engineers)
+        ])
+        # Every vehicle has up to three engineers
+        connection.execute(vehicle_engineer_association.insert(), [
+            {"vehicle_id": vehicle_id, "engineer_id": engineer_id}
+            for vehicle_id in range(1, rows + 1)
+            for engineer_id in random.sample(range(1, num_engineers + 1), min(vehicle_id % 4, num_engineers))
+        ])
+        # Some laptops are not loaned to anyone
+        connection.execute(Laptop.__table__.insert(), [
+            {"model": "Laptop", "date_loaned": date(2020, 1, 1), "engineer_id": None if i % 10 == 0 else random.randint(1, num_engineers)}
+            for i in range(rows)
+        ])
+        connection.execute(ContactDetails.__table__.insert(), [
+            {"phone_number": f"{i:012d}", "address": "Address", "engineer_id": random.randint(1, num_engineers)} for i in range(rows)
+        ])
+
+
+# Fields a screen listing each table might ask for, none of them from a related row
+FIELDS = {
+    "vehicles": ["model", "quantity"],
+    "engineers": ["name"],
+    "laptops": ["model"],
+    "contact_details": ["phone_number"]
+}
+
+def time_read(bind, read, repeat):
+    """Best time in milliseconds to read the whole table as (id, JSON bytes) pairs, and the dicts read."""
+    best = None
+    for _ in range(repeat):
+        session = Session(bind=bind, expire_on_commit=False)
+        start = perf_counter()
+        rows = read(session)
+        elapsed = (perf_counter() - start) * 1000
+        session.close()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, [json.loads(encoded) for _, encoded in rows]
+
+
+@click.command()
+@click.option("--url", default=None, help="Scratch database to benchmark in, its tables are dropped. Defaults to a temporary SQLite file.")
+@click.option("--rows", type=int, default=100000, help="Rows in vehicles, laptops and contact_details.")
+@click.option("--repeat", type=int, default=3, help="Times each read is timed, the best time is shown.")
+def main(url, rows, repeat):
+    scratch_file = None
+    if url is None:
+        scratch_file = os.path.join(tempfile.gettempdir(), "core_reads_benchmark.db")
+        if os.path.exists(scratch_file):
+            os.remove(scratch_file)
+        url = f"sqlite:///{scratch_file}"
+    bind = create_engine(url)
+    car_utils, engin_utils, laptop_utils, contact_utils = VehicleUtils(), EngineerUtils(), LaptopUtils(), ContactDetailsUtils()
+    reads = {
+        # table: (ORM read, Core read)
+        "vehicles": (car_utils.read_vehicles_all, car_utils.json_vehicles_all),
+        "engineers": (engin_utils.read_all_engineers, engin_utils.json_engineers_all),
+        "laptops": (laptop_utils.read_all_laptops, laptop_utils.json_laptops_all),
+        "contact_details": (contact_utils.read_all_contact_details, contact_utils.json_contact_details_all)
+    }
+    try:
+        Base.metadata.drop_all(bind)
+        Base.metadata.create_all(bind)
+        fill(bind, rows)
+
+        print(f"{rows} rows per table on {bind.dialect.name}")
+        print(f"{'table':<16} {'ORM ms':>10} {'Core ms':>10} {'speedup':>8} {'cached ms':>10} {'speedup':>8} {'fields ms':>10} {'speedup':>8}")
+        for table, (orm_read, core_read) in reads.items():
+            orm_ms, orm_dicts = time_read(bind, lambda session: [(row.id, json.dumps(row.to_json()).encode('utf-8')) for row in orm_read(session)], repeat)
+            json_cache.resize(0)
+            core_ms, core_dicts = time_read(bind, core_read, repeat)
+            json_cache.resize(rows)
+            # Fill the cache before timing
+            time_read(bind, core_read, 1)
+            cached_ms, cached_dicts = time_read(bind, core_read, repeat)
+            if cached_dicts != core_dicts:
+                raise click.ClickException(f"The cached JSON of {table} differs from the JSON encoded again")
+            fields = FIELDS[table]
+            fields_ms, fields_dicts = time_read(bind, lambda session: core_read(session, fields=fields), repeat)
+            # Without the engineer names the database may return the rows in another order
+            if sorted(map(json.dumps, fields_dicts)) != sorted(json.dumps({field: row[field] for field in fields}) for row in core_dicts):
+                raise click.ClickException(f"Reading the fields {fields} of {table} gave different values than reading whole rows")
+            # Neither read orders a vehicle's engineers, so compare them as sets
+            if table == "vehicles":
+                orm_dicts = [{**car, "engineers": sorted(car["engineers"])} for car in orm_dicts]
+                core_dicts = [{**car, "engineers": sorted(car["engineers"])} for car in core_dicts]
+            if sorted(orm_dicts, key=lambda row: row["id"]) != sorted(core_dicts, key=lambda row: row["id"]):
+                raise click.ClickException(f"The ORM and Core reads of {table} gave different results")
+            print(f"{table:<16} {orm_ms:>10.1f} {core_ms:>10.1f} {orm_ms / core_ms:>7.1f}x {cached_ms:>10.1f} {orm_ms / cached_ms:>7.1f}x {fields_ms:>10.1f} {orm_ms / fields_ms:>7.1f}x")
+    finally:
+        Base.metadata.drop_all(bind)
+        bind.dispose()
+        if scratch_file is not None:
+            os.remove(scratch_file)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Time the per-call overhead of building a lookup query on every call against running a statement built once.
+
+Both forms hit the same compiled statement cache, so the difference is the Python time spent constructing the
+query and generating its cache key. Lookups run against a small scratch database so the query itself is cheap.
+
+    python -m training.benchmarks.statement_cache --calls 5000
+"""
+import os
+import tempfile
+from datetime import date
+from time import perf_counter
+import click
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, selectinload, joinedload
+from training.server import statements
+from training.server.base import Base
+from training.server.model import Vehicle, Engineer, Laptop, ContactDetails
+
+def fill(bind):
+    session = Session(bind=bind)
+    engineer = Engineer("Engineer", date(1990, 1, 1))
+    session.add_all([
+        engineer,
+        Vehicle("Model", 1, 20000, date(2020, 1, 1)),
+        Laptop("Laptop", date(2020, 1, 1), engineer),
+        ContactDetails("000000000000", "Address", engineer)
+    ])
+    session.commit()
+    session.close()
+
+
+# lookup: (query built per call, statement built once and its parameters)
+LOOKUPS = {
+    "engineer by name": (
+        lambda session: session.query(Engineer).filter(Engineer.name == "Engineer").first(),
+        lambda session: session.execute(statements.engineer_by_name, {"name": "Engineer"}).scalars().first()
+    ),
+    "vehicles by model": (
+        lambda session: session.query(Vehicle).options(selectinload(Vehicle.engineers)).filter(Vehicle.model == "Model").all(),
+        lambda session: session.execute(statements.vehicles_by_model, {"model": "Model"}).scalars().all()
+    ),
+    "vehicle by id": (
+        lambda session: session.query(Vehicle).options(selectinload(Vehicle.engineers)).get(1),
+        lambda session: session.execute(statements.vehicle_by_id, {"id": 1}).scalars().first()
+    ),
+    "laptop by owner": (
+        lambda session: session.query(Laptop).options(joinedload(Laptop.engineer)).filter(Laptop.engineer_id == 1).first(),
+        lambda session: session.execute(statements.laptop_by_owner, {"engineer_id": 1}).scalars().first()
+    ),
+    "contacts by engineer_id": (
+        lambda session: session.query(ContactDetails).options(joinedload(ContactDetails.engineer)).filter(ContactDetails.engineer_id == 1).all(),
+        lambda session: session.execute(statements.contact_details_by_engineer_id, {"engineer_id": 1}).scalars().all()
+    )
+}
+
+def time_lookup(bind, lookup, calls):
+    """Average microseconds per call."""
+    session = Session(bind=bind)
+    lookup(session)
+    start = perf_counter()
+    for _ in range(calls):
+        lookup(session)
+        # Otherwise get() would answer from the identity map without a query
+        session.expunge_all()
+    elapsed = perf_counter() - start
+    session.close()
+    return elapsed * 1000000 / calls
+
+
+@click.command()
+@click.option("--url", default=None, help="Scratch database to benchmark in, its tables are dropped. Defaults to a temporary SQLite file.")
+@click.option("--calls", type=int, default=5000, help="Calls timed for each lookup.")
+def main(url, calls):
+    scratch_file = None
+    if url is None:
+        scratch_file = os.path.join(tempfile.gettempdir(), "statement_cache_benchmark.db")
+        if os.path.exists(scratch_file):
+            os.remove(scratch_file)
+        url = f"sqlite:///{scratch_file}"
+    bind = create_engine(url)
+    try:
+        Base.metadata.drop_all(bind)
+        Base.metadata.create_all(bind)
+        fill(bind)
+
+        print(f"{calls} calls per lookup on {bind.dialect.name}")
+        print(f"{'lookup':<25} {'per call us':>12} {'prebuilt us':>12} {'speedup':>8}")
+        for name, (per_call, prebuilt) in LOOKUPS.items():
+            before = time_lookup(bind, per_call, calls)
+            after = time_lookup(bind, prebuilt, calls)
+            print(f"{name:<25} {before:>12.1f} {after:>12.1f} {before / after:>7.2f}x")
+    finally:
+        Base.metadata.drop_all(bind)
+        bind.dispose()
+        if scratch_file is not None:
+            os.remove(scratch_file)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Compare concurrent write throughput with server table locks against database isolation.
+
+Starts a server for each lock mode, then has concurrent clients update vehicle quantities.
+--rows sets how many vehicles the clients spread their updates over, fewer rows means more conflicts.
+
+    python -m training.benchmarks.write_throughput --clients 16 --requests 200
+"""
+import click
+from training.benchmarks.common import start_server, stop_server, request, run_clients
+from training.server.transactions import ISOLATION_LEVELS
+from training.sock_utils import FramedConnection
+
+def read_vehicle_ids(port):
+    conn = FramedConnection.connect("localhost", port)
+    try:
+        response = request(conn, {"data_type": "vehicle", "action": "read", "model": "all"})
+    finally:
+        conn.close()
+    return [car["id"] for car in response["vehicles"]]
+
+
+@click.command()
+@click.option("--port", type=int, default=6500)
+@click.option("--clients", type=int, default=16, help="Concurrent client connections.")
+@click.option("--requests", type=int, default=200, help="Updates sent by each client.")
+@click.option("--rows", type=int, default=None, help="Vehicles the updates are spread over. Defaults to every vehicle.")
+@click.option("--isolation-level", type=click.Choice(ISOLATION_LEVELS), default=None, help="Isolation level for the database lock mode.")
+def main(port, clients, requests, rows, isolation_level):
+    results = []
+    for lock_mode in ["table", "database"]:
+        server_args = ["--lock-mode", lock_mode, "--threads", str(clients)]
+        if lock_mode == "database" and isolation_level is not None:
+            server_args += ["--isolation-level", isolation_level]
+        server = start_server(port, *server_args)
+        try:
+            vehicle_ids = read_vehicle_ids(port)[:rows]
+
+            def client_messages(client_index):
+                return [
+                    {
+                        "data_type": "vehicle",
+                        "action": "update",
+                        "id": vehicle_ids[(client_index + i) % len(vehicle_ids)],
+                        "quantity": i
+                    }
+                    for i in range(requests)
+                ]
+
+            elapsed, statuses = run_clients(port, clients, client_messages)
+        finally:
+            stop_server(server)
+        results.append((lock_mode, elapsed, statuses))
+
+    print(f"{clients} clients x {requests} updates over {len(vehicle_ids)} vehicles")
+    print(f"{'lock mode':<10} {'seconds':>8} {'writes/s':>10}  statuses")
+    for lock_mode, elapsed, statuses in results:
+        writes = statuses.get("success", 0)
+        print(f"{lock_mode:<10} {elapsed:>8.2f} {writes / elapsed:>10.1f}  {statuses}")
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,14 @@ from math import inf
 from datetime import date
 from os import read, replace
 from random import seed
+from itertools import count
 from sqlalchemy import engine
 
 from sqlalchemy.orm.exc import UnmappedInstanceError
 from sqlalchemy.sql.expression import delete, insert, update
 from sqlalchemy.sql.functions import ReturnTypeFromArgs
 from training.client.choice_funcs import get_digit_choice, get_yes_no_choice, get_day, get_month, get_year
-from training.sock_utils import send_message, decode_message_chunks, get_data_from_connection
+from training.sock_utils import send_message, decode_message_chunks, get_data_from_connection, FramedConnection
 from docx import Document
 import json
 import logging
@@ -55,20 +56,143 @@ def dump_to_docx(object, out_file_name):
 
 class Client:
 
-    def __init__(self, server_port, listen_port):
+    def __init__(self, server_port, listen_port=None):
         self.server_port = server_port
         self.port = listen_port
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind(("localhost", self.port))
-        self.sock.listen()
-        self.sock.settimeout(1)
+        self.sock = None
+        if self.port is not None:
+            # Legacy reply mode: the server dials back to this listen port with every response
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.bind(("localhost", self.port))
+            self.sock.listen()
+            self.sock.settimeout(1)
         logging.basicConfig(filename="client.log", level=logging.DEBUG, format="%(asctime)s - %(levelname)s: %(message)s")
+        # Requests share one persistent framed connection instead of a new connection per message
+        self.conn = None
+        # Pipelined requests are tagged with a request_id, responses that arrive early wait here
+        self.request_ids = count(1)
+        self.unclaimed_responses = {}
 
     def __del__(self):
-        self.sock.close()
+        if self.conn is not None:
+            self.conn.close()
+        if self.sock is not None:
+            self.sock.close()
+
+    def connect_to_server(self):
+        self.conn = FramedConnection.connect("localhost", self.server_port)
+        logging.info(f"Opened persistent connection to server port {self.server_port}")
+
+    def send_to_server(self, msg):
+        if self.port is not None:
+            msg = {**msg, "port": self.port}
+        if self.conn is None:
+            self.connect_to_server()
+        try:
+            self.conn.send(msg)
+        except OSError:
+            # The server may have dropped an idle connection, reconnect once and retry
+            logging.info("Persistent connection to the server was lost. Reconnecting.")
+            self.conn.close()
+            self.connect_to_server()
+            self.conn.send(msg)
+
+    def send_request(self, msg):
+        """Send a request without waiting for its response. Returns the request_id to collect the response with."""
+        request_id = next(self.request_ids)
+        self.send_to_server({**msg, "request_id": request_id})
+        return request_id
+
+    def get_response(self, request_id):
+        """Wait for the response to a request sent with send_request, stashing responses to other requests."""
+        while request_id not in self.unclaimed_responses:
+            server_response = self.get_server_response()
+            if "request_id" not in server_response:
+                # connection errors are not tagged with a request_id
+                return server_response
+            self.unclaimed_responses[server_response["request_id"]] = server_response
+        return self.unclaimed_responses.pop(request_id)
+
+    def pipeline(self, msgs):
+        """Send every request before waiting on any response. Returns the responses in request order."""
+        if self.sock is not None:
+            # The legacy reply-to-port mode has no request ids to match responses with
+            responses = []
+            for msg in msgs:
+                self.send_to_server(msg)
+                responses.append(self.get_server_response())
+            return responses
+        request_ids = [self.send_request(msg) for msg in msgs]
+        return [self.get_response(request_id) for request_id in request_ids]
+
+    def stream_read(self, read_msg, entry, chunk_size=None):
+        """Read every row of a read "all" job as it streams in. Yields rows, one frame's worth at a time
+        in memory, and stops early after an error response."""
+        stream_msg = {**read_msg, "stream": True}
+        if chunk_size is not None:
+            stream_msg["chunk_size"] = chunk_size
+        self.send_to_server(stream_msg)
+        more = True
+        while more:
+            server_response = self.get_server_response()
+            if not self.check_server_status(server_response):
+                return
+            yield from server_response.get(entry, [])
+            more = server_response.get("more", False)
+
+    def subscribe(self, data_types=None, after_seq=None):
+        """Yield the change events the server pushes, and "resync" messages telling to read the tables again.
+        Events arrive on a connection of their own, which is reopened after a disconnect to resume after the
+        last event seen. Stops after an error response."""
+        subscribe_msg = {"action": "subscribe"}
+        if data_types is not None:
+            subscribe_msg["data_types"] = data_types
+        conn = None
+        try:
+            while True:
+                if conn is None:
+                    conn = FramedConnection.connect("localhost", self.server_port)
+                    conn.send(subscribe_msg if after_seq is None else {**subscribe_msg, "after_seq": after_seq})
+                try:
+                    server_response = conn.recv()
+                except (OSError, JSONDecodeError, ValueError) as err:
+                    server_response = None
+                    logging.error(f"Failed to read a change event from the server: {err}")
+                if server_response is None:
+                    logging.info("Change feed connection to the server was lost. Resubscribing.")
+                    conn.close()
+                    conn = None
+                    continue
+                if not self.check_server_status(server_response):
+                    return
+                after_seq = server_response["seq"]
+                if server_response["status"] != "subscribed":
+                    yield server_response
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def respond_to_server(self, server_port, msg):
+        """Answer a server prompt, on the port it named (legacy mode) or on the persistent connection."""
+        if server_port is not None:
+            send_message("localhost", server_port, msg)
+        else:
+            self.conn.send(msg)
 
     def get_server_response(self):
+        if self.sock is None:
+            try:
+                server_response = self.conn.recv()
+            except (OSError, JSONDecodeError, ValueError) as err:
+                server_response = None
+                logging.error(f"Failed to read a response from the server: {err}")
+            if server_response is None:
+                self.conn.close()
+                self.conn = None
+                return {"status": "error", "text": "Server closed the connection before responding."}
+            return server_response
+
         server_response = None
         while server_response is None:
             message_chunks = get_data_from_connection(self.sock)
@@ -94,7 +218,8 @@ class Client:
             print(error_msg)
             return False
 
-        if status == "error":
+        if status in ["error", "busy"]:
+            # A busy server turned the job away without running it
             error_msg = server_response["text"]
             logging.error(error_msg)
             print(error_msg)
@@ -120,7 +245,6 @@ class Client:
         # Send insert message to the server
         logging.info(f"Asking server to add new vehicle {model} manufactured on {manufacture_date} to the database.")
         insert_msg = {
-            "port": self.port,
             "action": "add",
             "data_type": "vehicle",
             "model": model,
@@ -130,7 +254,7 @@ class Client:
             "manufacture_month": month,
             "manufacture_date": day
         }
-        send_message("localhost", self.server_port, insert_msg)
+        self.send_to_server(insert_msg)
 
         # Wait for server response
         server_response = self.get_server_response()
@@ -147,7 +271,7 @@ class Client:
             return
 
         # Else: insert was successful
-        new_server_port = server_response["port"]
+        new_server_port = server_response.get("port")
         # Added a new vehicle, prompt user to assign engineers to the vehicle
         success_msg = f"Successfully added new vehicle!\nModel: {model}\nQuantity: {quantity}\nPrice: {price}\nManufacture Date: {manufacture_date}"
         print(success_msg)
@@ -163,7 +287,7 @@ class Client:
                     "response": "y",
                     "engineers": engineer_names
                 }
-                send_message("localhost", new_server_port, assign_msg)
+                self.respond_to_server(new_server_port, assign_msg)
 
                 server_response = self.get_server_response()
                 status = self.check_server_status(server_response)
@@ -180,7 +304,7 @@ class Client:
                 assign_msg = {
                     "response": "n"
                 }
-                send_message("localhost", new_server_port, assign_msg)
+                self.respond_to_server(new_server_port, assign_msg)
                 logging.info(f"User skipped assigning any engineers to new vehicle {model} manufactured on {manufacture_date}")
 
     # Add an engineer to the DB
@@ -197,13 +321,12 @@ class Client:
         insert_msg = {
             "data_type": "engineer",
             "action": "add",
-            "port": self.port,
             "name": engin_name,
             "birth_year": birth_year,
             "birth_month": birth_month,
             "birth_date": birth_day
         }
-        send_message("localhost", self.server_port, insert_msg)
+        self.send_to_server(insert_msg)
 
         server_response = self.get_server_response()
 
@@ -212,13 +335,8 @@ class Client:
         if not status:
             return None
 
-        try:
-            new_server_port = server_response["port"]
-        except:
-            no_port = "Server response did not include entry \"port\" to let the client know where to send yes/no response."
-            logging.error(no_port)
-            print(no_port)
-            return None
+        # Only set when the server is answering in the legacy reply-to-port mode
+        new_server_port = server_response.get("port")
 
         success_msg = f"Successfully added new engineer {engin_name} to the database!"
         logging.info(success_msg)
@@ -234,7 +352,7 @@ class Client:
                     "response": "y",
                     "vehicles": vehicle_models
                 }
-                send_message("localhost", new_server_port, assign_msg)
+                self.respond_to_server(new_server_port, assign_msg)
 
                 server_response = self.get_server_response()
                 status = self.check_server_status(server_response)
@@ -253,7 +371,7 @@ class Client:
                     "response" : "n"
                 }
                 logging.info(f"User skipped assigning engineer {engin_name} to any vehicles.")
-                send_message("localhost", new_server_port, assign_msg)
+                self.respond_to_server(new_server_port, assign_msg)
 
     # Add a laptop to the DB and loan to an engineer if desired
     def add_laptop(self):
@@ -268,14 +386,13 @@ class Client:
         insert_msg = {
             "data_type": "laptop",
             "action": "add",
-            "port": self.port,
             "model": model,
             "loan_year": year_loaned,
             "loan_month": month_loaned,
             "loan_date": day_loaned,
             "engineer": engin_name
         }
-        send_message("localhost", self.server_port, insert_msg)
+        self.send_to_server(insert_msg)
 
         success = False
         while not success:
@@ -294,14 +411,8 @@ class Client:
                 print(success_msg)
                 return
 
-            try:
-                new_server_port = server_response["port"]
-            except:
-                error_msg = "Server response has no entry for \"port\" to let the client know where to send the response to."
-                print(error_msg)
-                logging.error(error_msg)
-                return
-            
+            new_server_port = server_response.get("port")
+
             if status == "no_engineer":
                 logging.info(f"Engineer {engin_name} did not exist in the database.")
                 print(f"Engineer {engin_name} did not exist in the database.")
@@ -309,7 +420,7 @@ class Client:
                 response_msg = {
                     "response": abort_laptop
                 }
-                send_message("localhost", new_server_port, response_msg)
+                self.respond_to_server(new_server_port, response_msg)
                 if abort_laptop == 'n':
                     logging.info("Client chose to abort adding the laptop without loaning it to an existing engineer.")
                     return
@@ -324,7 +435,7 @@ class Client:
                 response_msg = {
                     "response": replace_laptop
                 }
-                send_message("localhost", new_server_port, response_msg)
+                self.respond_to_server(new_server_port, response_msg)
                 if replace_laptop == 'n':
                     logging.info(f"Client chose to abort adding the laptop as to not replace {engin_name}'s existing laptop")
                     return
@@ -340,12 +451,11 @@ class Client:
         insert_msg = {
             "data_type": "contact_details",
             "action": "add",
-            "port": self.port,
             "phone_number": phone_number,
             "address": address,
             "engineer": engin_name
         }
-        send_message("localhost", self.server_port, insert_msg)
+        self.send_to_server(insert_msg)
 
         server_response = self.get_server_response()
 
@@ -372,10 +482,9 @@ class Client:
         delete_msg = {
             "data_type": "engineer",
             "action": "delete",
-            "port": self.port,
             "name": engin_name
         }
-        send_message("localhost", self.server_port, delete_msg)
+        self.send_to_server(delete_msg)
 
         server_response = self.get_server_response()
 
@@ -401,10 +510,9 @@ class Client:
         delete_msg = {
             "data_type": "vehicle",
             "action": "delete",
-            "port": self.port,
             "model": model
         }
-        send_message("localhost", self.server_port, delete_msg)
+        self.send_to_server(delete_msg)
 
         server_response = self.get_server_response()
 
@@ -424,7 +532,6 @@ class Client:
         delete_msg = {
             "data_type": "laptop",
             "action": "delete",
-            "port": self.port,
             "engineer": engin_name
         }
         if engin_name == "":
@@ -432,7 +539,7 @@ class Client:
                                    "Invalid Laptop ID. Enter a number > 0", 1, inf)
             delete_msg["id"] = id
 
-        send_message("localhost", self.server_port, delete_msg)
+        self.send_to_server(delete_msg)
 
         server_response = self.get_server_response()
 
@@ -459,7 +566,6 @@ class Client:
         delete_msg = {
             "data_type": "contact_details",
             "action": "delete",
-            "port": self.port,
             "engineer": engin_name
         }
         if engin_name == "":
@@ -467,7 +573,7 @@ class Client:
                                    "Invalid Contact Details ID. Enter a number > 0", 1, inf)
             delete_msg["id"] = id
 
-        send_message("localhost", self.server_port, delete_msg)
+        self.send_to_server(delete_msg)
 
         server_response = self.get_server_response()
 
@@ -527,7 +633,6 @@ class Client:
         read_msg = {
             "data_type": "vehicle",
             "action": "read",
-            "port": self.port,
             "model": model
         }
         if model == "":
@@ -538,7 +643,7 @@ class Client:
         else:
             logging.info(f"Asking the server to read info for vehicles of model {model}")
 
-        send_message("localhost", self.server_port, read_msg)
+        self.send_to_server(read_msg)
 
         server_response = self.get_server_response()
 
@@ -574,7 +679,6 @@ class Client:
         read_msg = {
             "data_type": "engineer",
             "action": "read",
-            "port": self.port,
             "name": name
         }
         if name == "":
@@ -585,7 +689,7 @@ class Client:
         else:
             logging.info(f"Reading info for engineer named {name}")
 
-        send_message("localhost", self.server_port, read_msg)
+        self.send_to_server(read_msg)
 
         server_response = self.get_server_response()
 
@@ -619,7 +723,6 @@ class Client:
         read_msg = {
             "data_type": "vehicle_engineers",
             "action": "read",
-            "port": self.port
         }
         read_vehicles = get_yes_no_choice("Read vehicles by engineer name? Enter \"N\" to read engineers by vehicle model. (Y/N):")
         if read_vehicles == 'y':
@@ -632,7 +735,7 @@ class Client:
             logging.info(f"Asking server to read engineers that worked on model {model} vehicles.")
             read_msg["model"] = model
         
-        send_message("localhost", self.server_port, read_msg)
+        self.send_to_server(read_msg)
 
         server_response = self.get_server_response()
 
@@ -687,7 +790,6 @@ class Client:
         read_msg = {
             "data_type": "laptop",
             "action": "read",
-            "port": self.port
         }
         if read_all == 'y':
             logging.info("Asking server to read info for all laptops")
@@ -706,7 +808,7 @@ class Client:
                 read_msg["model"] = ""
                 read_msg["engineer"] = engin_name
 
-        send_message("localhost", self.server_port, read_msg)
+        self.send_to_server(read_msg)
         
         server_response = self.get_server_response()
 
@@ -742,7 +844,6 @@ class Client:
         read_msg = {
             "data_type": "contact_details",
             "action": "read",
-            "port": self.port,
             "engineer": name
         }
         
@@ -755,7 +856,7 @@ class Client:
         else:
             logging.info(f"Asking server to read info for contact details of engineer {name}")
         
-        send_message("localhost", self.server_port, read_msg)
+        self.send_to_server(read_msg)
 
         server_response = self.get_server_response()
 
@@ -788,7 +889,6 @@ class Client:
         update_msg = {
             "data_type": "vehicle",
             "action": "update",
-            "port": self.port,
             "id": vehicle_id
         }
         model = input(f"Enter the new model for vehicle ID {vehicle_id}\n(Leave blank to keep model the same):")
@@ -836,7 +936,7 @@ class Client:
         if engineer_names:
             update_msg["engineers"] = engineer_names
         
-        send_message("localhost", self.server_port, update_msg)
+        self.send_to_server(update_msg)
 
         server_response = self.get_server_response()
 
@@ -867,7 +967,6 @@ class Client:
         update_msg = {
             "data_type": "engineer",
             "action": "update",
-            "port": self.port,
             "id": engin_id
         }
 
@@ -906,7 +1005,7 @@ class Client:
         if vehicles:
             update_msg["vehicles"] = vehicles
         
-        send_message("localhost", self.server_port, update_msg)
+        self.send_to_server(update_msg)
 
         server_response = self.get_server_response()
 
@@ -962,7 +1061,6 @@ class Client:
         update_msg = {
             "data_type": "laptop",
             "action": "update",
-            "port": self.port,
             "id": laptop_id
         }
 
@@ -999,7 +1097,7 @@ class Client:
         elif engineer != "":
             update_msg["engineer"] = engineer
         
-        send_message("localhost", self.server_port, update_msg)
+        self.send_to_server(update_msg)
 
         server_response = self.get_server_response()
 
@@ -1036,9 +1134,8 @@ class Client:
             if isinstance(json_data, dict):
                 self.parse_json_object_and_insert(json_data)
             else:
-                # JSON array
-                for json_object in json_data:
-                    self.parse_json_object_and_insert(json_object)
+                # JSON array, inserted with one request instead of one per object
+                self.bulk_insert(json_data)
         except JSONDecodeError:
             error_msg = f"JSONDecodeError: There was a problem reading the JSON object in {file_name} ; JSON object likely not encoded properly."
             print(error_msg)
@@ -1048,6 +1145,38 @@ class Client:
             print(error_msg)
             logging.error(error_msg)
 
+    def bulk_insert(self, json_objects):
+        logging.info(f"Attempting to bulk insert {len(json_objects)} JSON objects into the database.")
+        bulk_msg = {
+            "action": "bulk_add",
+            "records": json_objects
+        }
+        self.send_to_server(bulk_msg)
+
+        server_response = self.get_server_response()
+        status = self.check_server_status(server_response)
+        if not status:
+            return
+
+        try:
+            results = server_response["results"]
+        except:
+            error_msg = "Server bulk insert response is missing entry \"results\""
+            logging.error(error_msg)
+            print(error_msg)
+            return
+
+        for json_object, result in zip(json_objects, results):
+            if result["status"] == "error":
+                error_msg = f"Aborted adding {json_object} to the database: {result['text']}"
+                print(error_msg)
+                logging.error(error_msg)
+        added = sum(1 for result in results if result["status"] == "success")
+        updated = sum(1 for result in results if result["status"] == "updated")
+        summary_msg = f"Added {added} and updated {updated} of {len(results)} JSON objects in the database."
+        print(summary_msg)
+        logging.info(summary_msg)
+
     def parse_json_object_and_insert(self, json_object):
         logging.info(f"Attempting to parse JSON object and insert into the database.")
         
@@ -1055,7 +1184,6 @@ class Client:
         insert_msg = {
             "data_type": data_type,
             "action": "add",
-            "port": self.port
         }
         if data_type is None:
             error_msg = "Error: no \"data_type\" entry found in JSON object." + \
@@ -1063,7 +1191,7 @@ class Client:
             print(error_msg)
             logging.error(error_msg)
         
-        send_message("localhost", self.server_port, {**insert_msg, **json_object})
+        self.send_to_server({**insert_msg, **json_object})
 
         server_response = self.get_server_response()
         status = self.check_server_status(server_response)
@@ -1080,7 +1208,6 @@ class Client:
                 manufacture_year = server_response["manufacture_year"]
                 manufacture_month = server_response["manufacture_month"]
                 manufacture_date = server_response["manufacture_date"]
-                new_server_port = server_response["port"]
             except:
                 error_msg = "Server JSON vehicle insert job is missing one of [\"model\", \"quantity\", \"price\", \"manufacture_year\", \"manufacture_month\", \"manufacture_date\"]"
                 logging.error(error_msg)
@@ -1093,10 +1220,11 @@ class Client:
             print(success_msg)
             logging.info(success_msg)
 
+            new_server_port = server_response.get("port")
             assign_engins_response = {
                 "response": "n"
             }
-            send_message("localhost", new_server_port, assign_engins_response)
+            self.respond_to_server(new_server_port, assign_engins_response)
 
         elif data_type == "engineer":
             logging.info("Attempting to add an engineer to the database from JSON object.")
@@ -1106,7 +1234,6 @@ class Client:
                 birth_year = server_response["birth_year"]
                 birth_month = server_response["birth_month"]
                 birth_date = server_response["birth_date"]
-                new_server_port = server_response["port"]
             except:
                 error_msg = "Server JSON engineer insert job is missing one of [\"name\", \"birth_year\", \"birth_month\", \"birth_date\"]"
                 print(error_msg)
@@ -1118,25 +1245,20 @@ class Client:
             print(success_msg)
             logging.info(success_msg)
                 
+            new_server_port = server_response.get("port")
             assign_vehicles_response = {
                 "response": "n"
             }
-            send_message("localhost", new_server_port, assign_vehicles_response)
+            self.respond_to_server(new_server_port, assign_vehicles_response)
 
         elif data_type == "laptop":
             logging.info("Attempting to add a laptop to the database from JSON object")
-            if status == 'no_engineer' or status == 'prev_laptop':
-                try:
-                    new_server_port = server_response["port"]
-                except:
-                    error_msg = "Server JSON laptop insert requires client permission to proceed, but did not include an entry \"port\""
-                    logging.error(error_msg)
-                    print(error_msg)
-                    return
+            if status == 'no_engineer' or status == 'previous_laptop':
+                new_server_port = server_response.get("port")
                 add_anyways = {
                     "response": "y"
                 }
-                send_message("localhost", new_server_port, add_anyways)
+                self.respond_to_server(new_server_port, add_anyways)
                 server_response = self.get_server_response()
                 status = self.check_server_status(server_response)
                 if not status:
@@ -1218,10 +1340,11 @@ class Client:
         if table_choice == 6:
             msg = {
                 "action": "reset",
-                "port": self.port
             }
-            send_message("localhost", self.server_port, msg)
-            print("\nDatabase reset.\n")
+            self.send_to_server(msg)
+            # The server answers once the reset is done
+            if self.check_server_status(self.get_server_response()):
+                print("\nDatabase reset.\n")
             return True
 
         if table_choice == 5:
@@ -1260,10 +1383,11 @@ class Client:
 
 @click.command()
 @click.argument("server_port", nargs=1, type=int)
-@click.argument("client_port", nargs=1, type=int)
+@click.argument("client_port", nargs=1, type=int, required=False)
 def main(server_port, client_port):
     print(f"Server port: {server_port}")
-    print(f"Client port: {client_port}")
+    if client_port is not None:
+        print(f"Client port: {client_port}")
     client = Client(server_port, client_port)
     run_again = client.display_interface()
     while run_again:
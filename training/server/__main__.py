@@ -3,52 +3,95 @@ import threading
 import logging
 from types import new_class
 import click
+import signal
 from time import sleep
+from contextlib import nullcontext
 from sys import stdin
 from select import select
 from sqlalchemy.exc import IntegrityError
-from readerwriterlock import rwlock
+from sqlalchemy.orm import Session as SessionClass
 from sqlalchemy.orm.exc import UnmappedInstanceError
-from training.server.db_utils import VehicleUtils, EngineerUtils, LaptopUtils, ContactDetailsUtils
-from training.sock_utils import send_message, decode_message_chunks, get_data_from_connection
-from training.server.base import Session
+from training.server.db_utils import VehicleUtils, EngineerUtils, LaptopUtils, ContactDetailsUtils, BulkUtils, JSON_FIELDS
+from training.sock_utils import decode_message_chunks, bind_listen_socket, accept_connection, read_until_closed, is_framed_connection, FramedConnection, EncodedList
+from training.server.base import Session, engine, replica_engines
+from training.server.channels import PortChannel, ConnectionChannel, PendingResponses, DeferredChannel, VersionedChannel, PromptTimeout
+from training.server.job_pool import JobPool
+from training.server.locks import LockManager, lock_requests
+from training.server.transactions import is_retryable, ISOLATION_LEVELS
 from training.server.reset import reset_db
+from training.server.replicas import ReplicaRouter, STRATEGIES
+from training.server.cache import read_cache, json_cache
+from training.server.versions import read_table_version, READ_TABLES
+from training.server.feed import ChangeFeed, DATA_TYPES
 from json import JSONDecodeError
-from random import randint
 from datetime import date
 
+# Rows per frame of a streamed read
+STREAM_CHUNK_SIZE = 500
+
+# Times a job that runs as one transaction is run before a conflict with other jobs is reported
+JOB_ATTEMPTS = 3
+# Seconds to wait before running a job again, times the attempts so far
+JOB_RETRY_BACKOFF = 0.05
+
 class Server:
     
-    def __init__(self, listen_port, handle_jobs_multithreaded=False):
+    def __init__(self, listen_port, handle_jobs_multithreaded=False, worker_threads=16, queue_size=64, sock=None, lock_manager=None, interactive=True, lock_mode="table", isolation_level=None, transaction_scope=None, replica_strategy="round-robin", read_your_writes=5.0, cache_size=1024, json_cache_size=50000, feed_poll_interval=1.0, feed_retention=10000, feed_gap_timeout=5.0, prompt_timeout=60.0):
         logging.basicConfig(filename="server.log", level=logging.DEBUG, format="%(asctime)s - %(levelname)s: %(message)s")
         self.shutdown = False
         self.singlethreaded = handle_jobs_multithreaded
-        self.used_ports = {listen_port}
-        self.PORT_MIN = 1024
-        self.PORT_MAX = 49151
         self.car_utils = VehicleUtils()
         self.engin_utils = EngineerUtils()
         self.laptop_utils = LaptopUtils()
         self.contact_utils = ContactDetailsUtils()
+        self.bulk_utils = BulkUtils()
         self.port = listen_port
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind(("localhost", self.port))
-        logging.info(f"Bound server socket to {self.port}")
-        self.sock.listen()
-        self.sock.settimeout(1)
+        if sock is None:
+            self.sock = bind_listen_socket("localhost", self.port)
+            logging.info(f"Bound server socket to {self.port}")
+        else:
+            # Worker process accepting on a socket its parent already bound
+            self.sock = sock
         
 
         logging.info("Server started")
-        self.db_lock = rwlock.RWLockFairD()
+        self.lock_mode = lock_mode
+        # Left to the database, isolation comes with running each job as one transaction by default
+        self.transaction_scope = transaction_scope or ("job" if lock_mode == "database" else "call")
+        # A job waiting on a client that never answers its prompt would hold a worker thread for good
+        self.prompt_timeout = prompt_timeout
+        # Worker processes share locks that work across processes, a lone server only needs thread locks
+        self.lock_manager = LockManager() if lock_manager is None else lock_manager
+        self.session_bind = engine if isolation_level is None else engine.execution_options(isolation_level=isolation_level)
+        logging.info(f"Using {lock_mode} locking and one transaction per {self.transaction_scope} with isolation level {isolation_level or 'default'}")
+        self.router = None
+        if replica_engines:
+            replicas = [replica if isolation_level is None else replica.execution_options(isolation_level=isolation_level) for replica in replica_engines]
+            self.router = ReplicaRouter(self.session_bind, replicas, replica_strategy, read_your_writes)
+            logging.info(f"Sending read jobs to {len(replicas)} read replicas by {replica_strategy}")
+        read_cache.resize(cache_size)
+        json_cache.resize(json_cache_size)
+        logging.info(f"Caching up to {cache_size} lookups and {json_cache_size} rows encoded as JSON")
+        self.single_thread_lock = threading.Lock()
+        # Change events are always read from the primary, the replicas may not have them yet
+        self.change_feed = ChangeFeed(lambda: Session(bind=self.session_bind), self.call_with_rlock, feed_poll_interval, feed_retention, feed_gap_timeout)
+        self.change_feed.start()
+        self.job_pool = JobPool(worker_threads, queue_size)
+        logging.info(f"Started {worker_threads} job worker threads with room for {queue_size} queued jobs")
         self.listen_thread = threading.Thread(target=self.listen_for_jobs, args=(handle_jobs_multithreaded,))
         self.listen_thread.daemon = True
         self.listen_thread.start()
         logging.info("Listen thread started")
-        self.shutdown_thread = threading.Thread(target=self.user_shutdown, args=())
-        self.shutdown_thread.start()
-        logging.info("User Shutdown Input thread started")
-        self.shutdown_thread.join()
+        if interactive:
+            self.shutdown_thread = threading.Thread(target=self.user_shutdown, args=())
+            self.shutdown_thread.start()
+            logging.info("User Shutdown Input thread started")
+            self.shutdown_thread.join()
+        else:
+            self.wait_for_shutdown_signal()
+        self.job_pool.shutdown()
+        self.change_feed.stop()
+        logging.info(f"Read cache: {read_cache.stats()}, JSON cache: {json_cache.stats()}")
 
         logging.info("Server shutdown")
 
@@ -56,74 +99,96 @@ class Server:
         print("Server destructor called")
         self.sock.close()
 
-    def get_unused_port(self):
-        port = randint(self.PORT_MIN, self.PORT_MAX)
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        taken = True
-        while taken:
-            port = randint(self.PORT_MIN, self.PORT_MAX)
-            try:
-                s.bind(("localhost", port))
-                s.listen()
-                taken = False
-            except:
-                continue
-        s.close()
-        self.used_ports.add(port)
-        return port
-
-    def get_client_response(self, listen_sock):
-        client_response = None
-        while client_response is None:
-            message_chunks = get_data_from_connection(listen_sock)
-
-            if not message_chunks:
-                continue
-
-            try:
-                message_dict = decode_message_chunks(message_chunks)
-                client_response = message_dict
-                break
-            except JSONDecodeError:
-                continue
-        return client_response
-
-    def send_error_msg(self, error_msg, client_port):
+    def send_error_msg(self, error_msg, client):
         msg = {
             "status": "error",
             "text": error_msg
         }
         logging.error(error_msg)
-        self.try_send_message("localhost", client_port, msg)
+        self.try_send_message(client, msg)
+
+    def send_busy_msg(self, job_json, client=None):
+        client = self.reply_channel(job_json, client)
+        logging.warning(f"Job queue is full, turning away job {job_json}")
+        if client is None:
+            return
+        self.try_send_message(client, self.busy_msg())
+
+    def busy_msg(self):
+        return {
+            "status": "busy",
+            "text": "Server is busy handling other jobs. Try again later."
+        }
 
     def call_with_wlock(self, func, *args, **kwargs):
-        if not self.singlethreaded:
-            with self.db_lock.gen_wlock():
-                logging.info(f"Writer lock held by thread calling function: {func}")
-                res = func(*args, **kwargs)
-                return res
-        else:
-            res = func(*args, **kwargs)
-            return res
+        return self.call_with_locks(func, True, *args, **kwargs)
 
     def call_with_rlock(self, func, *args, **kwargs):
-        if not self.singlethreaded:
-            with self.db_lock.gen_rlock():
-                logging.info(f"Reader lock held by thread calling function: {func}")
-                res = func(*args, **kwargs)
-                return res
-        else:
-            res = func(*args, **kwargs)
-
-    def try_send_message(self, host, client_port, msg):
+        return self.call_with_locks(func, False, *args, **kwargs)
+
+    def call_with_locks(self, func, exclusive, *args, **kwargs):
+        # Lock only the tables (or rows) func declared with uses_tables, undeclared functions lock every table
+        if self.singlethreaded:
+            return func(*args, **kwargs)
+        if args and isinstance(args[0], SessionClass) and args[0].info.get("unit_of_work"):
+            # The call is part of its job's transaction and the job already holds the schema lock. A conflict
+            # aborts the whole transaction, so handle_job runs the whole job again
+            return func(*args, **kwargs)
+        requests = lock_requests(func, exclusive, args, kwargs)
+        if self.lock_mode == "database":
+            # The database isolates the call, but can't isolate dropping and recreating tables, so only
+            # the schema lock is kept
+            with self.lock_manager.hold({"schema": requests["schema"]}):
+                return func(*args, **kwargs)
+        with self.lock_manager.hold(requests):
+            logging.info(f"Locks {requests} held by thread calling function: {func}")
+            return func(*args, **kwargs)
+
+    def job_locks(self):
+        # A job that runs as one transaction keeps the tables from being dropped until it commits
+        if self.transaction_scope == "job" and not self.singlethreaded:
+            return self.lock_manager.hold({"schema": "S"})
+        return nullcontext()
+
+    def try_send_message(self, client, msg):
         try:
-            send_message(host, client_port, msg)
+            client.send(msg)
         except ConnectionRefusedError:
-            error_msg = f"ConnectionRefusedError: socket.connect to client port {client_port} refused (likely cause is no open socket on port {client_port}"
+            error_msg = f"ConnectionRefusedError: socket.connect to {client} refused (likely cause is no open socket on {client})"
             logging.error(error_msg)
             return False
+        except OSError as err:
+            logging.error(f"Lost connection to {client} while sending a response: {err}")
+            return False
         return True
 
+    def try_prompt(self, session, client, msg):
+        """Send msg and wait for the client's follow-up response. Returns None if the client could not be reached.
+
+        A job that runs as one transaction commits what it did so far before prompting, so the results the
+        client is shown can't be rolled back later, and the job's row locks aren't held while the client
+        thinks. The rest of the job runs in a new transaction.
+        """
+        if session.info.get("unit_of_work"):
+            session.commit()
+            # What the client is shown can't be taken back by running the job again
+            session.info["prompted"] = True
+        try:
+            client_response = client.prompt(msg, self.prompt_timeout)
+        except PromptTimeout as err:
+            self.send_error_msg(f"PromptTimeout: {err}", client)
+            return None
+        except ConnectionRefusedError:
+            error_msg = f"ConnectionRefusedError: socket.connect to {client} refused (likely cause is no open socket on {client})"
+            logging.error(error_msg)
+            return None
+        except (OSError, JSONDecodeError, ValueError) as err:
+            logging.error(f"Lost connection to {client} while waiting for a response: {err}")
+            return None
+        if client_response is None:
+            logging.error(f"{client} closed the connection before responding.")
+        return client_response
+
     def user_shutdown(self):
         print("Press \"enter\" at any time to shutdown the server.")
         timeout = 0.5
@@ -134,151 +199,426 @@ class Server:
                 logging.info("Shutting down the server...")
                 break
 
+    def wait_for_shutdown_signal(self):
+        # Worker processes have no terminal to read, their parent process sends SIGTERM instead
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, "shutdown", True))
+        while not self.shutdown:
+            sleep(0.5)
+        logging.info("Shutting down the server...")
+
     def listen_for_jobs(self, single_threaded=False):
         while not self.shutdown:
-            message_chunks = get_data_from_connection(self.sock)
+            connection = accept_connection(self.sock)
 
-            if not message_chunks:
-                # catch socket timeout from get_data_from_connection
+            if connection is None:
+                # catch socket timeout from accept_connection
                 continue
-                
+
+            # Framed clients keep their connection open, so each connection is read on its own thread
+            clientsocket, address = connection
+            connection_thread = threading.Thread(target=self.handle_connection, args=(clientsocket, address, single_threaded))
+            connection_thread.daemon = True
+            connection_thread.start()
+
+    def handle_connection(self, clientsocket, address, single_threaded=False):
+        try:
+            framed = is_framed_connection(clientsocket)
+        except OSError:
+            clientsocket.close()
+            return
+
+        if not framed:
+            # Legacy client: one JSON message terminated by the client closing the socket
+            message_chunks = read_until_closed(clientsocket)
+            if not message_chunks:
+                return
             try:
-                # decode the message and spawn a new thread to handle it
                 message_dict = decode_message_chunks(message_chunks)
-                print(type(message_dict))
-                
-                if single_threaded:
-                    logging.info(f"Successfully received message from client. Handling job on this thread {message_dict}.")
-                    self.handle_job(message_dict)
-                else:
-                    logging.info(f"Successfully received message from client. Spawning a new thread to handle job {message_dict}.")
-                    handle_job_thread = threading.Thread(target=self.handle_job, args=(message_dict,))
-                    handle_job_thread.start()
             except JSONDecodeError:
+                return
+            self.dispatch_job(message_dict, single_threaded)
+            return
+
+        clientsocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = FramedConnection(clientsocket)
+        pending = PendingResponses()
+        logging.info(f"Accepted persistent connection from {address[0]}")
+        while not self.shutdown:
+            try:
+                message_dict = conn.recv()
+            except (JSONDecodeError, ValueError) as err:
+                logging.error(f"Dropping connection from {address[0]} after a malformed frame: {err}")
+                break
+            except OSError:
+                break
+            if message_dict is None:
+                # client closed the connection
+                break
+            request_id = message_dict.get("request_id")
+            if request_id is not None and not isinstance(request_id, (int, str)):
+                self.send_error_msg("Client message entry \"request_id\" must be an integer or a string", ConnectionChannel(conn))
                 continue
+            if pending.deliver(message_dict):
+                # follow-up response to a job that prompted the client
+                continue
+            if "port" in message_dict:
+                # Legacy reply mode: results are sent to the client's listen port
+                self.dispatch_job(message_dict, single_threaded)
+            elif request_id is not None and not single_threaded:
+                # Pipelined job: run it alongside the connection's other jobs, responses are matched by request_id
+                self.dispatch_job(message_dict, single_threaded, ConnectionChannel(conn, request_id, pending))
+            elif single_threaded:
+                self.run_job(message_dict, single_threaded, ConnectionChannel(conn, request_id))
+            else:
+                # Jobs may prompt the client for follow-up responses on this connection,
+                # so the connection is not read again until the job is finished
+                client = ConnectionChannel(conn, request_id)
+                job = self.job_pool.submit(self.try_handle_job, message_dict, client)
+                if job is None:
+                    self.send_busy_msg(message_dict, client)
+                else:
+                    job.result()
+        pending.close()
+        self.change_feed.unsubscribe(conn)
+        conn.close()
+        logging.info(f"Closed persistent connection from {address[0]}")
+
+    def run_job(self, message_dict, single_threaded=False, client=None):
+        logging.info(f"Successfully received message from client. Handling job on this thread {message_dict}.")
+        if single_threaded:
+            # Connections are read on separate threads, so jobs still need to run one at a time
+            with self.single_thread_lock:
+                self.try_handle_job(message_dict, client)
+        else:
+            self.try_handle_job(message_dict, client)
+
+    def try_handle_job(self, message_dict, client=None):
+        # A failed job must not take down the connection thread it runs on
+        try:
+            self.handle_job(message_dict, client)
+        except Exception as err:
+            logging.exception(f"Unexpected error while handling job {message_dict}")
+            if client is not None:
+                self.send_error_msg(f"{type(err).__name__}: {err}", client)
+
+    def dispatch_job(self, message_dict, single_threaded=False, client=None):
+        if single_threaded:
+            self.run_job(message_dict, single_threaded, client)
+        else:
+            logging.info(f"Successfully received message from client. Queueing job for a worker thread {message_dict}.")
+            if self.job_pool.submit(self.try_handle_job, message_dict, client) is None:
+                self.send_busy_msg(message_dict, client)
 
-    def handle_job(self, job_json):
-        print(type(job_json))
-        print(job_json)
+    def reply_channel(self, job_json, client=None):
+        # Answer on the connection the job arrived on, unless the client asked for the legacy reply-to-port mode
+        if "port" in job_json:
+            return PortChannel(job_json['port'])
+        return client
+
+    def handle_job(self, job_json, client=None):
         try:
             if job_json["action"] == "reset":
                 logging.info("Resetting the database...")
                 self.call_with_wlock(reset_db)
+                read_cache.clear()
+                json_cache.clear()
                 logging.info("Database successfully reset.")
+                # Tell the client the reset is done, so it doesn't start on the old tables
+                client = self.reply_channel(job_json, client)
+                if client is not None:
+                    self.try_send_message(client, {"status": "success"})
                 return
         except:
             logging.info(f"Left try action == reset block with message {job_json}")
             pass
 
-        try:
-            client_port = job_json['port']
-        except KeyError:
+        client = self.reply_channel(job_json, client)
+        if client is None:
             logging.error(f"Client message {job_json} did not include entry \"port\" to report back results.")
             return
-        
-        self.used_ports.add(client_port)
 
         try:
             action = job_json['action']
         except KeyError:
             text = "Client message did not include entry \"action\" to let the server know an action to take (add/delete/read/update)"
-            self.send_error_msg(text, client_port)
+            self.send_error_msg(text, client)
             return
-        
-        try:
-            data_type = job_json['data_type']
-        except KeyError:
-            text = "Client message did not include entry \"data_type\" to let the server know which table to work with."
-            self.send_error_msg(text, client_port)
+
+        if action == "stats":
+            # Share of lookups answered without querying the database
+            self.try_send_message(client, {"status": "success", "cache": read_cache.stats(), "json_cache": json_cache.stats(), "transaction_scope": self.transaction_scope})
             return
 
-        if data_type not in ["vehicle", "engineer", "laptop", "contact_details", "vehicle_engineers"]:
-            text = "Client message entry \"data_type\" is not one of [\"vehicle\", \"engineer\", \"laptop\", \"contact_details\", \"vehicle_engineers\"]"
-            self.send_error_msg(text, client_port)
+        if action in ["subscribe", "unsubscribe"]:
+            self.handle_subscription(action, job_json, client)
             return
+        
+        # A bulk add gives the data type of each of its records instead
+        data_type = None
+        if action != "bulk_add":
+            try:
+                data_type = job_json['data_type']
+            except KeyError:
+                text = "Client message did not include entry \"data_type\" to let the server know which table to work with."
+                self.send_error_msg(text, client)
+                return
 
-        vehicle_engineers_error_msg = f"Data type vehicle_engineers only supports the \"read\" action and does not support action \"{action}\""
+            if data_type not in ["vehicle", "engineer", "laptop", "contact_details", "vehicle_engineers"]:
+                text = "Client message entry \"data_type\" is not one of [\"vehicle\", \"engineer\", \"laptop\", \"contact_details\", \"vehicle_engineers\"]"
+                self.send_error_msg(text, client)
+                return
+
+        bind = nullcontext(self.session_bind)
+        if self.router is not None:
+            bind = self.router.bind(action == "read", client.client_key)
+        if self.transaction_scope == "job":
+            # Hold responses back until the job's transaction commits, so clients never act on uncommitted results
+            client = DeferredChannel(client)
+        with bind as session_bind:
+            for attempt in range(1, JOB_ATTEMPTS + 1):
+                if self.run_job_transaction(session_bind, action, data_type, job_json, client, attempt):
+                    break
+                sleep(JOB_RETRY_BACKOFF * attempt)
+
+        if self.transaction_scope == "job":
+            try:
+                client.flush()
+            except OSError as err:
+                logging.error(f"Lost connection to {client} while sending a response: {err}")
+
+    def run_job_transaction(self, session_bind, action, data_type, job_json, client, attempt):
+        """Run the job's action. Returns False if the job runs as one transaction and the database aborted
+        it over a conflict with another job's, so it should be run again: its writes are rolled back and
+        its held back responses thrown away. A job that prompted the client has committed what it did
+        before the prompt and isn't run again, nor is one on its last attempt."""
+        # db_utils commit after reads too, so keep what they loaded (eager loaded relationships included)
+        # instead of reloading it row by row when the results are serialized
+        session = Session(bind=session_bind, expire_on_commit=False, info={"unit_of_work": self.transaction_scope == "job", "replica": session_bind is not self.session_bind})
+        try:
+            with self.job_locks():
+                self.run_action(session, action, data_type, job_json, client)
+                if self.transaction_scope == "job":
+                    conflict = session.info.get("conflict")
+                    if conflict is not None:
+                        # A write answered the client with an error and the job carried on, but the database
+                        # may have rolled back the whole transaction
+                        raise conflict
+                    session.commit()
+            return True
+        except Exception as err:
+            session.rollback()
+            if self.transaction_scope != "job":
+                raise
+            client.discard()
+            if attempt == JOB_ATTEMPTS or session.info.get("prompted") or not is_retryable(err):
+                raise
+            logging.warning(f"Running job {job_json} again after a transaction conflict (attempt {attempt} of {JOB_ATTEMPTS}): {err}")
+            return False
+        finally:
+            session.close()
 
-        session = Session()
+    def run_action(self, session, action, data_type, job_json, client):
+        vehicle_engineers_error_msg = f"Data type vehicle_engineers only supports the \"read\" action and does not support action \"{action}\""
 
         if action == "add":
             if data_type == "vehicle":
-                self.add_vehicle(session, job_json, client_port)
+                self.add_vehicle(session, job_json, client)
 
             elif data_type == "engineer":
-                self.add_engineer(session, job_json, client_port)
+                self.add_engineer(session, job_json, client)
             
             elif data_type == "laptop":
-                self.add_laptop(session, job_json, client_port)
+                self.add_laptop(session, job_json, client)
             
             elif data_type == "contact_details":
-                self.add_contact_details(session, job_json, client_port)
+                self.add_contact_details(session, job_json, client)
             
             elif data_type == "vehicle_engineers":
-                session.close()
-                self.send_error_msg(vehicle_engineers_error_msg, client_port)
+                self.send_error_msg(vehicle_engineers_error_msg, client)
                 return
 
         elif action == "delete":
             if data_type == "vehicle":
-                self.delete_vehicle(session, job_json, client_port)
+                self.delete_vehicle(session, job_json, client)
             
             elif data_type == "engineer":
-                self.delete_engineer(session, job_json, client_port)
+                self.delete_engineer(session, job_json, client)
 
             elif data_type == "laptop":
-                self.delete_laptop(session, job_json, client_port)
+                self.delete_laptop(session, job_json, client)
             
             elif data_type == "contact_details":
-                self.delete_contact_details(session, job_json, client_port)
+                self.delete_contact_details(session, job_json, client)
             
             elif data_type == "vehicle_engineers":
-                session.close()
-                self.send_error_msg(vehicle_engineers_error_msg, client_port)
+                self.send_error_msg(vehicle_engineers_error_msg, client)
                 return
 
 
         elif action == "read":
+            if not self.valid_fields(data_type, job_json, client):
+                return
+            client = self.versioned_channel(session, data_type, job_json, client)
+            if client is None:
+                return
+
             if data_type == "vehicle":
-                self.query_vehicle(session, job_json, client_port)
+                self.query_vehicle(session, job_json, client)
             
             elif data_type == "engineer":
-                self.query_engineer(session, job_json, client_port)
+                self.query_engineer(session, job_json, client)
 
             elif data_type == "laptop":
-                self.query_laptop(session, job_json, client_port)
+                self.query_laptop(session, job_json, client)
 
             elif data_type == "contact_details":
-                self.query_contact_details(session, job_json, client_port)
+                self.query_contact_details(session, job_json, client)
             
             elif data_type == "vehicle_engineers":
-                self.query_vehicle_engineers(session, job_json, client_port)
+                self.query_vehicle_engineers(session, job_json, client)
             
         elif action == "update":
             if data_type == "vehicle":
-                self.update_vehicle(session, job_json, client_port)
+                self.update_vehicle(session, job_json, client)
             
             elif data_type == "engineer":
-                self.update_engineer(session, job_json, client_port)
+                self.update_engineer(session, job_json, client)
 
             elif data_type == "laptop":
-                self.update_laptop(session, job_json, client_port)
+                self.update_laptop(session, job_json, client)
                 
             else:
-                session.close()
                 unimplemented_err = f"Server action \"update\" is not yet implemented for data type \"{data_type}\""
-                self.send_error_msg(unimplemented_err, client_port)
+                self.send_error_msg(unimplemented_err, client)
                 return
 
+        elif action == "bulk_add":
+            self.bulk_add(session, job_json, client)
+
         else:
-            session.close()
-            text = f"Client message entry \"action\": {action} must be one of [\"add\", \"delete\", \"read\"]"
-            self.send_error_msg(text, client_port)
+            text = f"Client message entry \"action\": {action} must be one of [\"add\", \"delete\", \"read\", \"update\", \"bulk_add\", \"stats\"]"
+            self.send_error_msg(text, client)
+            return
+
+    def handle_subscription(self, action, job_json, client):
+        """Subscribe the client's connection to the change events of "data_types" (every data type by default),
+        numbered after "after_seq" when resuming, or unsubscribe it. Events follow a "subscribed" response."""
+        if not isinstance(client, ConnectionChannel):
+            self.send_error_msg(f"Client {action} job needs a persistent connection for the events to be sent on", client)
+            return
+        if action == "unsubscribe":
+            if not self.change_feed.unsubscribe(client.client_key):
+                self.send_error_msg("Client connection is not subscribed to any change events", client)
+                return
+            self.try_send_message(client, {"status": "success"})
+            return
+
+        all_data_types = list(DATA_TYPES.values())
+        data_types = job_json.get("data_types", all_data_types)
+        if not isinstance(data_types, list) or not data_types or any(data_type not in all_data_types for data_type in data_types):
+            self.send_error_msg(f"Client subscribe job entry \"data_types\" must be a list of data types from {all_data_types}", client)
             return
+        after_seq = job_json.get("after_seq")
+        if after_seq is not None and (isinstance(after_seq, bool) or not isinstance(after_seq, int) or after_seq < 0):
+            self.send_error_msg("Client subscribe job entry \"after_seq\" must be a sequence number no less than 0", client)
+            return
+        start_seq, last_seq = self.change_feed.sequence_numbers()
+        if after_seq is not None and after_seq > last_seq:
+            self.send_error_msg(f"Client subscribe job entry \"after_seq\": {after_seq} is past the last change event {last_seq}", client)
+            return
+
+        # The feed sends events from its own thread, so an earlier subscription is stopped
+        # and the new one confirmed before any of its events can be sent
+        self.change_feed.unsubscribe(client.client_key)
+        seq = start_seq if after_seq is None else after_seq
+        if not self.try_send_message(client, {"status": "subscribed", "seq": seq}):
+            return
+        self.change_feed.subscribe(client, data_types, seq)
+        logging.info(f"Subscribed {client} to {data_types} change events after {seq}")
+
+    def valid_fields(self, data_type, job_json, client):
+        """Check a read job's "fields", the to_json entries to send of each row instead of all of them."""
+        if "fields" not in job_json:
+            return True
+        fields = job_json["fields"]
+        if data_type == "vehicle_engineers":
+            self.send_error_msg("Client vehicle_engineers read job cannot choose \"fields\", it reads both vehicles and engineers", client)
+            return False
+        if not isinstance(fields, list) or not fields or any(field not in JSON_FIELDS[data_type] for field in fields):
+            self.send_error_msg(f"Client {data_type} read job entry \"fields\" must be a list of fields from {list(JSON_FIELDS[data_type])}", client)
+            return False
+        return True
+
+    def versioned_channel(self, session, data_type, job_json, client):
+        """Wrap client so a read's responses carry the version of the tables it reads, if the job sent
+        "if_version". If that is still the version, send "not_modified" instead and return None, the read can be skipped."""
+        if "if_version" not in job_json:
+            return client
+        version = self.call_with_rlock(read_table_version, session, READ_TABLES[data_type])
+        if version is None:
+            return client
+        if job_json.get("if_version") == version:
+            logging.info(f"Client {data_type} read is not modified since version {version}")
+            self.try_send_message(client, {"status": "not_modified", "version": version})
+            return None
+        return VersionedChannel(client, version)
+
+    def send_all(self, session, job_json, client, read_all, entry, empty_error=None):
+        """Send the rows read_all reads under msg[entry], all at once or one page at a time. read_all gives
+        each row as an (id, JSON bytes) pair, and the bytes are sent as they are. With "fields", only
+        those entries of each row are read and sent.
+
+        With "limit", a page of rows after "after_id" is sent along with "next_after_id" to read the next
+        page from, if there is one. With "stream", every row is sent in frames of "chunk_size" rows, each
+        marked with whether "more" frames follow, so neither side holds the whole table in memory.
+        Each page is read in its own call, so table locks are not held while the client reads.
+        """
+        after_id = job_json.get("after_id")
+        limit = job_json.get("limit")
+        stream = job_json.get("stream", False)
+        chunk_size = job_json.get("chunk_size")
+        if chunk_size is None:
+            chunk_size = STREAM_CHUNK_SIZE
+        # bool is an int too, but true isn't an id or a count
+        if after_id is not None and (isinstance(after_id, bool) or not isinstance(after_id, int) or after_id < 0):
+            self.send_error_msg("Client read job entry \"after_id\" must be an id no less than 0", client)
+            return
+        for name, value in [("limit", limit), ("chunk_size", chunk_size)]:
+            if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value < 1):
+                self.send_error_msg(f"Client read job entry \"{name}\" must be a number greater than 0", client)
+                return
 
-        session.close()
+        if not stream:
+            # Read one row past the page to know whether there is another page
+            rows = self.call_with_rlock(read_all, session, None if limit is None else limit + 1, after_id, fields=job_json.get("fields"))
+            if not rows and after_id is None and empty_error is not None:
+                self.send_error_msg(empty_error, client)
+                return
+            msg = {"status": "success", entry: EncodedList(encoded for _, encoded in rows[:limit])}
+            if limit is not None and len(rows) > limit:
+                msg["next_after_id"] = rows[limit - 1][0]
+            logging.info(f"Successfully read {len(msg[entry])} {entry}")
+            self.try_send_message(client, msg)
+            return
+
+        # A job that runs as one transaction holds its responses until it commits, so only its reads are chunked
+        sent = 0
+        while True:
+            rows = self.call_with_rlock(read_all, session, chunk_size + 1, after_id, fields=job_json.get("fields"))
+            if not rows and sent == 0 and empty_error is not None:
+                self.send_error_msg(empty_error, client)
+                return
+            more = len(rows) > chunk_size
+            rows = rows[:chunk_size]
+            if not self.try_send_message(client, {"status": "success", entry: EncodedList(encoded for _, encoded in rows), "more": more}):
+                return
+            sent += len(rows)
+            if not more:
+                logging.info(f"Successfully streamed {sent} {entry}")
+                return
+            after_id = rows[-1][0]
 
-    def query_vehicle_engineers(self, session, job_json, client_port):
+    def query_vehicle_engineers(self, session, job_json, client):
         msg = {
             "status": None
         }
@@ -295,7 +635,7 @@ class Server:
             logging.info("Client vehicle_engineers read job had no entry for \"engineer\".")
             if model is None:
                 error_msg = "Aborted reading vehicle_engineers relationship because client did not provide either \"model\" nor \"engineer\"."
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
         
         if model is not None:
@@ -303,12 +643,12 @@ class Server:
                 engineers = self.call_with_rlock(self.car_utils.read_assigned_engineers_by_model, session, model)
             except AttributeError:
                 error_msg = f"No model {model} vehicles exist in the database."
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
 
             if not engineers:
                 error_msg = f"No engineers are assigned to any model {model} vehicles."
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
             
             msg["status"] = "success"
@@ -320,23 +660,23 @@ class Server:
                 cars = self.call_with_rlock(self.engin_utils.read_assigned_vehicles_by_name, session, engineer)
             except AttributeError:
                 error_msg = f"Engineer {engineer} does not exist in the database."
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
 
             if not cars:
                 error_msg = f"No vehicles are assigned to engineer {engineer}"
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
 
             msg["status"] = "success"
             msg["vehicles"] = [car.to_json() for car in cars]
             logging.info(f"Successfully read vehicles engineer {engineer} is assigned to")
         
-        success = self.try_send_message("localhost", client_port, msg)
+        success = self.try_send_message(client, msg)
         if not success:
             return
 
-    def add_vehicle(self, session, job_json, client_port):
+    def add_vehicle(self, session, job_json, client):
         msg = {
             'status': None
         }
@@ -346,62 +686,62 @@ class Server:
         try:
             model = job_json['model']
             if not model:
-                self.send_error_msg("IntegrityError: model name must not be empty (\"\")", client_port)
+                self.send_error_msg("IntegrityError: model name must not be empty (\"\")", client)
                 return
         except:
-            self.send_error_msg(error_text.format("model"), client_port)
+            self.send_error_msg(error_text.format("model"), client)
             return
         
         try:
             quantity = job_json['quantity']
             if quantity < 0:
-                self.send_error_msg("IntegrityError: quantity must be no less than 0", client_port)
+                self.send_error_msg("IntegrityError: quantity must be no less than 0", client)
                 return
         except:
-            self.send_error_msg(error_text.format("quantity"), client_port)
+            self.send_error_msg(error_text.format("quantity"), client)
             return
 
         try:
             price = job_json['price']
             if price < 1:
-                self.send_error_msg("IntegrityError: price must be no less than 1", client_port)
+                self.send_error_msg("IntegrityError: price must be no less than 1", client)
                 return
         except:
-            self.send_error_msg(error_text.format("price"), client_port)
+            self.send_error_msg(error_text.format("price"), client)
             return
 
         try:
             manufacture_year = job_json['manufacture_year']
             if manufacture_year < 1920 or manufacture_year > 2021:
-                self.send_error_msg("IntegrityError: manufacture year must be between the years (1920-2021)", client_port)
+                self.send_error_msg("IntegrityError: manufacture year must be between the years (1920-2021)", client)
                 return
 
         except:
-            self.send_error_msg(error_text.format("manufacture_year"), client_port)
+            self.send_error_msg(error_text.format("manufacture_year"), client)
             return
         
         try:
             manufacture_month = job_json["manufacture_month"]
             if manufacture_month < 1 or manufacture_month > 12:
-                self.send_error_msg("IntegrityError: manufacture month must be between (1-12)", client_port)
+                self.send_error_msg("IntegrityError: manufacture month must be between (1-12)", client)
                 return
         except:
-            self.send_error_msg(error_text.format("manufacture_month"), client_port)
+            self.send_error_msg(error_text.format("manufacture_month"), client)
             return
         
         try:
             manufacture_date = job_json["manufacture_date"]
             if manufacture_date < 1 or manufacture_date > 31:
-                self.send_error_msg("IntegrityError: manufacture date must be between (1-31)", client_port)
+                self.send_error_msg("IntegrityError: manufacture date must be between (1-31)", client)
                 return
         except:
-            self.send_error_msg(error_text.format("manufacture_date"), client_port)
+            self.send_error_msg(error_text.format("manufacture_date"), client)
             return
 
         try:
             full_manufacture_date = date(manufacture_year, manufacture_month, manufacture_date)
         except ValueError as err:
-            self.send_error_msg(f"ValueError: {err}", client_port)
+            self.send_error_msg(f"ValueError: {err}", client)
             return
         new_car = self.call_with_wlock(self.car_utils.add_vehicle_db, session, model, quantity, price, full_manufacture_date)
 
@@ -412,41 +752,27 @@ class Server:
             logging.info(text)
             msg["status"] = "updated"
             msg["text"] = text
-            success = self.try_send_message("localhost", client_port, msg)
+            success = self.try_send_message(client, msg)
             if not success:
                 return
             return
 
         # Else, let client know new vehicle was added
-        new_port = self.get_unused_port()
         logging.info(f"Successfully added new vehicle {model} manufactured on {full_manufacture_date} to the database.")
         msg["status"] = "success"
-        msg["port"] = new_port
         new_car_json = new_car.to_json()
-        success = self.try_send_message("localhost", client_port, {**msg, **new_car_json})
-        if not success:
-            return
-
-        # Grab an unused port and bind a new socket to it to listen for more client messages
-        # Make sure messages to the client tells it the new port to respond to
-        
-        new_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        new_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        new_sock.bind(("localhost", new_port))
-        new_sock.listen()
-        new_sock.settimeout(1)
         logging.info("Waiting for client to respond \"yes\" or \"no\" to assigning engineers.")
-        
+
         # Wait for client to respond "yes" or "no" to assigning engineers
-        client_response = self.get_client_response(new_sock)
+        client_response = self.try_prompt(session, client, {**msg, **new_car_json})
+        if client_response is None:
+            return
 
         try:
             add_engins = client_response['response']
         except:
             text = "Client did not include entry \"response\" to let the server know whether they wanted to assign engineers to the new vehicle."
-            self.send_error_msg(text, client_port)
-            new_sock.close()
-            self.used_ports.remove(new_port)
+            self.send_error_msg(text, client)
             return
         
         # If client responds "no", no need for further action
@@ -462,9 +788,8 @@ class Server:
                 engineers = client_response["engineers"]
             except:
                 text = "Client did not include entry \"engineers\" to let the server know which engineers to assign to the new vehicle."
-                self.send_error_msg(text, client_port)
-                new_sock.close()
-                self.used_ports.remove(new_port)
+                self.send_error_msg(text, client)
+                return
             
             for name in engineers:
                 name = name.strip()
@@ -477,6 +802,8 @@ class Server:
                 else:
                     # Else, store in assigned list
                     assigned_names.append(name)
+                    if engin in new_engins:
+                        continue
                     new_engins.append(engin)
                     self.call_with_wlock(self.car_utils.update_vehicle_db, session, new_car.id, engineers=new_engins)
                     logging.info(f"Engineer {name} successfully assigned to new vehicle.")
@@ -486,15 +813,11 @@ class Server:
             msg["assigned"] = assigned_names
             msg["unassigned"] = unassigned_names
             logging.info("Finished assigning engineers to the new vehicle.")
-            success = self.try_send_message("localhost", client_port, msg)
+            success = self.try_send_message(client, msg)
             if not success:
                 return
 
-        # Close new socket
-        new_sock.close()
-        self.used_ports.remove(new_port)
-
-    def delete_vehicle(self, session, job_json, client_port):
+    def delete_vehicle(self, session, job_json, client):
         msg = {
             "status": None
         }
@@ -503,21 +826,21 @@ class Server:
             model = job_json["model"]
         except:
             error_msg = "Client vehicle delete job has no entry for \"model\"."
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
         models_deleted = self.call_with_wlock(self.car_utils.delete_vehicle_by_model, session, model)
         if models_deleted:
             logging.info(f"Successfully deleted all {model} model vehicles.")
             msg["status"] = "success"
-            success = self.try_send_message("localhost", client_port, msg)
+            success = self.try_send_message(client, msg)
             if not success:
                 return
         else:
             error_msg = f"No vehicles of model {model} existed in the database to be deleted."
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
         return
 
-    def query_vehicle(self, session, job_json, client_port):
+    def query_vehicle(self, session, job_json, client):
         msg = {
             "status": None
         }
@@ -526,7 +849,7 @@ class Server:
             model = job_json["model"]
         except:
             error_msg = "Client vehicle read job has no entry for \"model\""
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
         cars = []
         if model == "":
@@ -534,42 +857,44 @@ class Server:
                 id = job_json["id"]
             except:
                 error_msg = "Client vehicle read job entered a blank model name, but did not have an entry for \"id\""
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
             logging.info(f"Attempting to read vehicle id {id} from the database.")
-            car = self.call_with_rlock(self.car_utils.read_vehicle_by_id, session, id)
+            car = self.call_with_rlock(self.car_utils.read_vehicle_by_id, session, id, job_json.get("fields"))
             if car is None:
                 error_msg = f"No vehicle with id {id} exists in the database."
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
             msg["status"] = "success"
-            msg["vehicles"] = [car.to_json()]
+            msg["vehicles"] = [car.to_json(job_json.get("fields"))]
             logging.info(f"Successfully read vehicle id {id} from the database:" + str(car))
-            success = self.try_send_message("localhost", client_port, msg)
+            success = self.try_send_message(client, msg)
             if not success:
                 return
             return
         
         elif model == "all":
             logging.info("Attempting to read all vehicles from the database.")
-            cars = self.call_with_rlock(self.car_utils.read_vehicles_all, session)
+            self.send_all(session, job_json, client, self.car_utils.json_vehicles_all, "vehicles", f"No cars with model {model} were found in the database.")
+            return
 
         else:
             logging.info(f"Attempting to read all {model} model vehicles from the database.")
-            cars = self.call_with_rlock(self.car_utils.read_vehicles_by_model, session, model)
+            cars = self.call_with_rlock(self.car_utils.read_vehicles_by_model, session, model, job_json.get("fields"))
         
         if not cars:
             error_msg = f"No cars with model {model} were found in the database."
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
+            return
         
         logging.info(f"Vehicle read on {model} model vehicles successful.")
         msg["status"] = "success"
-        msg["vehicles"] = [car.to_json() for car in cars]
-        success = self.try_send_message("localhost", client_port, msg)
+        msg["vehicles"] = [car.to_json(job_json.get("fields")) for car in cars]
+        success = self.try_send_message(client, msg)
         if not success:
             return
 
-    def update_vehicle(self, session, job_json, client_port):
+    def update_vehicle(self, session, job_json, client):
         msg = {
             "status": None
         }
@@ -578,7 +903,7 @@ class Server:
             vehicle_id = job_json["id"]
         except:
             error_msg = "Client update vehicle job did not have an entry for \"id\""
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
         
         logging.info(f"Attempting to update vehicle with id {vehicle_id}")
@@ -587,7 +912,7 @@ class Server:
 
         if curr_car is None:
             error_msg = f"No vehicle with id {vehicle_id} exists in the database. Cannot update a vehicle that doesn't exist."
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
 
         model = quantity = price = manufacture_year = manufacture_month = manufacture_date = engineer_names = engineers = None
@@ -596,14 +921,15 @@ class Server:
         try:
             model = job_json["model"]
             if model == "":
-                self.send_error_msg("IntegrityError: entry \"model\" must not be empty (\"\")", client_port)
+                self.send_error_msg("IntegrityError: entry \"model\" must not be empty (\"\")", client)
+                return
         except:
             logging.info(missing_entry_msg.format(entry_name = "model"))
         
         try:
             quantity = job_json["quantity"]
             if quantity < 0:
-                self.send_error_msg("IntegrityError: entry \"quantity\" must be more than 0", client_port)
+                self.send_error_msg("IntegrityError: entry \"quantity\" must be more than 0", client)
                 return
         except:
             logging.info(missing_entry_msg.format(entry_name = "quantity"))
@@ -611,7 +937,7 @@ class Server:
         try:
             price = job_json["price"]
             if price < 1:
-                self.send_error_msg("IntegrityError: entry \"price\" must be more than 1", client_port)
+                self.send_error_msg("IntegrityError: entry \"price\" must be more than 1", client)
                 return
         except:
             logging.info(missing_entry_msg.format(entry_name = "price"))
@@ -619,7 +945,7 @@ class Server:
         try:
             manufacture_year = job_json["manufacture_year"]
             if manufacture_year < 1920 or manufacture_year > 2021:
-                self.send_error_msg("IntegrityError: entry \"manufacture_year\" must be in the range (1920-2021)", client_port)
+                self.send_error_msg("IntegrityError: entry \"manufacture_year\" must be in the range (1920-2021)", client)
                 return
         except:
             logging.info(missing_entry_msg.format(entry_name = "manufacture_year"))
@@ -628,7 +954,7 @@ class Server:
         try:
             manufacture_month = job_json["manufacture_month"]
             if manufacture_month < 1 or manufacture_month > 12:
-                self.send_error_msg("IntegrityError: entry \"manufacture_month\" must be in the range (1-12)", client_port)
+                self.send_error_msg("IntegrityError: entry \"manufacture_month\" must be in the range (1-12)", client)
                 return
         except KeyError:
             logging.info(missing_entry_msg.format(entry_name = "manufacture_month"))
@@ -639,7 +965,7 @@ class Server:
         try:
             manufacture_date = job_json["manufacture_date"]
             if manufacture_date < 1 or manufacture_date > 31:
-                self.send_error_msg("IntegrityError: entry \"manufacture_date\" must be in the range (1-31)", client_port)
+                self.send_error_msg("IntegrityError: entry \"manufacture_date\" must be in the range (1-31)", client)
                 return
         except:
             logging.info(missing_entry_msg.format(entry_name = "manufacture_date"))
@@ -650,7 +976,7 @@ class Server:
             engineers = []
             for name in engineer_names:
                 engin = self.call_with_rlock(self.engin_utils.read_engineer_by_name, session, name)
-                if engin is not None:
+                if engin is not None and engin not in engineers:
                     engineers.append(engin)
             engineers = None if not engineers else engineers
         except:
@@ -661,7 +987,7 @@ class Server:
             full_manufacture_date = date(manufacture_year, manufacture_month, manufacture_date)
         except ValueError:
             error_msg = f"ValueError: client date is not a real calendar date. Year: {manufacture_year}, Month: {manufacture_month}, Date: {manufacture_date}"
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
         except:
             logging.info("Client left one of the manufacture date fields empty. Skipping update for manufacture date fields.")
@@ -670,16 +996,16 @@ class Server:
 
         if car is None:
             error_msg = f"There was an issue updating vehicle id {vehicle_id}. Most likely cause is that no vehicle with id {vehicle_id} exists in the database."
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
         
         msg["status"] = "success"
         msg["vehicle"] = car.to_json()
-        success = self.try_send_message("localhost", client_port, msg)
+        success = self.try_send_message(client, msg)
         if not success:
             return
 
-    def add_engineer(self, session, job_json, client_port):
+    def add_engineer(self, session, job_json, client):
         msg = {
             'status': None
         }
@@ -689,43 +1015,43 @@ class Server:
         try:
             engin_name = job_json["name"]
             if engin_name == "":
-                self.send_error_msg("IntegrityError: Client engineer insert job gave an empty \"name\" entry", client_port)
+                self.send_error_msg("IntegrityError: Client engineer insert job gave an empty \"name\" entry", client)
                 return
         except:
-            self.send_error_msg(error_text.format("name"), client_port)
+            self.send_error_msg(error_text.format("name"), client)
             return
         
         try:
             birth_year = job_json["birth_year"]
             if birth_year < 1920 or birth_year > 2021:
-                self.send_error_msg("IntegrityError: Client engineer insert job gave a year not in the range (1920-2021)", client_port)
+                self.send_error_msg("IntegrityError: Client engineer insert job gave a year not in the range (1920-2021)", client)
                 return
         except:
-            self.send_error_msg(error_text.format("birth_year"), client_port)
+            self.send_error_msg(error_text.format("birth_year"), client)
             return
 
         try:
             birth_month = job_json["birth_month"]
             if birth_month < 1 or birth_month > 12:
-                self.send_error_msg("IntegrityError: Client engineer insert job gave a month not in the range (1-12)", client_port)
+                self.send_error_msg("IntegrityError: Client engineer insert job gave a month not in the range (1-12)", client)
                 return
         except:
-            self.send_error_msg(error_text.format("birth_month"), client_port)
+            self.send_error_msg(error_text.format("birth_month"), client)
             return
 
         try:
             birth_date = job_json["birth_date"]
             if birth_date < 1 or birth_date > 31:
-                self.send_error_msg("IntegrityError: Client engineer insert job gave a date not in the range (1-31)", client_port)
+                self.send_error_msg("IntegrityError: Client engineer insert job gave a date not in the range (1-31)", client)
                 return
         except:
-            self.send_error_msg(error_text.format("birth_date"), client_port)
+            self.send_error_msg(error_text.format("birth_date"), client)
             return
         
         try:
             full_birth_date = date(birth_year, birth_month, birth_date)
         except ValueError as err:
-            self.send_error_msg(f"ValueError: {err}", client_port)
+            self.send_error_msg(f"ValueError: {err}", client)
             return
 
         
@@ -734,36 +1060,25 @@ class Server:
         if new_engin is None:
             text = f"Engineer named {engin_name} already exists in the database.\n" + \
                    f"Aborted adding duplicate engineer {engin_name} to the database."
-            self.send_error_msg(text, client_port)
+            self.send_error_msg(text, client)
             return
 
-        new_port = self.get_unused_port()
         text = f"Successfully added new engineer {engin_name} to the database!"
         logging.info(text)
         msg["status"] = "success"
-        msg["port"] = new_port
         new_engin_json = new_engin.to_json()
-        success = self.try_send_message("localhost", client_port, {**msg, **new_engin_json})
-        if not success:
-            return
-
-        new_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        new_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        new_sock.bind(("localhost", new_port))
-        new_sock.listen()
-        new_sock.settimeout(1)
         logging.info("Waiting for client to respond \"yes\" or \"no\" to assign new engineer to vehicles.")
 
         # Wait for client to respond "yes" or "no" to assigning vehicles
-        client_response = self.get_client_response(new_sock)
+        client_response = self.try_prompt(session, client, {**msg, **new_engin_json})
+        if client_response is None:
+            return
 
         try:
             add_vehicles = client_response['response']
         except:
             text = "Client did not include entry \"response\" to let the server know whether to assign the new engineer to any vehicles."
-            self.send_error_msg(text, client_port)
-            new_sock.close()
-            self.used_ports.remove(new_port)
+            self.send_error_msg(text, client)
             return
 
         if add_vehicles == 'y':
@@ -775,9 +1090,7 @@ class Server:
                 vehicles = client_response['vehicles']
             except:
                 text = "Client response did not include entry \"vehicles\" to let the server know which vehicles to assign the new engineer to."
-                self.send_error_msg(text, client_port)
-                new_sock.close()
-                self.used_ports.remove(new_port)
+                self.send_error_msg(text, client)
                 return
             
             for car_model in vehicles:
@@ -789,6 +1102,9 @@ class Server:
                     continue
 
                 for car in cars:
+                    # A model listed twice is already assigned, vehicle_engineers can't hold the pair twice
+                    if new_engin in car.engineers:
+                        continue
                     new_engins_list = car.engineers + [new_engin]
                     self.call_with_wlock(self.car_utils.update_vehicle_db, session, car.id, engineers=new_engins_list)
                     assignment_msg = f"Successfully assigned {engin_name} to vehicle {car_model} manufactured on {car.manufacture_date}"
@@ -799,15 +1115,12 @@ class Server:
             msg["assigned"] = assigned
             msg["unassigned"] = unassigned
             logging.info(f"Finished assigning vehicles to the new engineer {engin_name}")
-            success = self.try_send_message("localhost", client_port, msg)
+            success = self.try_send_message(client, msg)
             if not success:
                 return
 
-        new_sock.close()
-        self.used_ports.remove(new_port)
 
-
-    def delete_engineer(self, session, job_json, client_port):
+    def delete_engineer(self, session, job_json, client):
         msg = {
             "status": None
         }
@@ -816,23 +1129,23 @@ class Server:
             name = job_json["name"]
         except:
             error_msg = "Client engineer delete job has no entry for \"name\""
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
         engin = self.call_with_rlock(self.engin_utils.read_engineer_by_name, session, name)
         if engin is None:
             error_msg = f"Engineer {name} doesn't exist in the database. Aborted deleting non-existant engineer."
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
         self.call_with_wlock(self.engin_utils.delete_engineer_by_name, session, name)
         logging.info(f"Successfully deleted engineer {name} from the database.")
         msg["status"] = "success"
-        success = self.try_send_message("localhost", client_port, msg)
+        success = self.try_send_message(client, msg)
         if not success:
             return
         return
 
 
-    def query_engineer(self, session, job_json, client_port):
+    def query_engineer(self, session, job_json, client):
         msg = {
             "status": None
         }
@@ -841,7 +1154,7 @@ class Server:
             name = job_json["name"]
         except:
             error_msg = "Client engineer read job has no entry for \"name\""
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
         
         if name == "":
@@ -849,41 +1162,41 @@ class Server:
                 id = job_json["id"]
             except:
                 error_msg = "Client left engineer name blank, but did not provide an entry for \"id\""
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
             logging.info(f"Attempting to read engineer with id {id} from the database.")
             engin = self.call_with_rlock(self.engin_utils.read_engineer_by_id, session, id)
             if engin is None:
                 error_msg = f"No engineer with id {id} exists in the database"
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
             msg["status"] = "success"
-            msg["engineers"] = [engin.to_json()]
+            msg["engineers"] = [engin.to_json(job_json.get("fields"))]
             logging.info(f"Successfully read engineer with id {id}:" + str(engin))
-            success = self.try_send_message("localhost", client_port, msg)
+            success = self.try_send_message(client, msg)
             if not success:
                 return
         elif name == "all":
             logging.info("Attempting to read all engineers.")
-            engins = self.call_with_rlock(self.engin_utils.read_all_engineers, session)
-            msg["engineers"] = [eng.to_json() for eng in engins]
+            self.send_all(session, job_json, client, self.engin_utils.json_engineers_all, "engineers")
+            return
         
         else:
             logging.info(f"Attempting to read engineer named {name}")
             engin = self.call_with_rlock(self.engin_utils.read_engineer_by_name, session, name)
             if engin is None:
                 error_msg = f"No engineer named {name} exists in the database"
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
-            msg["engineers"] = [engin.to_json()]
+            msg["engineers"] = [engin.to_json(job_json.get("fields"))]
         
         logging.info(f"Engineer(s) successfully read from the database.")
         msg["status"] = "success"
-        success = self.try_send_message("localhost", client_port, msg)
+        success = self.try_send_message(client, msg)
         if not success:
             return
 
-    def update_engineer(self, session, job_json, client_port):
+    def update_engineer(self, session, job_json, client):
         msg = {
             "status": None
         }
@@ -892,7 +1205,7 @@ class Server:
             engin_id = job_json["id"]
         except:
             error_msg = "Client update engineer job did not include an entry for \"id\""
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
 
         logging.info(f"Attempting to update engineer with ID {engin_id}")
@@ -901,7 +1214,7 @@ class Server:
 
         if curr_engin is None:
             error_msg = f"No engineer with ID {engin_id} exists in the database. Cannot update information for an engineer that doesn't exist."
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
 
         name = birth_year = birth_month = birth_date = vehicle_models = None
@@ -933,29 +1246,16 @@ class Server:
 
         vehicles_assigned = []
         vehicles_unassigned = []
+        vehicle_models = None
         try:
             vehicle_models = job_json["vehicles"]
-            logging.info(f"Attempting to update vehicle assignments for engineer with ID {engin_id}")
-            # Remove engineer from models not in the vehicle_models list
-            # Add engineer to models in the vehicle_models list
-            all_cars = self.call_with_rlock(self.car_utils.read_vehicles_all, session)
-            for car in all_cars:
-                if car.model in vehicle_models:
-                    new_engins = car.engineers + [curr_engin]
-                    self.call_with_wlock(self.car_utils.update_vehicle_db, session, car.id, engineers=new_engins)
-                    vehicles_assigned.append(car.model)
-                    logging.info(f"Successfully assigned engineer with ID {engin_id} to vehicle model {car.model}")
-                else:
-                    try:
-                        car.engineers.remove(curr_engin)
-                        self.call_with_wlock(self.car_utils.update_vehicle_db, session, car.id, engineers=car.engineers)
-                        vehicles_unassigned.append(car.model)
-                        logging.info(f"Successfully un-assigned engineer with ID {engin_id} from vehicle model {car.model}")
-                    except:
-                        logging.info(f"Engineer with ID {engin_id} was already not assigned to car model {car.model}")
-
         except:
             logging.info(missing_entry_msg.format(entry_name = "vehicles"))
+        if vehicle_models is not None:
+            logging.info(f"Attempting to update vehicle assignments for engineer with ID {engin_id}")
+            # Assign the engineer to models in the vehicle_models list and remove them from every other model
+            vehicles_assigned, vehicles_unassigned = self.call_with_wlock(self.engin_utils.set_assigned_vehicles_by_id, session, engin_id, vehicle_models)
+            logging.info(f"Engineer with ID {engin_id} is assigned to vehicle models {vehicles_assigned}, un-assigned from {vehicles_unassigned}")
 
         
         
@@ -965,7 +1265,7 @@ class Server:
 
         if engin_updated is None:
             error_msg = f"There was an issue updating engineer with ID {engin_id}. Most likely cause is a non-existant engineer with ID {engin_id}"
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
         
         if vehicles_assigned:
@@ -978,12 +1278,12 @@ class Server:
         msg["engineer"] = engin_updated.to_json()
         success_msg = f"Successfully updated info for engineer with ID {engin_id}.\nEngineer new info:\n{engin_updated.to_json()}"
         logging.info(success_msg)
-        success = self.try_send_message("localhost", client_port, msg)
+        success = self.try_send_message(client, msg)
         if not success:
             return
         
 
-    def add_laptop(self, session, job_json, client_port):
+    def add_laptop(self, session, job_json, client):
         msg = {
             "status": None
         }
@@ -993,40 +1293,33 @@ class Server:
         try:
             model = job_json["model"]
         except:
-            self.send_error_msg(error_text.format("model"), client_port)
+            self.send_error_msg(error_text.format("model"), client)
             return
         
         try:
             loan_year = job_json["loan_year"]
         except:
-            self.send_error_msg(error_text.format("loan_year"), client_port)
+            self.send_error_msg(error_text.format("loan_year"), client)
             return
 
         try:
             loan_month = job_json["loan_month"]
         except:
-            self.send_error_msg(error_text.format("loan_month"), client_port)
+            self.send_error_msg(error_text.format("loan_month"), client)
             return
         
         try:
             loan_date = job_json["loan_date"]
         except:
-            self.send_error_msg(error_text.format("loan_date"), client_port)
+            self.send_error_msg(error_text.format("loan_date"), client)
             return
         
         try:
             engin_name = job_json["engineer"]
         except:
-            self.send_error_msg(error_text.format("engineer"), client_port)
+            self.send_error_msg(error_text.format("engineer"), client)
             return
         
-        new_port = self.get_unused_port()
-        new_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        new_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        new_sock.bind(("localhost", new_port))
-        new_sock.listen()
-        new_sock.settimeout(1)
-
         # First, if engineer doesn't exist in the database, prompt client if we should add it without loaning to an engineer
         engin = self.call_with_rlock(self.engin_utils.read_engineer_by_name, session, engin_name)
         if engin is None:
@@ -1034,25 +1327,19 @@ class Server:
             logging.info(no_engin_text)
             msg["status"] = "no_engineer"
             msg["text"] = no_engin_text
-            msg["port"] = new_port
-            success = self.try_send_message("localhost", client_port, msg)
-            if not success:
+            client_response = self.try_prompt(session, client, msg)
+            if client_response is None:
                 return
 
-            client_response = self.get_client_response(new_sock)
             try:
                 proceed = client_response["response"]
             except:
                 error_msg = "Client response has no entry \"response\" to let the server know whether to add the laptop or not."
-                self.send_error_msg(error_msg, client_port)
-                new_sock.close()
-                self.used_ports.remove(new_port)
+                self.send_error_msg(error_msg, client)
                 return
             
             if proceed == 'n':
                 logging.info("Client chose not to proceed with adding the laptop.")
-                new_sock.close()
-                self.used_ports.remove(new_port)
                 return
             
         # Second, see if the engineer already has a laptop loaned to them. Prompt to replace if so
@@ -1062,34 +1349,26 @@ class Server:
             logging.info(prev_owner_text)
             msg["status"] = "previous_laptop"
             msg["text"] = prev_owner_text
-            msg["port"] = new_port
-            success = self.try_send_message("localhost", client_port, msg)
-            if not success:
+            client_response = self.try_prompt(session, client, msg)
+            if client_response is None:
                 return
 
-            client_response = self.get_client_response(new_sock)
-
             try:
                 replace = client_response["response"]
             except:
                 error_msg = "Client response has no entry \"response\" to let the server know whether to replace the engineer's currently loaned laptop."
-                self.send_error_msg(error_msg, client_port)
-                new_sock.close()
-                self.used_ports.remove(new_port)
+                self.send_error_msg(error_msg, client)
+                return
             
             if replace == 'n':
                 logging.info("Client chose not to replace the engineer's current laptop.\nAborted adding new laptop")
-                new_sock.close()
-                self.used_ports.remove(new_port)
                 return
             
         # Finally, add the laptop and send success/error back to client
         new_laptop = self.call_with_wlock(self.laptop_utils.add_laptop_db, session, model, date(loan_year, loan_month, loan_date), engin_name)
         if new_laptop is None:
             error_msg = "Laptop already exists in the database. Aborted adding the duplicate laptop."
-            self.send_error_msg(error_msg, client_port)
-            new_sock.close()
-            self.used_ports.remove(new_port)
+            self.send_error_msg(error_msg, client)
             return
         
         new_laptop_json = new_laptop.to_json()
@@ -1100,15 +1379,12 @@ class Server:
             logging.info(f"Successfully added laptop {model} and loaned it to engineer {engin_name}")
         
         msg["replaced"] = False if prev_laptop is None else True
-        success = self.try_send_message("localhost", client_port, {**msg, **new_laptop_json})
+        success = self.try_send_message(client, {**msg, **new_laptop_json})
         if not success:
             return
-        
-        new_sock.close()
-        self.used_ports.remove(new_port)
 
 
-    def delete_laptop(self, session, job_json, client_port):
+    def delete_laptop(self, session, job_json, client):
         msg = {
             "status": None
         }
@@ -1117,7 +1393,7 @@ class Server:
             engin_name = job_json["engineer"]
         except:
             error_msg = "Client laptop delete job had no entry for \"engineer\""
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
         
         if engin_name == "":
@@ -1125,7 +1401,7 @@ class Server:
                 laptop_id = job_json["id"]
             except:
                 error_msg = "Client unowned laptop delete job had no entry for \"id\""
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
             
             try:
@@ -1134,24 +1410,24 @@ class Server:
                 success_msg = f"Successfully deleted laptop with id {laptop_id}"
                 logging.info(success_msg)
                 msg["status"] = "success"
-                success = self.try_send_message("localhost", client_port, msg)
+                success = self.try_send_message(client, msg)
                 if not success:
                     return
                 return
             except UnmappedInstanceError:
                 error_msg = f"Laptop with id {laptop_id} has already been deleted from the database."
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
         else:
             logging.info(f"Attempting to delete laptop loaned by {engin_name}")
             self.call_with_wlock(self.laptop_utils.delete_laptop_by_owner, session, engin_name)
             logging.info(f"Successfully deleted laptop loaned by {engin_name}")
             msg["status"] = "success"
-            success =self.try_send_message("localhost", client_port, msg)
+            success =self.try_send_message(client, msg)
             if not success:
                 return
 
-    def query_laptop(self, session, job_json, client_port):
+    def query_laptop(self, session, job_json, client):
         msg = {
             "status": None
         }
@@ -1160,7 +1436,7 @@ class Server:
             model = job_json["model"]
         except:
             error_msg = "Client laptop read job had no entry for \"model\""
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
         
         if model == "":
@@ -1168,49 +1444,44 @@ class Server:
                 engin_name = job_json["engineer"]
             except:
                 error_msg = "Client laptop read job left model blank, but did not provide an entry for \"engineer\""
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
             
             logging.info(f"Attempting to read laptop loaned by engineer {engin_name}")
             laptop = self.call_with_rlock(self.laptop_utils.read_laptop_by_owner, session, engin_name)
             if laptop is None:
                 error_msg = f"No laptop is loaned by engineer {engin_name}"
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
             msg["status"] = "success"
-            msg["laptops"] = [laptop.to_json()]
+            msg["laptops"] = [laptop.to_json(job_json.get("fields"))]
             logging.info(f"Successfully read laptop loaned by engineer {engin_name}")
-            success = self.try_send_message("localhost", client_port, msg)
+            success = self.try_send_message(client, msg)
             if not success:
                 return
             return
 
         elif model == "all":
             logging.info("Attempting to read all laptops")
-            laptops = self.call_with_rlock(self.laptop_utils.read_all_laptops, session)
-            if not laptops:
-                error_msg = "No laptops exist in the database"
-                self.send_error_msg(error_msg, client_port)
-                return
-            msg["laptops"] = [lap.to_json() for lap in laptops]
-            logging.info("Successfully read all laptops")
+            self.send_all(session, job_json, client, self.laptop_utils.json_laptops_all, "laptops", "No laptops exist in the database")
+            return
         
         else:
             logging.info(f"Attempting to read laptops with model {model}")
             laptops = self.call_with_rlock(self.laptop_utils.read_laptops_by_model, session, model)
             if not laptops:
                 error_msg = f"No laptops of model {model} exist in the database"
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
-            msg["laptops"] = [lap.to_json() for lap in laptops]
+            msg["laptops"] = [lap.to_json(job_json.get("fields")) for lap in laptops]
             logging.info(f"Successfully read laptops with model {model}")
         
         msg["status"] = "success"
-        success = self.try_send_message("localhost", client_port, msg)
+        success = self.try_send_message(client, msg)
         if not success:
             return
         
-    def update_laptop(self, session, job_json, client_port):
+    def update_laptop(self, session, job_json, client):
         msg = {
             "status": None
         }
@@ -1219,7 +1490,7 @@ class Server:
             laptop_id = job_json["id"]
         except:
             error_msg = "Client update laptop job has no entry for \"id\""
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
         
         logging.info(f"Attempting to update laptop ID {laptop_id} in the database.")
@@ -1228,7 +1499,7 @@ class Server:
 
         if curr_laptop is None:
             error_msg = f"No laptop exists with ID {laptop_id}. Cannot update a laptop that doesn't exist."
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
 
         model = loan_year = loan_month = loan_date = engineer_name = None
@@ -1268,18 +1539,18 @@ class Server:
 
         if updated_laptop is None:
             error_msg = f"There was a problem updating laptop ID {laptop_id}.\nMost likely cause is a non-existant laptop with ID {laptop_id}"
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
         
         msg["status"] = "success"
         msg["laptop"] = updated_laptop.to_json()
         success_msg = f"Successfully updated info for laptop ID {laptop_id}\nNew laptop info:{updated_laptop.to_json()}"
         logging.info(success_msg)
-        success = self.try_send_message("localhost", client_port, msg)
+        success = self.try_send_message(client, msg)
         if not success:
             return
 
-    def add_contact_details(self, session, job_json, client_port):
+    def add_contact_details(self, session, job_json, client):
         msg = {
             "status": None
         }
@@ -1288,45 +1559,45 @@ class Server:
         try:
             engin_name = job_json["engineer"]
         except:
-            self.send_error_msg(error_msg.format("engineer"), client_port)
+            self.send_error_msg(error_msg.format("engineer"), client)
             return
         
         try:
             phone_number = job_json["phone_number"]
         except:
-            self.send_error_msg(error_msg.format("phone_number"), client_port)
+            self.send_error_msg(error_msg.format("phone_number"), client)
             return
 
         try:
             address = job_json["address"]
         except:
-            self.send_error_msg(error_msg.format("address"), client_port)
+            self.send_error_msg(error_msg.format("address"), client)
             return
         
         # Attempt to add the new contact details, report error to client if duplicate or engineer doesn't exist
         engin = self.call_with_rlock(self.engin_utils.read_engineer_by_name, session, engin_name)
         if engin is None:
             error_msg = f"Engineer {engin_name} does not exist in the database. Contact details cannot be added for a non-existant engineer."
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
         
         new_contact = self.call_with_wlock(self.contact_utils.add_contact_details_db, session, phone_number, address, engin_name)
         if new_contact is None:
             error_msg = f"Detected duplicate contact details. Aborted adding duplicate."
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
         
         success_msg = f"Successfully added contact details for engineer {engin_name}"
         new_contact_json = new_contact.to_json()
         logging.info(success_msg)
         msg["status"] = "success"
-        success = self.try_send_message("localhost", client_port, {**msg, **new_contact_json})
+        success = self.try_send_message(client, {**msg, **new_contact_json})
         if not success:
             return
         return
      
 
-    def delete_contact_details(self, session, job_json, client_port):
+    def delete_contact_details(self, session, job_json, client):
         msg = {
             "status": None
         }
@@ -1335,7 +1606,7 @@ class Server:
             engin_name = job_json["engineer"]
         except:
             error_msg = "Client contact details delete job had no entry for \"engineer\""
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
         
         if engin_name == "":
@@ -1343,7 +1614,7 @@ class Server:
                 contact_id = job_json["id"]
             except:
                 error_msg = f"Client response ommitted engineer name but did not have an entry for contact details \"id\""
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
             
             try:
@@ -1351,19 +1622,19 @@ class Server:
                 self.call_with_wlock(self.contact_utils.delete_contact_details_by_id, session, contact_id)
                 success_msg = f"Successfully deleted contact details with ID {contact_id}"
                 msg["status"] = "success"
-                success = self.try_send_message("localhost", client_port, msg)
+                success = self.try_send_message(client, msg)
                 if not success:
                     return
                 return
             except UnmappedInstanceError:
                 error_msg = f"Contact details with ID {contact_id} has already been deleted from the database."
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
         else:
             engin = self.call_with_rlock(self.engin_utils.read_engineer_by_name, session, engin_name)
             if engin is None:
                 error_msg = f"Engineer {engin_name} does not exist in the database.\nAborted deleting contact details for non-existant engineer {engin_name}"
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
             logging.info(f"Attempting to delete contact details for engineer {engin_name}")
 
@@ -1371,17 +1642,17 @@ class Server:
                 self.call_with_wlock(self.contact_utils.delete_contact_details_by_engin_id, session, engin.id)
                 logging.info(f"Successfully deleted all contact details for engineer {engin_name}")
                 msg["status"] = "success"
-                success = self.try_send_message("localhost", client_port, msg)
+                success = self.try_send_message(client, msg)
                 if not success:
                     return
                 return
             except UnmappedInstanceError:
                 error_msg = f"Engineer {engin_name} has no contact details to delete. Aborted deleting non-existant contact details."
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
 
 
-    def query_contact_details(self, session, job_json, client_port):
+    def query_contact_details(self, session, job_json, client):
         msg = {
             "status": None
         }
@@ -1390,7 +1661,7 @@ class Server:
             engin_name = job_json["engineer"]
         except:
             error_msg = "Client contact details read job had no entry \"engineer\" for engineer name"
-            self.send_error_msg(error_msg, client_port)
+            self.send_error_msg(error_msg, client)
             return
         
         if engin_name == "":
@@ -1398,52 +1669,172 @@ class Server:
                 id = job_json["id"]
             except:
                 error_msg = "Client contact details read job left engineer name blank, but did not provide an entry \"id\" for contact details id."
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
             logging.info(f"Attempting to read contact details with id {id}")
             contact = self.call_with_rlock(self.contact_utils.read_contact_details_by_id, session, id)
             if contact is None:
                 error_msg = f"No contact details with id {id} exists in the database."
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
             logging.info(f"Successfully read contact details with id {id}")
-            msg["contact_details"] = [contact.to_json()]
+            msg["contact_details"] = [contact.to_json(job_json.get("fields"))]
         
         elif engin_name == "all":
             logging.info("Attempting to read all contact details.")
-            contacts = self.call_with_rlock(self.contact_utils.read_all_contact_details, session)
-            if not contacts:
-                error_msg = "No contact details exist in the database."
-                self.send_error_msg(error_msg, client_port)
-                return
-            logging.info("Successfully read all contact details.")
-            msg["contact_details"] = [contact.to_json() for contact in contacts]
+            self.send_all(session, job_json, client, self.contact_utils.json_contact_details_all, "contact_details", "No contact details exist in the database.")
+            return
 
         else:
             logging.info(f"Attempting to read contact details for engineer {engin_name}")
             engin = self.call_with_rlock(self.engin_utils.read_engineer_by_name, session, engin_name)
             if engin is None:
                 error_msg = f"No engineer named {engin_name} exists in the database. Cannot read contact details for non-existant engineer."
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
             contacts = self.call_with_rlock(self.contact_utils.read_contact_details_by_engin_id, session, engin.id)
             if not contacts:
                 error_msg = f"No contact details exist for engineer {engin_name}"
-                self.send_error_msg(error_msg, client_port)
+                self.send_error_msg(error_msg, client)
                 return
             logging.info(f"Successfully read contact details for engineer {engin_name}")
-            msg["contact_details"] = [contact.to_json() for contact in contacts]
+            msg["contact_details"] = [contact.to_json(job_json.get("fields")) for contact in contacts]
         
         msg["status"] = "success"
-        success = self.try_send_message("localhost", client_port, msg)
+        success = self.try_send_message(client, msg)
+        if not success:
+            return
+
+    def parse_bulk_record(self, record):
+        """Validate one bulk_add record like the matching add action does.
+        Returns the record's data type and values, or an error text in place of the values."""
+        error_text = "Bulk insert record has no valid entry for \"{}\""
+        data_type = record.get("data_type") if isinstance(record, dict) else None
+        if data_type not in ["vehicle", "engineer", "laptop", "contact_details"]:
+            return data_type, "Bulk insert record entry \"data_type\" is not one of [\"vehicle\", \"engineer\", \"laptop\", \"contact_details\"]"
+
+        if data_type == "vehicle":
+            fields = ["model", "quantity", "price", "manufacture_year", "manufacture_month", "manufacture_date"]
+        elif data_type == "engineer":
+            fields = ["name", "birth_year", "birth_month", "birth_date"]
+        elif data_type == "laptop":
+            fields = ["model", "loan_year", "loan_month", "loan_date", "engineer"]
+        else:
+            fields = ["engineer", "phone_number", "address"]
+        for field in fields:
+            if field not in record:
+                return data_type, error_text.format(field)
+
+        try:
+            if data_type == "vehicle":
+                if not record["model"]:
+                    return data_type, "IntegrityError: model name must not be empty (\"\")"
+                if record["quantity"] < 0:
+                    return data_type, "IntegrityError: quantity must be no less than 0"
+                if record["price"] < 1:
+                    return data_type, "IntegrityError: price must be no less than 1"
+                if record["manufacture_year"] < 1920 or record["manufacture_year"] > 2021:
+                    return data_type, "IntegrityError: manufacture year must be between the years (1920-2021)"
+                manufacture_date = date(record["manufacture_year"], record["manufacture_month"], record["manufacture_date"])
+                return data_type, {"model": record["model"], "quantity": record["quantity"], "price": record["price"], "manufacture_date": manufacture_date}
+
+            if data_type == "engineer":
+                if record["name"] == "":
+                    return data_type, "IntegrityError: Client engineer insert job gave an empty \"name\" entry"
+                if record["birth_year"] < 1920 or record["birth_year"] > 2021:
+                    return data_type, "IntegrityError: Client engineer insert job gave a year not in the range (1920-2021)"
+                birthday = date(record["birth_year"], record["birth_month"], record["birth_date"])
+                return data_type, {"name": record["name"], "birthday": birthday}
+
+            if data_type == "laptop":
+                date_loaned = date(record["loan_year"], record["loan_month"], record["loan_date"])
+                return data_type, {"model": record["model"], "date_loaned": date_loaned, "engineer": record["engineer"]}
+
+            return data_type, {"engineer": record["engineer"], "phone_number": record["phone_number"], "address": record["address"]}
+        except (TypeError, ValueError) as err:
+            return data_type, f"{type(err).__name__}: {err}"
+
+    def bulk_add(self, session, job_json, client):
+        msg = {
+            "status": None
+        }
+
+        try:
+            records = job_json["records"]
+            if not isinstance(records, list):
+                raise TypeError
+        except:
+            self.send_error_msg("Client bulk insert job has no \"records\" array of records to insert", client)
+            return
+
+        # Validate every record before inserting any of them, invalid records are reported and skipped
+        results = [None] * len(records)
+        valid = []
+        for i, record in enumerate(records):
+            data_type, values = self.parse_bulk_record(record)
+            if isinstance(values, str):
+                results[i] = {"status": "error", "text": values}
+            else:
+                valid.append((i, data_type, values))
+
+        logging.info(f"Attempting to bulk insert {len(valid)} of {len(records)} records")
+        inserted = self.call_with_wlock(self.bulk_utils.add_records_db, session, [(data_type, values) for _, data_type, values in valid])
+        if inserted is None:
+            self.send_error_msg("IntegrityError: Bulk insert conflicted with another client's changes. Aborted adding every record.", client)
+            return
+        for (i, _, _), result in zip(valid, inserted):
+            results[i] = result
+
+        succeeded = sum(1 for result in results if result["status"] != "error")
+        logging.info(f"Finished bulk insert, {succeeded} of {len(records)} records were added or updated")
+        msg["status"] = "success"
+        msg["results"] = results
+        success = self.try_send_message(client, msg)
         if not success:
             return
 
 @click.command()
 @click.argument("port", nargs=1, type=int)
 @click.option("-s", "--single-thread", is_flag=True)
-def main(port, single_thread):
-    Server(port, single_thread)
+@click.option("--mode", type=click.Choice(["threaded", "asyncio"]), default="threaded", help="Read connections on a thread each, or all on one asyncio event loop.")
+@click.option("--threads", type=int, default=16, help="Worker threads that run jobs. Each holds a database connection while it runs a job, so size the pool (TRAINING_POOL_SIZE plus TRAINING_MAX_OVERFLOW) to match.")
+@click.option("--queue-size", type=int, default=64, help="Jobs that may wait for a worker thread before clients are told the server is busy.")
+@click.option("--workers", type=click.IntRange(min=1), default=1, help="Server processes accepting on the same port.")
+@click.option("--lock-mode", type=click.Choice(["table", "database"]), default="table", help="Serialize conflicting jobs with table locks in the server, or leave isolation to the database.")
+@click.option("--isolation-level", type=click.Choice(ISOLATION_LEVELS), default=None, help="Transaction isolation level for job sessions. Defaults to the database's own default.")
+@click.option("--transaction-scope", type=click.Choice(["call", "job"]), default=None, help="Commit after every database call, or run each job as one transaction that is run again after a deadlock or serialization failure (needs --lock-mode database). Defaults to job with --lock-mode database, call otherwise. Jobs that prompt the client commit before each prompt and aren't run again after it.")
+@click.option("--replica-strategy", type=click.Choice(STRATEGIES), default="round-robin", help="How read jobs are spread over the read replicas in TRAINING_REPLICA_URLS.")
+@click.option("--read-your-writes", type=click.FloatRange(min=0), default=5.0, help="Seconds a client keeps reading from the primary after it writes, so it sees its own changes before they reach the replicas.")
+@click.option("--cache-size", type=click.IntRange(min=0), default=1024, help="Engineer, vehicle, laptop and contact details lookups kept in memory, 0 turns the cache off. Off with --workers.")
+@click.option("--json-cache-size", type=click.IntRange(min=0), default=50000, help="Rows kept encoded as JSON for reads of whole tables, 0 turns the cache off.")
+@click.option("--feed-poll-interval", type=click.FloatRange(min=0, min_open=True), default=1.0, help="Seconds between checks for change events committed by other processes, subscribers hear of this process's own commits right away.")
+@click.option("--feed-retention", type=click.IntRange(min=1), default=10000, help="Change events kept for subscribers resuming from a sequence number.")
+@click.option("--feed-gap-timeout", type=click.FloatRange(min=0, min_open=True), default=5.0, help="Seconds the change feed waits for a missing sequence number to be committed before taking its transaction to have rolled back and sending the events after it.")
+@click.option("--prompt-timeout", type=click.FloatRange(min=0, min_open=True), default=60.0, help="Seconds a job waits for the client to answer a prompt before it fails and frees its worker thread.")
+def main(port, single_thread, mode, threads, queue_size, workers, lock_mode, isolation_level, transaction_scope, replica_strategy, read_your_writes, cache_size, json_cache_size, feed_poll_interval, feed_retention, feed_gap_timeout, prompt_timeout):
+    if mode == "asyncio":
+        from training.server.async_server import AsyncServer
+        server_class = AsyncServer
+    else:
+        server_class = Server
+
+    if transaction_scope == "job" and lock_mode == "table":
+        # Table locks are released after each call while the job's open transaction still holds its row locks,
+        # so two jobs could each wait on a lock the other holds
+        raise click.UsageError("--transaction-scope job leaves isolation to the database, it needs --lock-mode database")
+    server_kwargs = {"lock_mode": lock_mode, "isolation_level": isolation_level, "transaction_scope": transaction_scope,
+                     "replica_strategy": replica_strategy, "read_your_writes": read_your_writes,
+                     "cache_size": cache_size, "json_cache_size": json_cache_size,
+                     "feed_poll_interval": feed_poll_interval, "feed_retention": feed_retention, "feed_gap_timeout": feed_gap_timeout, "prompt_timeout": prompt_timeout}
+    if workers == 1:
+        server_class(port, single_thread, threads, queue_size, **server_kwargs)
+        return
+    if single_thread:
+        raise click.UsageError("--single-thread only runs jobs one at a time within a process, it cannot be combined with --workers")
+    # Each process would cache its own copies and never hear of the other processes' writes
+    server_kwargs["cache_size"] = 0
+    from training.server.workers import run_workers
+    run_workers(server_class, port, workers, single_thread, threads, queue_size, **server_kwargs)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
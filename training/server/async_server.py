@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import json
+from json import JSONDecodeError
+from training.server.__main__ import Server
+from training.server.channels import ConnectionChannel, PendingResponses
+from training.sock_utils import encode_frame, FRAME_HEADER, MAX_FRAME_SIZE, LEGACY_MESSAGE_START
+
+class StreamConnection:
+    """Sending side of an asyncio stream that jobs on worker threads can answer through."""
+
+    def __init__(self, writer, loop):
+        self.writer = writer
+        self.loop = loop
+        self.write_lock = asyncio.Lock()
+
+    def send(self, msg):
+        # Called from worker threads, the write itself has to happen on the event loop
+        future = asyncio.run_coroutine_threadsafe(self.write_frame(encode_frame(msg)), self.loop)
+        future.result()
+
+    async def write_frame(self, frame):
+        async with self.write_lock:
+            self.writer.write(frame)
+            await self.writer.drain()
+
+
+async def read_frame(reader, header_start=b""):
+    """Read one length-prefixed message from an asyncio stream. Returns None once the peer closes."""
+    try:
+        header = header_start + await reader.readexactly(FRAME_HEADER.size - len(header_start))
+        (length,) = FRAME_HEADER.unpack(header)
+        if length > MAX_FRAME_SIZE:
+            raise ValueError(f"Frame of {length} bytes is larger than the {MAX_FRAME_SIZE} byte limit")
+        payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+    # Note: caller needs to catch errors thrown by json.loads
+    return json.loads(payload.decode("utf-8"))
+
+
+async def read_legacy_message(reader, first_byte):
+    """Read a legacy message, which ends when the client closes the socket. Raises ValueError once it is
+    longer than MAX_FRAME_SIZE, like read_frame, rather than buffering whatever the client sends."""
+    chunks = [first_byte]
+    size = len(first_byte)
+    while True:
+        chunk = await reader.read(65536)
+        if not chunk:
+            return b"".join(chunks)
+        size += len(chunk)
+        if size > MAX_FRAME_SIZE:
+            raise ValueError(f"Legacy message is larger than the {MAX_FRAME_SIZE} byte limit")
+        chunks.append(chunk)
+
+
+class AsyncServer(Server):
+    """Server that accepts and reads every client connection on one asyncio event loop.
+
+    Idle connections cost no thread. Jobs still call the blocking db_utils functions,
+    so they run on the server's job pool.
+    """
+
+    def __init__(self, listen_port, handle_jobs_multithreaded=False, worker_threads=16, queue_size=64, **kwargs):
+        self.loop = None
+        super().__init__(listen_port, handle_jobs_multithreaded, worker_threads, queue_size, **kwargs)
+
+    def listen_for_jobs(self, single_threaded=False):
+        asyncio.run(self.serve(single_threaded))
+
+    async def serve(self, single_threaded=False):
+        self.loop = asyncio.get_running_loop()
+        self.sock.setblocking(False)
+        server = await asyncio.start_server(lambda reader, writer: self.handle_stream(reader, writer, single_threaded), sock=self.sock)
+        logging.info("Accepting connections on the asyncio event loop")
+        async with server:
+            while not self.shutdown:
+                await asyncio.sleep(0.5)
+
+    def submit_job(self, message_dict, single_threaded=False, client=None):
+        """Queue a job for the job pool. Returns False if the queue is full."""
+        logging.info(f"Successfully received message from client. Queueing job for a worker thread {message_dict}.")
+        return self.job_pool.submit(self.run_job, message_dict, single_threaded, client) is not None
+
+    async def write_from_loop(self, conn, msg):
+        # StreamConnection.send waits on the event loop, so the loop itself has to await the write
+        try:
+            await conn.write_frame(encode_frame(msg))
+        except OSError as err:
+            logging.error(f"Lost connection while sending a response: {err}")
+            return False
+        return True
+
+    async def handle_stream(self, reader, writer, single_threaded=False):
+        address = writer.get_extra_info("peername")
+        first_byte = await reader.read(1)
+        if not first_byte:
+            writer.close()
+            return
+
+        if first_byte == LEGACY_MESSAGE_START:
+            # Legacy client: one JSON message terminated by the client closing the socket
+            try:
+                message_bytes = await read_legacy_message(reader, first_byte)
+            except ValueError as err:
+                logging.error(f"Dropping connection from {address[0]}: {err}")
+                return
+            finally:
+                writer.close()
+            try:
+                message_dict = json.loads(message_bytes.decode("utf-8"))
+            except (JSONDecodeError, UnicodeDecodeError):
+                return
+            if not self.submit_job(message_dict, single_threaded):
+                # Dialing back to the client's port blocks, so keep it off the event loop
+                self.loop.run_in_executor(None, self.send_busy_msg, message_dict)
+            return
+
+        conn = StreamConnection(writer, self.loop)
+        # Every in-band job answers through the event loop, so follow-up responses are always routed through
+        # pending. Jobs without a request_id wait on the None key, their client sends nothing else meanwhile
+        pending = PendingResponses()
+        logging.info(f"Accepted persistent connection from {address[0]}")
+        header_start = first_byte
+        while not self.shutdown:
+            try:
+                message_dict = await read_frame(reader, header_start)
+            except (JSONDecodeError, ValueError) as err:
+                logging.error(f"Dropping connection from {address[0]} after a malformed frame: {err}")
+                break
+            except OSError:
+                break
+            header_start = b""
+            if message_dict is None:
+                # client closed the connection
+                break
+            request_id = message_dict.get("request_id")
+            if request_id is not None and not isinstance(request_id, (int, str)):
+                error_msg = "Client message entry \"request_id\" must be an integer or a string"
+                logging.error(error_msg)
+                if not await self.write_from_loop(conn, {"status": "error", "text": error_msg}):
+                    break
+                continue
+            if pending.deliver(message_dict):
+                # follow-up response to a job that prompted the client
+                continue
+            if "port" in message_dict:
+                # Legacy reply mode: results are sent to the client's listen port
+                if not self.submit_job(message_dict, single_threaded):
+                    self.loop.run_in_executor(None, self.send_busy_msg, message_dict)
+            elif not self.submit_job(message_dict, single_threaded, ConnectionChannel(conn, request_id, pending)):
+                logging.warning(f"Job queue is full, turning away job {message_dict}")
+                busy_msg = self.busy_msg()
+                if request_id is not None:
+                    busy_msg["request_id"] = request_id
+                if not await self.write_from_loop(conn, busy_msg):
+                    break
+        pending.close()
+        self.change_feed.unsubscribe(conn)
+        writer.close()
+        logging.info(f"Closed persistent connection from {address[0]}")
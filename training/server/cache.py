@@ -0,0 +1,198 @@
+"""In-process caches of the entity lookups in db_utils and of rows encoded as JSON, invalidated by the writes in db_utils."""
+import json
+import threading
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SessionClass
+
+class ReadCache:
+    """LRU cache of lookup results by key, e.g. ("engineers", "name", name), holding at most max_entries.
+
+    Each entry is tagged with the rows it was built from, e.g. ("engineers", 3). A write marks the rows it
+    changes as stale on its session, and every entry tagged with one of them is dropped when that session's
+    transaction ends. Results are kept as copies detached from any session and merged into the session asking
+    for them, so a caller can change what it gets back without changing the cache.
+
+    A session that has written something and not committed it yet reads past the cache, so it sees its own
+    writes. A result read from a replica is not cached, it may be older than the primary.
+    """
+
+    def __init__(self, max_entries=0):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # key -> (detached copy, tags), least recently used first
+        self.entries = OrderedDict()
+        # tag -> keys of the entries built from that row
+        self.tagged = {}
+        # Counts transactions that dropped entries, a result read before one of them may be stale
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def resize(self, max_entries):
+        with self.lock:
+            self.max_entries = max_entries
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tagged.clear()
+            self.generation += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries
+            }
+
+    def lookup(self, session, key, load, tags):
+        """The result of load() for key, from the cache if it's there. tags(obj) gives the rows obj was built from.
+        None and empty results aren't cached, so adding a row never has to invalidate anything."""
+        entry = None
+        with self.lock:
+            usable = self.max_entries > 0 and not session.info.get("stale_tags")
+            if usable:
+                entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+                generation = self.generation
+        if entry is not None:
+            return merge(session, entry[0])
+
+        value = load()
+        if usable and value and not session.info.get("replica"):
+            objs = value if isinstance(value, list) else [value]
+            self.put(key, merge(SessionClass(), value, detach=True), {tag for obj in objs for tag in tags(obj)}, generation)
+        return value
+
+    def put(self, key, copy, tags, generation):
+        with self.lock:
+            if generation != self.generation:
+                # A write committed while the value was being read
+                return
+            self.remove(key)
+            self.entries[key] = (copy, tags)
+            for tag in tags:
+                self.tagged.setdefault(tag, set()).add(key)
+            self.evict()
+
+    def invalidate(self, session, tags):
+        """Mark rows session is writing as stale, their entries are dropped when its transaction ends."""
+        session.info.setdefault("stale_tags", set()).update(tags)
+
+    def drop(self, tags):
+        with self.lock:
+            self.generation += 1
+            for tag in tags:
+                for key in list(self.tagged.get(tag, ())):
+                    self.remove(key)
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[1]:
+            keys = self.tagged[tag]
+            keys.discard(key)
+            if not keys:
+                del self.tagged[tag]
+
+    def evict(self):
+        while len(self.entries) > self.max_entries:
+            self.remove(next(iter(self.entries)))
+
+
+def merge(session, value, detach=False):
+    # merge(load=False) copies the loaded state of clean objects without querying the database
+    copy = [session.merge(obj, load=False) for obj in value] if isinstance(value, list) else session.merge(value, load=False)
+    if detach:
+        session.close()
+    return copy
+
+
+class RowJSONCache:
+    """LRU cache of each row's to_json dict encoded as JSON bytes, keyed by (table, id), holding at most max_entries.
+
+    An entry is kept along with the version it was encoded at: the row's version and those of the rows of other
+    tables it shows (a vehicle's engineers, a laptop's engineer). A row read at a different version is encoded
+    again and replaces the entry. So an entry is never sent stale, even when another process wrote the row.
+    Writes in db_utils also drop the entries of the rows they change, so deleted rows don't hold on to space.
+    """
+
+    def __init__(self, max_entries=0):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # (table, id) -> (version, encoded JSON), least recently used first
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def resize(self, max_entries):
+        with self.lock:
+            self.max_entries = max_entries
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            encodes = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / encodes if encodes else 0.0,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries
+            }
+
+    def encode(self, table, row_id, version, row, to_json):
+        """The JSON bytes of to_json(row), for the row of table with row_id read at version."""
+        key = (table, row_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        encoded = json.dumps(to_json(row)).encode('utf-8')
+        if self.max_entries > 0:
+            with self.lock:
+                self.entries[key] = (version, encoded)
+                self.entries.move_to_end(key)
+                self.evict()
+        return encoded
+
+    def drop(self, tags):
+        # Tags name rows the same way keys do
+        with self.lock:
+            for tag in tags:
+                self.entries.pop(tag, None)
+
+    def evict(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+# Disabled until the server sizes them, other users of db_utils may write to the database without invalidating read_cache
+read_cache = ReadCache()
+json_cache = RowJSONCache()
+
+@event.listens_for(SessionClass, "after_transaction_end")
+def drop_stale_entries(session, transaction):
+    # Committed or rolled back, either way the rows written are no longer pending
+    if transaction.parent is None and session.info.get("stale_tags"):
+        tags = session.info.pop("stale_tags")
+        read_cache.drop(tags)
+        json_cache.drop(tags)
@@ -0,0 +1,187 @@
+import socket
+import threading
+import queue
+from time import monotonic
+from select import select
+from json import JSONDecodeError
+from training.sock_utils import send_message, decode_message_chunks, get_data_from_connection
+
+class PromptTimeout(Exception):
+    """The client did not respond to a prompt in time."""
+
+
+class PortChannel:
+    """Legacy reply channel: dial back to the listen port the client named in its job."""
+
+    def __init__(self, port, host="localhost"):
+        self.host = host
+        self.port = port
+        # Jobs from the same client share a key, used to send its reads where its writes are visible
+        self.client_key = ("port", port)
+
+    def __str__(self):
+        return f"client port {self.port}"
+
+    def send(self, msg):
+        send_message(self.host, self.port, msg)
+
+    def prompt(self, msg, timeout=None):
+        """Send msg with a one-off port for the client to respond to, then wait for that response.
+        Raises PromptTimeout if it takes longer than timeout seconds."""
+        listen_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listen_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listen_sock.bind((self.host, 0))
+        listen_sock.listen()
+        listen_sock.settimeout(1)
+        try:
+            self.send({**msg, "port": listen_sock.getsockname()[1]})
+            return self.get_client_response(listen_sock, timeout)
+        finally:
+            listen_sock.close()
+
+    def get_client_response(self, listen_sock, timeout=None):
+        deadline = None if timeout is None else monotonic() + timeout
+        client_response = None
+        while client_response is None:
+            if deadline is not None and monotonic() > deadline:
+                raise PromptTimeout(f"{self} did not respond within {timeout} seconds")
+            message_chunks = get_data_from_connection(listen_sock)
+
+            if not message_chunks:
+                continue
+
+            try:
+                message_dict = decode_message_chunks(message_chunks)
+                client_response = message_dict
+                break
+            except JSONDecodeError:
+                continue
+        return client_response
+
+
+class PendingResponses:
+    """Follow-up responses that jobs on one connection are waiting for, keyed by request_id."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queues = {}
+
+    def expect(self, request_id):
+        response_queue = queue.Queue(maxsize=1)
+        with self.lock:
+            self.queues[request_id] = response_queue
+        return response_queue
+
+    def discard(self, request_id):
+        with self.lock:
+            self.queues.pop(request_id, None)
+
+    def deliver(self, msg):
+        """Hand msg to the job waiting on its request_id. Returns False if no job is waiting for it."""
+        with self.lock:
+            response_queue = self.queues.pop(msg.get("request_id"), None)
+        if response_queue is None:
+            return False
+        response_queue.put(msg)
+        return True
+
+    def close(self):
+        # Wake any job still waiting so it can see the client is gone
+        with self.lock:
+            waiting = list(self.queues.values())
+            self.queues.clear()
+        for response_queue in waiting:
+            response_queue.put(None)
+
+
+class ConnectionChannel:
+    """In-band reply channel: answer on the persistent connection the job arrived on.
+
+    Jobs that carry a request_id have it echoed in every response, so a client can pipeline
+    several jobs on one connection and match responses that come back out of order.
+    """
+
+    def __init__(self, conn, request_id=None, pending=None):
+        self.conn = conn
+        self.request_id = request_id
+        self.pending = pending
+        self.client_key = conn
+
+    def __str__(self):
+        if self.request_id is None:
+            return "client connection"
+        return f"client connection (request {self.request_id})"
+
+    def send(self, msg):
+        if self.request_id is not None:
+            msg = {**msg, "request_id": self.request_id}
+        self.conn.send(msg)
+
+    def prompt(self, msg, timeout=None):
+        """Send msg and wait for the client's response on the same connection. Returns None if the client hung up,
+        raises PromptTimeout if it takes longer than timeout seconds."""
+        if self.pending is None:
+            # The job runs on the thread reading this connection, so the next frame is the response
+            self.send(msg)
+            if timeout is not None and not select([self.conn.sock], [], [], timeout)[0]:
+                raise PromptTimeout(f"{self} did not respond within {timeout} seconds")
+            return self.conn.recv()
+        response_queue = self.pending.expect(self.request_id)
+        try:
+            self.send(msg)
+        except OSError:
+            self.pending.discard(self.request_id)
+            raise
+        try:
+            return response_queue.get(timeout=timeout)
+        except queue.Empty:
+            # A response arriving later is taken for a new job
+            self.pending.discard(self.request_id)
+            raise PromptTimeout(f"{self} did not respond within {timeout} seconds")
+
+
+class DeferredChannel:
+    """Wraps a reply channel and holds back sent messages until flush, so they go out after the job commits.
+
+    Prompts still reach the client right away, after any messages held back before them. The job has
+    to commit before it prompts (Server.try_prompt does), or those messages go out uncommitted.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.deferred = []
+
+    def __str__(self):
+        return str(self.channel)
+
+    def send(self, msg):
+        self.deferred.append(msg)
+
+    def prompt(self, msg, timeout=None):
+        self.flush()
+        return self.channel.prompt(msg, timeout)
+
+    def flush(self):
+        while self.deferred:
+            self.channel.send(self.deferred.pop(0))
+
+    def discard(self):
+        self.deferred.clear()
+
+
+class VersionedChannel:
+    """Wraps a reply channel and adds the version of the tables a read job read to each message it sends."""
+
+    def __init__(self, channel, version):
+        self.channel = channel
+        self.version = version
+        self.client_key = getattr(channel, "client_key", None)
+
+    def __str__(self):
+        return str(self.channel)
+
+    def send(self, msg):
+        self.channel.send({**msg, "version": self.version})
+
+    def prompt(self, msg, timeout=None):
+        return self.channel.prompt(msg, timeout)
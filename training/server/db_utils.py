@@ -1,213 +1,593 @@
+import json
 from sqlalchemy.engine.base import Engine
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import IntegrityError, DBAPIError
 from training.server.base import Session
+from training.server.locks import uses_tables
+from training.server.transactions import is_retryable, commit, rollback, savepoint
 from datetime import date
+from training.server import statements
+from training.server.cache import read_cache, json_cache
+from training.server.versions import bump_versions
+from training.server.feed import record_changes
 from training.server.model import Vehicle, vehicle_engineer_association, Engineer, Laptop, ContactDetails
-from sqlalchemy import literal
+from sqlalchemy import literal, literal_column, insert, delete, update, bindparam, select, func, type_coerce, Float, text
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import selectinload, joinedload
 from sqlalchemy.orm.exc import UnmappedInstanceError
 
+# Keyset pagination: rows in id order after after_id, at most limit of them
+def paginate(query, id_column, limit=None, after_id=None):
+    if after_id is not None:
+        query = query.filter(id_column > after_id)
+    if limit is not None or after_id is not None:
+        query = query.order_by(id_column)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+# The json_*_all readers below encode the same dicts as the models' to_json straight from result rows,
+# skipping ORM objects for reads of whole tables. They return (id, JSON bytes) pairs, reusing the bytes
+# json_cache encoded the last time a row was read at the same version
+
+def engineer_names(session):
+    """Correlated subquery aggregating the names of each vehicle's engineers into one value."""
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        names = func.array_agg(Engineer.name)
+    elif dialect == "mysql":
+        names = func.json_arrayagg(Engineer.name)
+    else:
+        names = func.json_group_array(Engineer.name)
+    return select(names) \
+        .select_from(vehicle_engineer_association.join(Engineer.__table__, Engineer.id == vehicle_engineer_association.c.engineer_id)) \
+        .where(vehicle_engineer_association.c.vehicle_id == Vehicle.id) \
+        .scalar_subquery()
+
+
+def engineer_versions():
+    """Correlated subquery adding up the versions of each vehicle's engineers. It goes up when one of them
+    changes, and assigning or removing an engineer raises the vehicle's own version."""
+    return select(func.coalesce(func.sum(Engineer.version), 0)) \
+        .select_from(vehicle_engineer_association.join(Engineer.__table__, Engineer.id == vehicle_engineer_association.c.engineer_id)) \
+        .where(vehicle_engineer_association.c.vehicle_id == Vehicle.id) \
+        .scalar_subquery()
+
+
+def parse_names(names):
+    # array_agg gives a list and the JSON aggregates give text. Over no rows array_agg and JSON_ARRAYAGG give NULL
+    if names is None:
+        return []
+    if isinstance(names, list):
+        return names
+    return json.loads(names)
+
+
+def vehicle_row_json(row):
+    id, model, quantity, price, manufacture_date, names, version = row
+    return {
+        "id": id,
+        "data_type": "vehicle",
+        "model": model,
+        "quantity": quantity,
+        "price": float(price),
+        "manufacture_year": manufacture_date.year,
+        "manufacture_month": manufacture_date.month,
+        "manufacture_date": manufacture_date.day,
+        "engineers": parse_names(names),
+        "version": version
+    }
+
+
+def engineer_row_json(row):
+    id, name, birthday, version = row
+    return {
+        "id": id,
+        "data_type": "engineer",
+        "name": name,
+        "birth_year": birthday.year,
+        "birth_month": birthday.month,
+        "birth_date": birthday.day,
+        "version": version
+    }
+
+
+def laptop_row_json(row):
+    id, model, date_loaned, engin_id, engin_name, version = row
+    return {
+        "id": id,
+        "data_type": "laptop",
+        "model": model,
+        "loan_year": date_loaned.year,
+        "loan_month": date_loaned.month,
+        "loan_date": date_loaned.day,
+        "engineer": "None" if engin_id is None else engin_name,
+        "version": version
+    }
+
+
+def contact_details_row_json(row):
+    id, phone_number, address, engin_id, engin_name, version = row
+    return {
+        "id": id,
+        "data_type": "contact_details",
+        "phone_number": phone_number,
+        "address": address,
+        "engineer": "None" if engin_id is None else engin_name,
+        "version": version
+    }
+
+
+def encode_rows(table, rows, row_json, width):
+    # A row is the width columns row_json encodes, ending with its version, then the versions of
+    # the rows of other tables it shows. Together those versions are the version json_cache checks
+    return [(row[0], json_cache.encode(table, row[0], tuple(row[width - 1:]), row[:width], row_json)) for row in rows]
+
+
+# Reads of whole tables asking for some of the to_json "fields" select only the columns those fields are
+# made from, so a vehicle's engineer names or a laptop's engineer are only read when asked for. Each field
+# maps to the names of the columns it is made from and the function making its value from them
+
+def engineer_name(engineer_id):
+    return select(Engineer.name).where(Engineer.id == engineer_id).scalar_subquery()
+
+
+def vehicle_columns(session):
+    return {"model": Vehicle.model, "quantity": Vehicle.quantity, "price": type_coerce(Vehicle.price, Float),
+            "manufacture_date": Vehicle.manufacture_date, "engineer_names": engineer_names(session), "version": Vehicle.version}
+
+
+def engineer_columns(session):
+    return {"name": Engineer.name, "birthday": Engineer.birthday, "version": Engineer.version}
+
+
+def laptop_columns(session):
+    return {"model": Laptop.model, "date_loaned": Laptop.date_loaned, "engineer_name": engineer_name(Laptop.engineer_id), "version": Laptop.version}
+
+
+def contact_details_columns(session):
+    return {"phone_number": ContactDetails.phone_number, "address": ContactDetails.address,
+            "engineer_name": engineer_name(ContactDetails.engineer_id), "version": ContactDetails.version}
+
+
+def same(value):
+    return value
+
+
+def engineer_or_none(name):
+    return "None" if name is None else name
+
+
+VEHICLE_FIELDS = {
+    "id": (["id"], same),
+    "data_type": ([], lambda: "vehicle"),
+    "model": (["model"], same),
+    "quantity": (["quantity"], same),
+    "price": (["price"], float),
+    "manufacture_year": (["manufacture_date"], lambda day: day.year),
+    "manufacture_month": (["manufacture_date"], lambda day: day.month),
+    "manufacture_date": (["manufacture_date"], lambda day: day.day),
+    "engineers": (["engineer_names"], parse_names),
+    "version": (["version"], same)
+}
+
+ENGINEER_FIELDS = {
+    "id": (["id"], same),
+    "data_type": ([], lambda: "engineer"),
+    "name": (["name"], same),
+    "birth_year": (["birthday"], lambda day: day.year),
+    "birth_month": (["birthday"], lambda day: day.month),
+    "birth_date": (["birthday"], lambda day: day.day),
+    "version": (["version"], same)
+}
+
+LAPTOP_FIELDS = {
+    "id": (["id"], same),
+    "data_type": ([], lambda: "laptop"),
+    "model": (["model"], same),
+    "loan_year": (["date_loaned"], lambda day: day.year),
+    "loan_month": (["date_loaned"], lambda day: day.month),
+    "loan_date": (["date_loaned"], lambda day: day.day),
+    "engineer": (["engineer_name"], engineer_or_none),
+    "version": (["version"], same)
+}
+
+CONTACT_DETAILS_FIELDS = {
+    "id": (["id"], same),
+    "data_type": ([], lambda: "contact_details"),
+    "phone_number": (["phone_number"], same),
+    "address": (["address"], same),
+    "engineer": (["engineer_name"], engineer_or_none),
+    "version": (["version"], same)
+}
+
+# The fields read jobs may ask for, by data type
+JSON_FIELDS = {
+    "vehicle": VEHICLE_FIELDS,
+    "engineer": ENGINEER_FIELDS,
+    "laptop": LAPTOP_FIELDS,
+    "contact_details": CONTACT_DETAILS_FIELDS
+}
+
+def json_fields_all(session, id_column, columns, table_fields, fields, limit=None, after_id=None):
+    """(id, JSON bytes) pairs of each row's fields, in to_json order. Not kept in json_cache, which holds whole rows."""
+    wanted = [field for field in table_fields if field in fields]
+    names = [name for name in dict.fromkeys(name for field in wanted for name in table_fields[field][0]) if name != "id"]
+    query = select(id_column, *[columns[name] for name in names])
+    rows = session.execute(paginate(query, id_column, limit, after_id)).all()
+    commit(session)
+    # Where each field's columns are in a result row, worked out once for all rows
+    positions = {"id": 0, **{name: i for i, name in enumerate(names, 1)}}
+    plan = [(field, [positions[name] for name in table_fields[field][0]], table_fields[field][1]) for field in wanted]
+    return [(row[0], json.dumps({field: make(*[row[i] for i in indexes]) for field, indexes, make in plan}).encode('utf-8'))
+            for row in rows]
+
+
+# The rows a cached lookup result was built from, its entry is dropped when one of them is written
+def vehicle_tags(car):
+    return vehicle_row_tags(car) + [("engineers", engin.id) for engin in car.engineers]
+
+
+def vehicle_row_tags(car):
+    # For vehicles read without their engineers
+    return [("vehicles", car.id), ("vehicle_models", car.model)]
+
+
+def engineer_tags(engin):
+    return [("engineers", engin.id)]
+
+
+def laptop_tags(laptop):
+    return [("laptops", laptop.id)] + ([] if laptop.engineer is None else [("engineers", laptop.engineer.id)])
+
+
+def contact_details_tags(contact):
+    return [("contact_details", contact.id)] + ([] if contact.engineer is None else [("engineers", contact.engineer.id)])
+
+
 class VehicleUtils:
-    # Create a new vehicle
+    # Create a new vehicle, or add to the quantity of the existing vehicle with the same model
+    @uses_tables(reads=["engineers", "vehicle_engineers"], writes=["vehicles"], key=("vehicles", "model"))
     def add_vehicle_db(self, session, model, quantity, price, manufacture_date):
-        # if vehicle exists, update quantity
-        car_exists = (session.query(literal(True)).filter(Vehicle.model == model).first())
-        if car_exists is not None:
-            cars = self.read_vehicles_by_model(session, model)
-            session.commit()
-            for car in cars:
-                new_quantity = car.quantity + quantity
-                print(f"Updating model {model} in the database.")
-                self.update_vehicle_db(session, car.id, quantity=new_quantity)
-                session.commit()
-                return None
-        else:            
-            new_car = Vehicle(model, quantity, price, manufacture_date)
-            session.add(new_car)
-            session.commit()
-            print("Committed new car")
-            new_car_id = new_car.id
-            new_car_engins = [engin.name for engin in new_car.engineers]
-            return new_car
+        """Returns the new vehicle, or None if the model already existed and only its quantity was increased.
+
+        The quantity is merged by a single INSERT ... ON DUPLICATE KEY UPDATE (MySQL) or ON CONFLICT DO UPDATE
+        (Postgres, SQLite), so concurrent restocks of one model never lose each other's updates.
+        """
+        dialect = session.get_bind().dialect.name
+        vehicles = Vehicle.__table__
+        values = {"model": model, "quantity": quantity, "in_stock": quantity > 0, "price": price, "manufacture_date": manufacture_date}
+        if dialect == "mysql":
+            stmt = mysql.insert(vehicles).values(values)
+            new_quantity = vehicles.c.quantity + stmt.inserted.quantity
+            # MySQL assigns left to right, so in_stock has to be set before quantity changes
+            stmt = stmt.on_duplicate_key_update([("in_stock", new_quantity > 0), ("quantity", new_quantity), ("version", vehicles.c.version + 1)])
+        else:
+            stmt = (postgresql if dialect == "postgresql" else sqlite).insert(vehicles).values(values)
+            new_quantity = vehicles.c.quantity + stmt.excluded.quantity
+            stmt = stmt.on_conflict_do_update(index_elements=[vehicles.c.model], set_={"quantity": new_quantity, "in_stock": new_quantity > 0, "version": vehicles.c.version + 1})
+
+        if dialect == "postgresql":
+            # xmax is only 0 for a row version this statement inserted
+            inserted = session.execute(stmt.returning(literal_column("xmax = 0"))).scalar()
+        elif dialect == "mysql" and quantity != 0:
+            # 1 affected row for an insert, 2 for an update that changed the row
+            inserted = session.execute(stmt).rowcount == 1
+        else:
+            # The upsert can't report which it did, only the returned status depends on this check
+            inserted = session.query(literal(True)).filter(Vehicle.model == model).first() is None
+            session.execute(stmt)
+
+        if not inserted:
+            read_cache.invalidate(session, [("vehicle_models", model)])
+            record_changes(session, "vehicles", "update", session.execute(select(Vehicle.id).where(Vehicle.model == model)).scalars().all())
+            commit(session)
+            print(f"Updated quantity of model {model} in the database.")
+            return None
+        new_car = session.execute(statements.vehicles_by_model, {"model": model}).scalars().one()
+        record_changes(session, "vehicles", "insert", [new_car.id])
+        commit(session)
+        print("Committed new car")
+        return new_car
 
     # Delete a vehicle by model
+    @uses_tables(writes=["vehicles", "vehicle_engineers"], key=("vehicles", "model"))
     def delete_vehicle_by_model(self, session, model):
         cars = self.read_vehicles_by_model(session, model)
         if not cars:
             return False
+        read_cache.invalidate(session, [("vehicles", car.id) for car in cars])
         for car in cars:
             session.query(vehicle_engineer_association).filter(vehicle_engineer_association.c.vehicle_id == car.id).delete()
+            # The eager loaded engineers no longer match the rows just deleted, don't let the flush delete them again
+            session.expire(car, ["engineers"])
             session.delete(car)
-        session.commit()
+        commit(session)
         return True
 
     # Read all vehicles
-    def read_vehicles_all(self, session):
-        cars = session.query(Vehicle).all()
-        session.commit()
+    @uses_tables(reads=["vehicles"])
+    def read_vehicles_all(self, session, limit=None, after_id=None):
+        cars = paginate(session.query(Vehicle).options(selectinload(Vehicle.engineers)), Vehicle.id, limit, after_id).all()
+        commit(session)
         return cars
 
-    # Read a vehicle by id
-    def read_vehicle_by_id(self, session, id):
-        car = session.query(Vehicle).get(id)
-        session.commit()
-        return car
-
-    # Read a vehicles by model
-    def read_vehicles_by_model(self, session, model):
-        cars = session.query(Vehicle).filter(Vehicle.model == model).all()
-        session.commit()
-        return cars
+    # Read all vehicles as their to_json dicts, encoded
+    @uses_tables(reads=["vehicles", "vehicle_engineers", "engineers"])
+    def json_vehicles_all(self, session, limit=None, after_id=None, fields=None):
+        if fields is not None:
+            return json_fields_all(session, Vehicle.id, vehicle_columns(session), VEHICLE_FIELDS, fields, limit, after_id)
+        # Price is read as a float instead of going through Decimal
+        query = select(Vehicle.id, Vehicle.model, Vehicle.quantity, type_coerce(Vehicle.price, Float), Vehicle.manufacture_date, engineer_names(session), Vehicle.version,
+                       engineer_versions())
+        rows = session.execute(paginate(query, Vehicle.id, limit, after_id)).all()
+        commit(session)
+        return encode_rows("vehicles", rows, vehicle_row_json, 7)
+
+    # Read a vehicle by id, with its engineers unless the to_json fields leave them out
+    @uses_tables(reads=["vehicles"])
+    def read_vehicle_by_id(self, session, id, fields=None):
+        with_engineers = fields is None or "engineers" in fields
+        statement = statements.vehicle_by_id if with_engineers else statements.vehicle_by_id_without_engineers
+        def load():
+            car = session.execute(statement, {"id": id}).scalars().first()
+            commit(session)
+            return car
+        return read_cache.lookup(session, ("vehicles", "id", id, with_engineers), load, vehicle_tags if with_engineers else vehicle_row_tags)
+
+    # Read a vehicles by model, with their engineers unless the to_json fields leave them out
+    @uses_tables(reads=["vehicles"], key=("vehicles", "model"))
+    def read_vehicles_by_model(self, session, model, fields=None):
+        with_engineers = fields is None or "engineers" in fields
+        statement = statements.vehicles_by_model if with_engineers else statements.vehicles_by_model_without_engineers
+        def load():
+            cars = session.execute(statement, {"model": model}).scalars().all()
+            commit(session)
+            return cars
+        return read_cache.lookup(session, ("vehicles", "model", model, with_engineers), load, vehicle_tags if with_engineers else vehicle_row_tags)
 
     # Read engineers assigned to a vehicle model
+    @uses_tables(reads=["vehicles", "vehicle_engineers", "engineers"], key=("vehicles", "model"))
     def read_assigned_engineers_by_model(self, session, model):
-        cars = self.read_vehicles_by_model(session, model)
-        engineer_ids = []
-        for car in cars:
-            engineer_ids += session.query(vehicle_engineer_association.c.engineer_id).filter(vehicle_engineer_association.c.vehicle_id == car.id).all()
-        session.commit()
-        return [EngineerUtils.read_engineer_by_id(EngineerUtils(), session, id) for id in engineer_ids]
+        engins = session.execute(statements.engineers_by_vehicle_model, {"model": model}).scalars().all()
+        commit(session)
+        return engins
 
     # Update a vehicle record by id
+    @uses_tables(reads=["engineers"], writes=["vehicles", "vehicle_engineers"])
     def update_vehicle_db(self, session, id, model=None, quantity=None, price=None, manufacture_date=None, engineers=None):
         car = self.read_vehicle_by_id(session, id)
+        read_cache.invalidate(session, [("vehicles", id)])
         try:
-            car.model = model if model is not None else car.model
-            car.quantity = quantity if quantity is not None else car.quantity
-            car.price = price if price is not None else car.price
-            car.manufacture_date = manufacture_date if manufacture_date is not None else car.manufacture_date
-            car.engineers = engineers if engineers is not None else car.engineers
-            session.commit()
+            with savepoint(session):
+                car.model = model if model is not None else car.model
+                car.quantity = quantity if quantity is not None else car.quantity
+                car.price = price if price is not None else car.price
+                car.manufacture_date = manufacture_date if manufacture_date is not None else car.manufacture_date
+                car.engineers = engineers if engineers is not None else car.engineers
+                commit(session)
             print("Commited vehicle update")
+        except DBAPIError as err:
+            rollback(session)
+            print("Rollback vehicle update")
+            # Let handle_job run the job again after a deadlock or serialization failure
+            if is_retryable(err):
+                raise
+            return None
         except:
-            session.rollback()
+            rollback(session)
             print("Rollback vehicle update")
             return None
         return car
 
 class EngineerUtils:
     # Create a new engineer
+    @uses_tables(writes=["engineers"], key=("engineers", "name"))
     def add_engineer_db(self, session, name, date_of_birth):
         new_engin = Engineer(name, date_of_birth)
         try:
-            session.add(new_engin)
-            session.commit()
+            with savepoint(session):
+                session.add(new_engin)
+                commit(session)
             return new_engin
         except IntegrityError:
-            session.rollback()
+            rollback(session)
             return None
         
 
     # Delete an engineer and their respective contact details
+    @uses_tables(writes=["engineers", "contact_details", "laptops", "vehicle_engineers", "vehicles"], key=("engineers", "name"))
     def delete_engineer_by_name(self, session, name):
         engin = self.read_engineer_by_name(session, name)
         try:
             ContactDetailsUtils.delete_contact_details_by_engin_id(ContactDetailsUtils(), session, engin.id)
         except UnmappedInstanceError:
             pass
+        read_cache.invalidate(session, [("engineers", engin.id)])
+        # The vehicles lose an engineer and the laptops their loaner
+        record_changes(session, "vehicles", "update", bump_versions(session, Vehicle, Vehicle.id.in_(
+            select(vehicle_engineer_association.c.vehicle_id).where(vehicle_engineer_association.c.engineer_id == engin.id))))
+        record_changes(session, "laptops", "update", bump_versions(session, Laptop, Laptop.engineer_id == engin.id))
         session.query(vehicle_engineer_association).filter(vehicle_engineer_association.c.engineer_id == engin.id).delete()
         session.delete(engin)
-        session.commit()
+        commit(session)
 
     # Read all engineers
-    def read_all_engineers(self, session):
-        engins = session.query(Engineer).all()
-        session.commit()
+    @uses_tables(reads=["engineers"])
+    def read_all_engineers(self, session, limit=None, after_id=None):
+        engins = paginate(session.query(Engineer), Engineer.id, limit, after_id).all()
+        commit(session)
         return engins
 
+    # Read all engineers as their to_json dicts, encoded
+    @uses_tables(reads=["engineers"])
+    def json_engineers_all(self, session, limit=None, after_id=None, fields=None):
+        if fields is not None:
+            return json_fields_all(session, Engineer.id, engineer_columns(session), ENGINEER_FIELDS, fields, limit, after_id)
+        query = select(Engineer.id, Engineer.name, Engineer.birthday, Engineer.version)
+        rows = session.execute(paginate(query, Engineer.id, limit, after_id)).all()
+        commit(session)
+        return encode_rows("engineers", rows, engineer_row_json, 4)
+
     # Read an engineer by id
+    @uses_tables(reads=["engineers"])
     def read_engineer_by_id(self, session, id):
-        engin = session.query(Engineer).get(id)
-        session.commit()
-        return engin
+        def load():
+            engin = session.execute(statements.engineer_by_id, {"id": id}).scalars().first()
+            commit(session)
+            return engin
+        return read_cache.lookup(session, ("engineers", "id", id), load, engineer_tags)
 
     # Read an engineer by name
+    @uses_tables(reads=["engineers"], key=("engineers", "name"))
     def read_engineer_by_name(self, session, name):
-        engin = session.query(Engineer).filter(Engineer.name == name).first()
-        session.commit()
-        return engin
+        def load():
+            engin = session.execute(statements.engineer_by_name, {"name": name}).scalars().first()
+            commit(session)
+            return engin
+        return read_cache.lookup(session, ("engineers", "name", name), load, engineer_tags)
 
     # Read vehicles this engineer is assigned to
+    @uses_tables(reads=["engineers", "vehicle_engineers", "vehicles"], key=("engineers", "name"))
     def read_assigned_vehicles_by_name(self, session, name):
         engin = self.read_engineer_by_name(session, name)
-        vehicle_ids = session.query(vehicle_engineer_association.c.vehicle_id).filter(vehicle_engineer_association.c.engineer_id == engin.id).all()
-        car_utils = VehicleUtils()
-        session.commit()
-        return [car_utils.read_vehicle_by_id(session, id) for id in vehicle_ids]
+        cars = session.execute(statements.vehicles_by_engineer_id, {"engineer_id": engin.id}).scalars().all()
+        commit(session)
+        return cars
+
+    # Assign an engineer to exactly the given vehicle models, writing only the assignments that change
+    @uses_tables(writes=["vehicle_engineers", "vehicles"])
+    def set_assigned_vehicles_by_id(self, session, id, models):
+        """Returns the requested models that exist and the models the engineer was taken off."""
+        requested = dict(session.query(Vehicle.model, Vehicle.id).filter(Vehicle.model.in_(models)).all())
+        current = dict(session.query(Vehicle.model, Vehicle.id)
+                       .join(vehicle_engineer_association, vehicle_engineer_association.c.vehicle_id == Vehicle.id)
+                       .filter(vehicle_engineer_association.c.engineer_id == id).all())
+        added_ids = [car_id for model, car_id in requested.items() if model not in current]
+        removed_ids = [car_id for model, car_id in current.items() if model not in requested]
+        if added_ids:
+            session.execute(insert(vehicle_engineer_association), [{"vehicle_id": car_id, "engineer_id": id} for car_id in added_ids])
+        # The cached vehicles list their engineers
+        read_cache.invalidate(session, [("vehicles", car_id) for car_id in added_ids + removed_ids])
+        if added_ids or removed_ids:
+            record_changes(session, "vehicles", "update", bump_versions(session, Vehicle, Vehicle.id.in_(added_ids + removed_ids)))
+        if removed_ids:
+            session.execute(delete(vehicle_engineer_association).where(
+                vehicle_engineer_association.c.engineer_id == id,
+                vehicle_engineer_association.c.vehicle_id.in_(removed_ids)))
+        commit(session)
+        assigned_models = [model for model in dict.fromkeys(models) if model in requested]
+        unassigned_models = [model for model in current if model not in requested]
+        return assigned_models, unassigned_models
 
     # Update an engineer record by id
+    @uses_tables(writes=["engineers"])
     def update_engineer_by_id(self, session, id, name=None, date_of_birth=None):
         engin = self.read_engineer_by_id(session, id)
+        read_cache.invalidate(session, [("engineers", id)])
         engin.name = name if name is not None else engin.name
         engin.birthday = date_of_birth if date_of_birth is not None else engin.birthday
-        session.commit()
+        commit(session)
         return engin
 
 class LaptopUtils:
     # Create a new laptop
+    @uses_tables(reads=["engineers"], writes=["laptops"], key=("engineers", "engineer_name"))
     def add_laptop_db(self, session, model, date_loaned, engineer_name):
         engin = EngineerUtils.read_engineer_by_name(EngineerUtils(), session, engineer_name)
         try:
-            new_laptop = Laptop(model, date_loaned, engin)
-            session.add(new_laptop)
-            session.commit()
+            with savepoint(session):
+                new_laptop = Laptop(model, date_loaned, engin)
+                session.add(new_laptop)
+                commit(session)
             return new_laptop
         except IntegrityError:
-            session.rollback()
+            rollback(session)
             return None
 
     # Delete a laptop
+    @uses_tables(writes=["laptops"])
     def delete_laptop_by_id(self, session, id):
-        laptop = self.read_laptop_by_id(id)
+        laptop = self.read_laptop_by_id(session, id)
+        # Deleting a laptop that doesn't exist raises UnmappedInstanceError
+        if laptop is not None:
+            read_cache.invalidate(session, [("laptops", laptop.id)])
         session.delete(laptop)
-        session.commit()
+        commit(session)
 
+    @uses_tables(reads=["engineers"], writes=["laptops"], key=("engineers", "engineer_name"))
     def delete_laptop_by_model_owner(self, session, model, engineer_name):
-        laptop = self.read_laptop_by_model_owner(model, engineer_name)
+        laptop = self.read_laptop_by_model_owner(session, model, engineer_name)
+        if laptop is not None:
+            read_cache.invalidate(session, [("laptops", laptop.id)])
         session.delete(laptop)
-        session.commit()
+        commit(session)
 
+    @uses_tables(reads=["engineers"], writes=["laptops"], key=("engineers", "engineer_name"))
     def delete_laptop_by_owner(self, session, engineer_name):
         laptop = self.read_laptop_by_owner(session, engineer_name)
+        if laptop is not None:
+            read_cache.invalidate(session, [("laptops", laptop.id)])
         session.delete(laptop)
-        session.commit()
+        commit(session)
 
     # Read all laptops
-    def read_all_laptops(self, session):
-        laptops = session.query(Laptop).all()
-        session.commit()
+    @uses_tables(reads=["laptops"])
+    def read_all_laptops(self, session, limit=None, after_id=None):
+        laptops = paginate(session.query(Laptop).options(joinedload(Laptop.engineer)), Laptop.id, limit, after_id).all()
+        commit(session)
         return laptops
 
+    # Read all laptops as their to_json dicts, encoded
+    @uses_tables(reads=["laptops", "engineers"])
+    def json_laptops_all(self, session, limit=None, after_id=None, fields=None):
+        if fields is not None:
+            return json_fields_all(session, Laptop.id, laptop_columns(session), LAPTOP_FIELDS, fields, limit, after_id)
+        query = select(Laptop.id, Laptop.model, Laptop.date_loaned, Engineer.id, Engineer.name, Laptop.version, Engineer.version) \
+            .outerjoin(Engineer, Engineer.id == Laptop.engineer_id)
+        rows = session.execute(paginate(query, Laptop.id, limit, after_id)).all()
+        commit(session)
+        return encode_rows("laptops", rows, laptop_row_json, 6)
+
     # Read laptops by model
+    @uses_tables(reads=["laptops"])
     def read_laptops_by_model(self, session, model):
-        laptops = session.query(Laptop).filter(Laptop.model == model).all()
-        session.commit()
+        laptops = session.execute(statements.laptops_by_model, {"model": model}).scalars().all()
+        commit(session)
         return laptops
 
     # Read a laptop by id
+    @uses_tables(reads=["laptops"])
     def read_laptop_by_id(self, session, id):
-        laptop = session.query(Laptop).get(id)
-        session.commit()
-        return laptop
+        def load():
+            laptop = session.execute(statements.laptop_by_id, {"id": id}).scalars().first()
+            commit(session)
+            return laptop
+        return read_cache.lookup(session, ("laptops", "id", id), load, laptop_tags)
 
     # Read laptop by model and owner
+    @uses_tables(reads=["laptops", "engineers"], key=("engineers", "engineer_name"))
     def read_laptop_by_model_owner(self, session, model, engineer_name):
         engin = EngineerUtils.read_engineer_by_name(EngineerUtils(), session, engineer_name)
-        laptop = session.query(Laptop).filter(Laptop.model == model, Laptop.engineer_id == engin.id).first()
-        session.commit()
+        laptop = session.execute(statements.laptop_by_model_owner, {"model": model, "engineer_id": engin.id}).scalars().first()
+        commit(session)
         return laptop
 
     # Read laptop by owner
+    @uses_tables(reads=["laptops", "engineers"], key=("engineers", "engineer_name"))
     def read_laptop_by_owner(self, session, engineer_name):
         engin = EngineerUtils.read_engineer_by_name(EngineerUtils(), session, engineer_name)
         if engin is None:
             return None
-        laptop = session.query(Laptop).filter(Laptop.engineer_id == engin.id).first()
-        session.commit()
+        laptop = session.execute(statements.laptop_by_owner, {"engineer_id": engin.id}).scalars().first()
+        commit(session)
         return laptop
 
     # Update laptop by id
+    @uses_tables(reads=["engineers"], writes=["laptops"])
     def update_laptop_by_id(self, session, id, model=None, date_loaned=None, engineer_name=None):
         laptop = self.read_laptop_by_id(session, id)
+        read_cache.invalidate(session, [("laptops", id)])
         laptop.model = model if model is not None else laptop.model
         laptop.date_loaned = date_loaned if date_loaned is not None else laptop.date_loaned
         if engineer_name == "":
@@ -215,7 +595,7 @@ class LaptopUtils:
         else:
             engin = EngineerUtils.read_engineer_by_name(EngineerUtils(), session, engineer_name)
             laptop.engineer = engin if engin is not None else laptop.engineer
-        session.commit()
+        commit(session)
         return laptop
 
 
@@ -223,61 +603,236 @@ class LaptopUtils:
 class ContactDetailsUtils:
 
     # Create new contact details
+    @uses_tables(reads=["engineers"], writes=["contact_details"], key=("engineers", "engineer_name"))
     def add_contact_details_db(self, session, phone_number, address, engineer_name):
         engin = EngineerUtils.read_engineer_by_name(EngineerUtils(), session, engineer_name)
         try:
-            new_contact = ContactDetails(phone_number, address, engin)
-            session.add(new_contact)
-            session.commit()
+            with savepoint(session):
+                new_contact = ContactDetails(phone_number, address, engin)
+                session.add(new_contact)
+                commit(session)
             return new_contact
         except IntegrityError:
-            session.rollback()
+            rollback(session)
             return None
 
     # Delete contact details by id
+    @uses_tables(writes=["contact_details"])
     def delete_contact_details_by_id(self, session, id):
         contact = self.read_contact_details_by_id(session, id)
+        read_cache.invalidate(session, [("contact_details", contact.id)])
         session.delete(contact)
-        session.commit()
+        commit(session)
 
     # Delete contact details by engineer id
+    @uses_tables(writes=["contact_details"])
     def delete_contact_details_by_engin_id(self, session, engin_id):
         contacts = self.read_contact_details_by_engin_id(session, engin_id)
+        read_cache.invalidate(session, [("contact_details", contact.id) for contact in contacts])
         for contact in contacts:
             session.delete(contact)
-        session.commit()
+        commit(session)
 
     # Read all contact details
-    def read_all_contact_details(self, session):
-        contacts = session.query(ContactDetails).all()
-        session.commit()
+    @uses_tables(reads=["contact_details"])
+    def read_all_contact_details(self, session, limit=None, after_id=None):
+        contacts = paginate(session.query(ContactDetails).options(joinedload(ContactDetails.engineer)), ContactDetails.id, limit, after_id).all()
+        commit(session)
         return contacts
 
+    # Read all contact details as their to_json dicts, encoded
+    @uses_tables(reads=["contact_details", "engineers"])
+    def json_contact_details_all(self, session, limit=None, after_id=None, fields=None):
+        if fields is not None:
+            return json_fields_all(session, ContactDetails.id, contact_details_columns(session), CONTACT_DETAILS_FIELDS, fields, limit, after_id)
+        query = select(ContactDetails.id, ContactDetails.phone_number, ContactDetails.address, Engineer.id, Engineer.name, ContactDetails.version, Engineer.version) \
+            .outerjoin(Engineer, Engineer.id == ContactDetails.engineer_id)
+        rows = session.execute(paginate(query, ContactDetails.id, limit, after_id)).all()
+        commit(session)
+        return encode_rows("contact_details", rows, contact_details_row_json, 6)
+
     # Read contact details by id
+    @uses_tables(reads=["contact_details"])
     def read_contact_details_by_id(self, session, id):
-        contact = session.query(ContactDetails).get(id)
-        session.commit()
-        return contact
+        def load():
+            contact = session.execute(statements.contact_details_by_id, {"id": id}).scalars().first()
+            commit(session)
+            return contact
+        return read_cache.lookup(session, ("contact_details", "id", id), load, contact_details_tags)
 
     # Read contact details by engineer id
+    @uses_tables(reads=["contact_details"])
     def read_contact_details_by_engin_id(self, session, engin_id):
-        contacts = session.query(ContactDetails).filter(ContactDetails.engineer_id == engin_id).all()
-        session.commit()
+        contacts = session.execute(statements.contact_details_by_engineer_id, {"engineer_id": engin_id}).scalars().all()
+        commit(session)
         return contacts
 
     # Update contact details by id
+    @uses_tables(reads=["engineers"], writes=["contact_details"])
     def update_contact_details_by_id(self, session, id, phone_number=None, address=None, engineer_name=None):
         contact = self.read_contact_details_by_id(session, id)
         engin = EngineerUtils.read_engineer_by_name(EngineerUtils(), session, engineer_name)
+        read_cache.invalidate(session, [("contact_details", id)])
         contact.phone_number = phone_number if phone_number is not None else contact.phone_number
         contact.address = address if address is not None else contact.address
         contact.engineer = engin if engin is not None else contact.engineer
-        session.commit()
+        commit(session)
         return contact
 
     # Update contact details by engineer id
+    @uses_tables(reads=["engineers"], writes=["contact_details"])
     def update_contact_details_by_engin_id(self, session, engin_id, phone_number=None, address=None):
         contact = self.read_contact_details_by_engin_id(session, engin_id)
         engin = EngineerUtils.read_engineer_by_id(EngineerUtils(), session, engin_id)
-        session.commit()
-        return self.update_contact_details_by_id(session, contact.id, phone_number, address, engin.name)
\ No newline at end of file
+        commit(session)
+        return self.update_contact_details_by_id(session, contact.id, phone_number, address, engin.name)
+
+# Split values into lists short enough for one IN (...) clause
+def chunked(values, size=500):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+# The last id the connection's latest insert handed out, for databases that can't return ids from an executemany.
+# MySQL reports the first id and row count of the last multi-row insert the driver sent the rows in
+LAST_INSERTED_ID = {
+    "sqlite": text("SELECT last_insert_rowid()"),
+    "mysql": text("SELECT LAST_INSERT_ID() + ROW_COUNT() - 1")
+}
+
+
+class BulkUtils:
+    # Add records of mixed data types in one transaction, each data type with one multi-row insert
+    @uses_tables(writes=["engineers", "vehicles", "laptops", "contact_details"])
+    def add_records_db(self, session, records):
+        """records is a list of (data_type, values) pairs with already validated values.
+        Returns one status dict per record, or None if a concurrent write made the inserts conflict."""
+        results = [None] * len(records)
+        by_type = {"engineer": [], "vehicle": [], "laptop": [], "contact_details": []}
+        for i, (data_type, values) in enumerate(records):
+            by_type[data_type].append((i, values))
+        try:
+            with savepoint(session):
+                # Engineers first, laptops and contact details refer to them
+                self.add_engineers(session, by_type["engineer"], results)
+                self.add_vehicles(session, by_type["vehicle"], results)
+                names = {values["engineer"] for _, values in by_type["laptop"] + by_type["contact_details"]}
+                engineer_ids = self.read_engineer_ids(session, names)
+                self.add_laptops(session, by_type["laptop"], engineer_ids, results)
+                self.add_contact_details(session, by_type["contact_details"], engineer_ids, results)
+                commit(session)
+        except IntegrityError:
+            rollback(session)
+            return None
+        return results
+
+    def read_engineer_ids(self, session, names):
+        engineer_ids = {}
+        for names_chunk in chunked(names):
+            engineer_ids.update(session.query(Engineer.name, Engineer.id).filter(Engineer.name.in_(names_chunk)).all())
+        return engineer_ids
+
+    def add_engineers(self, session, records, results):
+        existing = set()
+        for names_chunk in chunked({values["name"] for _, values in records}):
+            existing.update(name for name, in session.query(Engineer.name).filter(Engineer.name.in_(names_chunk)))
+        rows = []
+        for i, values in records:
+            name = values["name"]
+            if name in existing:
+                results[i] = {"status": "error", "text": f"Engineer named {name} already exists in the database.\n" +
+                                                         f"Aborted adding duplicate engineer {name} to the database."}
+                continue
+            existing.add(name)
+            rows.append({"name": name, "birthday": values["birthday"]})
+            results[i] = {"status": "success"}
+        if rows:
+            session.execute(insert(Engineer.__table__), rows)
+            record_changes(session, "engineers", "insert", self.read_engineer_ids(session, [row["name"] for row in rows]).values())
+
+    def add_vehicles(self, session, records, results):
+        existing = {}
+        for models_chunk in chunked({values["model"] for _, values in records}):
+            existing.update(session.query(Vehicle.model, Vehicle.id).filter(Vehicle.model.in_(models_chunk)).all())
+        # Like add_vehicle_db, a model that already exists only has its quantity increased
+        new_rows = {}
+        added_quantities = {}
+        for i, values in records:
+            model = values["model"]
+            if model in existing or model in new_rows:
+                if model in existing:
+                    car_id = existing[model]
+                    added_quantities[car_id] = added_quantities.get(car_id, 0) + values["quantity"]
+                else:
+                    new_rows[model]["quantity"] += values["quantity"]
+                results[i] = {"status": "updated", "text": f"Vehicle model {model} already exists in the database.\n" +
+                                                           f"Updated quantity of {model} vehicles by {values['quantity']}."}
+                continue
+            new_rows[model] = {"model": model, "quantity": values["quantity"], "price": values["price"],
+                               "manufacture_date": values["manufacture_date"]}
+            results[i] = {"status": "success"}
+        if new_rows:
+            rows = [{**row, "in_stock": row["quantity"] > 0} for row in new_rows.values()]
+            session.execute(insert(Vehicle.__table__), rows)
+            for models_chunk in chunked(new_rows):
+                record_changes(session, "vehicles", "insert", session.execute(select(Vehicle.id).where(Vehicle.model.in_(models_chunk))).scalars().all())
+        if added_quantities:
+            read_cache.invalidate(session, [("vehicles", car_id) for car_id in added_quantities])
+            vehicles = Vehicle.__table__
+            new_quantity = vehicles.c.quantity + bindparam("added_quantity")
+            session.execute(update(vehicles).where(vehicles.c.id == bindparam("vehicle_id"))
+                                            .values(quantity=new_quantity, in_stock=new_quantity > 0, version=vehicles.c.version + 1),
+                            [{"vehicle_id": car_id, "added_quantity": quantity} for car_id, quantity in added_quantities.items()])
+            record_changes(session, "vehicles", "update", added_quantities)
+
+    def add_laptops(self, session, records, engineer_ids, results):
+        loaned = set()
+        for ids_chunk in chunked(set(engineer_ids.values())):
+            loaned.update(engin_id for engin_id, in session.query(Laptop.engineer_id).filter(Laptop.engineer_id.in_(ids_chunk)))
+        rows = []
+        for i, values in records:
+            engin_name = values["engineer"]
+            engin_id = engineer_ids.get(engin_name)
+            # Like the JSON insert client, add the laptop without a loaner or alongside the engineer's current laptop
+            results[i] = {"status": "success", "replaced": engin_id in loaned}
+            if engin_id is None:
+                results[i]["text"] = f"Engineer {engin_name} does not exist in the database. The laptop is not loaned by any engineer."
+            else:
+                loaned.add(engin_id)
+            rows.append({"model": values["model"], "date_loaned": values["date_loaned"], "engineer_id": engin_id})
+        if rows:
+            # Laptops have no natural key to find the new rows by, so the insert returns their ids
+            laptops = Laptop.__table__
+            dialect = session.get_bind().dialect
+            if dialect.insert_executemany_returning:
+                new_ids = session.execute(insert(laptops).returning(laptops.c.id), rows).scalars().all()
+            else:
+                # The laptops write lock keeps other inserts out, so the new rows have the consecutive ids
+                # ending at the last one this insert handed out
+                session.execute(insert(laptops), rows)
+                last_id = session.execute(LAST_INSERTED_ID[dialect.name]).scalar_one()
+                new_ids = list(range(last_id - len(rows) + 1, last_id + 1))
+            record_changes(session, "laptops", "insert", new_ids)
+
+    def add_contact_details(self, session, records, engineer_ids, results):
+        existing = set()
+        for phones_chunk in chunked({values["phone_number"] for _, values in records}):
+            existing.update(phone for phone, in session.query(ContactDetails.phone_number).filter(ContactDetails.phone_number.in_(phones_chunk)))
+        rows = []
+        for i, values in records:
+            engin_name = values["engineer"]
+            if engin_name not in engineer_ids:
+                results[i] = {"status": "error", "text": f"Engineer {engin_name} does not exist in the database. Contact details cannot be added for a non-existant engineer."}
+                continue
+            if values["phone_number"] in existing:
+                results[i] = {"status": "error", "text": "Detected duplicate contact details. Aborted adding duplicate."}
+                continue
+            existing.add(values["phone_number"])
+            rows.append({"phone_number": values["phone_number"], "address": values["address"], "engineer_id": engineer_ids[engin_name]})
+            results[i] = {"status": "success"}
+        if rows:
+            session.execute(insert(ContactDetails.__table__), rows)
+            for phones_chunk in chunked(row["phone_number"] for row in rows):
+                record_changes(session, "contact_details", "insert",
+                               session.execute(select(ContactDetails.id).where(ContactDetails.phone_number.in_(phones_chunk))).scalars().all())
@@ -0,0 +1,376 @@
+"""Change feed: the rows each committed transaction inserted, updated and deleted, pushed to subscribed clients.
+
+Sessions collect the changes they make to vehicles, engineers, laptops and contact details: the ORM's
+through session events, Core statements' through db_utils calling record_changes. At commit they are
+written to change_events, which the database numbers as they are inserted, so writers don't wait on
+each other for their numbers. Numbers are handed out before commit though: a transaction can commit
+after one numbered later, and the numbers of rolled back transactions are never used.
+
+A ChangeFeed in each server process reads the new events and sends them to its subscribed clients.
+It only sends an event once every number before it has been committed or given up on. A missing
+number is given up on gap_timeout seconds after a later event appeared, taking its transaction to have
+rolled back; should its events show up after all, subscribers already past them are told to resync.
+So a client that has seen event n has seen every event before it, or been told to read the tables again.
+
+The feed is woken when a session of its own process commits events, and polls for the events of other
+processes (worker processes, other users of db_utils).
+"""
+import logging
+import threading
+from collections import deque
+from time import monotonic
+from sqlalchemy import event, select, delete, func, or_
+from sqlalchemy.orm import Session as SessionClass
+from training.server.locks import uses_tables
+from training.server.model import change_events
+from training.server.transactions import commit
+from training.server.versions import VERSIONED, row_changed
+
+# Data type of each table with change events
+DATA_TYPES = {"vehicles": "vehicle", "engineers": "engineer", "laptops": "laptop", "contact_details": "contact_details"}
+
+# Event written by a database reset, ahead of the events of the default rows
+RESET = "reset"
+
+# Skipped numbers remembered to catch events committed late
+MAX_SKIPPED = 100
+
+def pending_changes(session):
+    # (table, row id) -> "insert", "update" or "delete", in the order the rows first changed
+    return session.info.setdefault("change_events", {})
+
+
+def record_changes(session, table, change, ids):
+    """Note that session changed the rows of table with ids. An insert followed by updates is still an
+    insert, and a row inserted and deleted within the transaction never changed as far as others can tell."""
+    changes = pending_changes(session)
+    for row_id in ids:
+        key = (table, row_id)
+        previous = changes.get(key)
+        if previous == "insert" and change == "update":
+            continue
+        if previous == "insert" and change == "delete":
+            del changes[key]
+            continue
+        changes[key] = change
+
+
+@event.listens_for(SessionClass, "after_flush")
+def record_flushed_changes(session, flush_context):
+    # new, dirty and deleted still list what was flushed, and new rows have their ids by now
+    for obj in session.new:
+        if isinstance(obj, VERSIONED):
+            record_changes(session, obj.__table__.name, "insert", [obj.id])
+    for obj in session.dirty:
+        if isinstance(obj, VERSIONED) and row_changed(obj):
+            record_changes(session, obj.__table__.name, "update", [obj.id])
+    for obj in session.deleted:
+        if isinstance(obj, VERSIONED):
+            record_changes(session, obj.__table__.name, "delete", [obj.id])
+
+
+@event.listens_for(SessionClass, "after_transaction_create")
+def save_changes_at_savepoint(session, transaction):
+    if transaction.nested:
+        session.info.setdefault("change_savepoints", {})[transaction] = dict(pending_changes(session))
+
+
+@event.listens_for(SessionClass, "after_soft_rollback")
+def restore_changes_at_savepoint(session, previous_transaction):
+    # Rolling back to a savepoint undoes the changes made since
+    saved = session.info.get("change_savepoints", {}).pop(previous_transaction, None)
+    if saved is not None:
+        session.info["change_events"] = saved
+
+
+@event.listens_for(SessionClass, "before_commit")
+def write_change_events(session):
+    session.flush()
+    changes = session.info.pop("change_events", None)
+    if not changes:
+        return
+    # The database numbers them in the order given
+    session.execute(change_events.insert(), [
+        {"table_name": table, "event": change, "row_id": row_id} for (table, row_id), change in changes.items()
+    ])
+    session.info["committing_events"] = True
+
+
+@event.listens_for(SessionClass, "after_commit")
+def announce_change_events(session):
+    if session.info.pop("committing_events", False):
+        commits.announce()
+
+
+@event.listens_for(SessionClass, "after_transaction_end")
+def forget_changes(session, transaction):
+    # Rolled back, the changes never happened
+    if transaction.parent is None:
+        session.info.pop("change_events", None)
+        session.info.pop("change_savepoints", None)
+        session.info.pop("committing_events", None)
+
+
+class CommitSignal:
+    """Counts commits that wrote change events in this process, so a feed can wait for the next one."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.count = 0
+
+    def announce(self):
+        with self.condition:
+            self.count += 1
+            self.condition.notify_all()
+
+    def wait(self, seen, timeout):
+        """Wait until a commit after the first seen, or timeout seconds. Returns the commits counted."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.count != seen, timeout)
+            return self.count
+
+
+commits = CommitSignal()
+
+@uses_tables()
+def read_seq_range(session):
+    """The sequence numbers of the first and last events kept, or (None, None) if there are none."""
+    seq_range = session.execute(select(func.min(change_events.c.seq), func.max(change_events.c.seq))).one()
+    commit(session)
+    return tuple(seq_range)
+
+
+@uses_tables()
+def read_change_events(session, after_seq, limit, last_seq=None):
+    """Up to limit events numbered after after_seq (and up to last_seq), as (seq, table_name, event, row_id)
+    tuples in order."""
+    query = select(change_events.c.seq, change_events.c.table_name, change_events.c.event, change_events.c.row_id) \
+        .where(change_events.c.seq > after_seq).order_by(change_events.c.seq).limit(limit)
+    if last_seq is not None:
+        query = query.where(change_events.c.seq <= last_seq)
+    events = session.execute(query).all()
+    commit(session)
+    return events
+
+
+@uses_tables()
+def read_first_seq_within(session, ranges):
+    """The first event numbered within any of the (first, last) ranges, or None."""
+    first_seq = session.execute(select(func.min(change_events.c.seq))
+                                .where(or_(*(change_events.c.seq.between(first, last) for first, last in ranges)))).scalar()
+    commit(session)
+    return first_seq
+
+
+@uses_tables()
+def trim_change_events(session, keep):
+    """Delete all but the last keep events."""
+    last_trimmed = session.execute(select(change_events.c.seq).order_by(change_events.c.seq.desc()).offset(keep).limit(1)).scalar()
+    if last_trimmed is not None:
+        session.execute(delete(change_events).where(change_events.c.seq <= last_trimmed))
+    commit(session)
+
+
+class Subscription:
+    def __init__(self, client, data_types, position):
+        self.client = client
+        self.data_types = set(data_types)
+        # Sequence number of the last event the client has been sent or skipped
+        self.position = position
+
+
+class ChangeFeed:
+    """Sends subscribed clients the change events of the data types they asked for, in sequence order.
+
+    Each event is sent as {"status": "event", "seq": n, "data_type": ..., "event": "insert", "update" or
+    "delete", "id": row id}. A client resuming after events it missed were trimmed (only the last retention
+    events are kept) or lost to a database reset, or that was sent events numbered after one committed
+    late, is sent {"status": "resync", "seq": n} instead, and should read the tables again before
+    following the events after n.
+
+    call runs the feed's database functions with the locks they need, like Server.call_with_rlock.
+    """
+
+    def __init__(self, session_factory, call, poll_interval=1.0, retention=10000, gap_timeout=5.0, batch_size=500):
+        self.session_factory = session_factory
+        self.call = call
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.gap_timeout = gap_timeout
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        # client key -> Subscription
+        self.subscriptions = {}
+        # Held while reading new events, by the feed's thread and by subscribe jobs
+        self.read_lock = threading.Lock()
+        # Every event up to complete_seq has been read or given up on, None until the first read
+        self.complete_seq = None
+        # Sequence numbers of the first and last events kept, as last read
+        self.first_seq = 0
+        self.last_seq = 0
+        # (last sequence number, time it was first read) for numbers past complete_seq, oldest first
+        self.sightings = deque()
+        # (first, last) sequence numbers given up on
+        self.skipped = deque(maxlen=MAX_SKIPPED)
+        # Events up to this sequence number have been deleted
+        self.trimmed_below = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        commits.announce()
+        self.thread.join()
+
+    def sequence_numbers(self):
+        """Read the events written so far. Returns the sequence number a new subscription starts after,
+        every event up to it having been committed, and that of the last event written."""
+        session = self.session_factory()
+        try:
+            with self.read_lock:
+                self.read_new_events(session)
+                return self.complete_seq, self.last_seq
+        finally:
+            session.close()
+
+    def subscribe(self, client, data_types, after_seq):
+        """Start sending client the events after after_seq, replacing its earlier subscription."""
+        with self.lock:
+            self.subscriptions[client.client_key] = Subscription(client, data_types, after_seq)
+        # Catch up without waiting for the next commit
+        commits.announce()
+
+    def unsubscribe(self, client_key):
+        with self.lock:
+            return self.subscriptions.pop(client_key, None) is not None
+
+    def subscriber_count(self):
+        with self.lock:
+            return len(self.subscriptions)
+
+    def run(self):
+        seen = commits.count
+        while not self.stopped:
+            try:
+                self.poll()
+            except Exception:
+                # The tables may be in the middle of a reset, try again on the next poll
+                logging.exception("Failed to read the change feed")
+            # A missing number is given up on without waiting for another commit
+            timeout = min(self.poll_interval, self.gap_timeout) if self.sightings else self.poll_interval
+            seen = commits.wait(seen, timeout)
+
+    def poll(self):
+        session = self.session_factory()
+        try:
+            with self.read_lock:
+                self.read_new_events(session)
+                late_seq = self.read_late_events(session)
+                complete_seq = self.complete_seq
+            with self.lock:
+                subscriptions = list(self.subscriptions.values())
+            if late_seq is not None:
+                for sub in subscriptions:
+                    if sub.position >= late_seq:
+                        self.send_resync(sub, sub.position)
+            behind = [sub for sub in subscriptions if sub.position < complete_seq]
+            while behind:
+                after_seq = min(sub.position for sub in behind)
+                events = self.call(read_change_events, session, after_seq, self.batch_size, complete_seq)
+                # Fewer than asked for, the rest of the numbers up to complete_seq were never used
+                read_all = len(events) < self.batch_size
+                for sub in behind:
+                    self.send_events(sub, events, complete_seq, read_all)
+                behind = [sub for sub in behind if sub.position < complete_seq and self.subscribed(sub)]
+            if self.last_seq - self.retention > self.trimmed_below:
+                self.call(trim_change_events, session, self.retention)
+                self.trimmed_below = self.last_seq - self.retention
+        finally:
+            session.close()
+
+    def read_new_events(self, session):
+        """Move complete_seq past the events written since, stopping at a missing number that may yet be
+        committed. Called with read_lock held."""
+        first_seq, last_seq = self.call(read_seq_range, session)
+        if first_seq is None:
+            if self.complete_seq is None:
+                self.complete_seq = 0
+            return
+        now = monotonic()
+        self.first_seq = first_seq
+        if self.complete_seq is None:
+            self.complete_seq = first_seq - 1
+        if last_seq > self.last_seq:
+            self.last_seq = last_seq
+            self.sightings.append((last_seq, now))
+        while self.complete_seq < last_seq:
+            events = self.call(read_change_events, session, self.complete_seq, self.batch_size)
+            for seq, table, change, row_id in events:
+                if seq > self.complete_seq + 1:
+                    # Numbers before a reset belong to the tables it dropped
+                    if change != RESET and not self.given_up(seq - 1, now):
+                        return
+                    if change != RESET:
+                        self.skipped.append((self.complete_seq + 1, seq - 1))
+                self.complete_seq = seq
+            while self.sightings and self.sightings[0][0] <= self.complete_seq:
+                self.sightings.popleft()
+            if len(events) < self.batch_size:
+                return
+
+    def given_up(self, seq, now):
+        # A later event has been written for gap_timeout seconds
+        return any(last_seq > seq and now - seen >= self.gap_timeout for last_seq, seen in self.sightings)
+
+    def read_late_events(self, session):
+        """The first event numbered within the numbers given up on, which are forgotten up to it, or None."""
+        while self.skipped and self.skipped[0][1] < self.first_seq:
+            self.skipped.popleft()
+        if not self.skipped:
+            return None
+        late_seq = self.call(read_first_seq_within, session, list(self.skipped))
+        if late_seq is not None:
+            logging.warning(f"Change event {late_seq} was committed after the change feed gave up on it")
+            while self.skipped and self.skipped[0][0] <= late_seq:
+                self.skipped.popleft()
+        return late_seq
+
+    def subscribed(self, sub):
+        with self.lock:
+            return self.subscriptions.get(sub.client.client_key) is sub
+
+    def send_events(self, sub, events, complete_seq, read_all):
+        try:
+            if sub.position + 1 < self.first_seq:
+                # The events right after its position may be gone (or their numbers never used)
+                self.send_resync(sub, complete_seq)
+                return
+            for seq, table, change, row_id in events:
+                if seq <= sub.position:
+                    continue
+                if change == RESET:
+                    sub.client.send({"status": "resync", "seq": seq})
+                elif DATA_TYPES[table] in sub.data_types:
+                    sub.client.send({"status": "event", "seq": seq, "data_type": DATA_TYPES[table], "event": change, "id": row_id})
+                sub.position = seq
+            if read_all:
+                sub.position = max(sub.position, complete_seq)
+        except OSError as err:
+            self.drop(sub, err)
+
+    def send_resync(self, sub, seq):
+        try:
+            sub.client.send({"status": "resync", "seq": seq})
+            sub.position = seq
+        except OSError as err:
+            self.drop(sub, err)
+
+    def drop(self, sub, err):
+        logging.info(f"Dropping the change feed subscription of {sub.client}: {err}")
+        with self.lock:
+            if self.subscriptions.get(sub.client.client_key) is sub:
+                del self.subscriptions[sub.client.client_key]
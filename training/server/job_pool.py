@@ -0,0 +1,65 @@
+import threading
+import queue
+import logging
+from time import monotonic
+from concurrent.futures import Future
+
+class JobPool:
+    """Fixed set of worker threads that take jobs from a bounded queue.
+
+    submit() refuses new jobs once the queue is full instead of blocking, so the server can
+    tell the client it is busy rather than piling up threads and database sessions.
+    """
+
+    def __init__(self, num_threads=16, queue_size=64):
+        self.jobs = queue.Queue(maxsize=queue_size)
+        # Held while a job is queued, so none is queued behind the stop sentinels
+        self.submit_lock = threading.Lock()
+        self.stopped = False
+        self.workers = []
+        for i in range(num_threads):
+            worker = threading.Thread(target=self.work, name=f"job-worker-{i}")
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func to run on a worker thread. Returns a Future for its result, or None if the queue is
+        full or the pool is shutting down."""
+        future = Future()
+        with self.submit_lock:
+            if self.stopped:
+                return None
+            try:
+                self.jobs.put_nowait((future, func, args, kwargs))
+            except queue.Full:
+                return None
+        return future
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            future, func, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as err:
+                logging.exception(f"Worker thread failed running {func}")
+                future.set_exception(err)
+
+    def shutdown(self, timeout=10):
+        """Stop taking jobs and let the workers finish the ones already queued. Queueing the stop sentinels
+        waits at most timeout seconds for room in a full queue, workers still busy after that are left
+        running as daemon threads."""
+        with self.submit_lock:
+            self.stopped = True
+        deadline = monotonic() + timeout
+        for _ in self.workers:
+            try:
+                self.jobs.put(None, timeout=max(0, deadline - monotonic()))
+            except queue.Full:
+                logging.warning(f"Job queue still full {timeout} seconds into shutdown, not waiting for the queued jobs")
+                return
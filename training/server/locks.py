@@ -0,0 +1,139 @@
+import os
+import fcntl
+import inspect
+import threading
+from itertools import count
+from contextlib import contextmanager
+
+TABLES = ["contact_details", "engineers", "laptops", "vehicle_engineers", "vehicles"]
+
+# Table locks are taken in an intention mode (IS/IX) when only some rows of the table are locked,
+# so a job locking one vehicle model still conflicts with a job locking the whole vehicles table.
+COMPATIBLE_MODES = {
+    "IS": {"IS", "IX", "S"},
+    "IX": {"IS", "IX"},
+    "S": {"IS", "S"},
+    "X": set()
+}
+
+def uses_tables(reads=(), writes=(), key=None, schema=False):
+    """Declare the tables a db_utils function reads and writes, so the server knows what to lock.
+
+    key is a (table, argument name) pair. The named argument is a natural key of that table (a vehicle
+    model, an engineer name), and only rows with that key are locked instead of the whole table.
+    schema marks functions that drop or create tables, which no other job may run alongside.
+    """
+    def decorator(func):
+        func.lock_reads = tuple(reads)
+        func.lock_writes = tuple(writes)
+        func.lock_key = key
+        func.lock_schema = schema
+        return func
+    return decorator
+
+
+def lock_requests(func, exclusive, args, kwargs):
+    """Map each resource func needs to a lock mode.
+
+    Resources are table names, (table, key) pairs and "schema", which every job holds shared unless it
+    drops or creates tables. Functions that never declared their tables lock every table, shared or exclusive.
+    """
+    if not hasattr(func, "lock_writes"):
+        mode = "X" if exclusive else "S"
+        return {"schema": "S", **{table: mode for table in TABLES}}
+
+    requests = {"schema": "X" if func.lock_schema else "S"}
+    requests.update({table: "S" for table in func.lock_reads})
+    requests.update({table: "X" for table in func.lock_writes})
+    if func.lock_key is not None:
+        table, arg_name = func.lock_key
+        key = inspect.signature(func).bind(*args, **kwargs).arguments.get(arg_name)
+        mode = requests[table]
+        requests[table] = "IX" if mode == "X" else "IS"
+        requests[(table, key)] = mode
+    return requests
+
+
+class LockManager:
+    """Reader/writer locks per table and per natural key, for the threads of one server process.
+
+    A job's locks are granted all at once, so jobs never hold some locks while waiting on others
+    and cannot deadlock. Waiting jobs are granted in arrival order, so writers are not starved.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.held = {}
+        # ticket -> requests of every waiting job, in arrival order
+        self.waiting = {}
+        self.tickets = count()
+
+    def can_grant(self, ticket, requests):
+        for resource, mode in requests.items():
+            if any(held_mode not in COMPATIBLE_MODES[mode] for held_mode in self.held.get(resource, [])):
+                return False
+        # Don't overtake an earlier waiting job that wants a conflicting lock
+        for earlier_ticket, earlier in self.waiting.items():
+            if earlier_ticket == ticket:
+                break
+            for resource, mode in requests.items():
+                if resource in earlier and earlier[resource] not in COMPATIBLE_MODES[mode]:
+                    return False
+        return True
+
+    @contextmanager
+    def hold(self, requests):
+        with self.condition:
+            ticket = next(self.tickets)
+            self.waiting[ticket] = requests
+            try:
+                self.condition.wait_for(lambda: self.can_grant(ticket, requests))
+            finally:
+                del self.waiting[ticket]
+            for resource, mode in requests.items():
+                self.held.setdefault(resource, []).append(mode)
+            # Jobs queued behind this one may now be grantable
+            self.condition.notify_all()
+        try:
+            yield
+        finally:
+            with self.condition:
+                for resource, mode in requests.items():
+                    self.held[resource].remove(mode)
+                    if not self.held[resource]:
+                        del self.held[resource]
+                self.condition.notify_all()
+
+
+class FileLockManager:
+    """Table locks on shared lock files, held across every server process that uses the same path prefix.
+
+    flock only has shared and exclusive locks, so row locks are widened to their table. Tables are locked
+    in sorted order to avoid deadlocks between jobs. Each acquisition opens its own file descriptor,
+    because flock treats locks taken through one open file as a single lock, so threads in the same
+    process would otherwise share it. flock does not queue readers behind waiting writers, so a steady
+    stream of readers can hold off a writer.
+    """
+
+    def __init__(self, path_prefix):
+        self.path_prefix = path_prefix
+
+    @contextmanager
+    def hold(self, requests):
+        tables = {}
+        for resource, mode in requests.items():
+            table = resource if isinstance(resource, str) else resource[0]
+            exclusive = mode in ["IX", "X"]
+            tables[table] = tables.get(table, False) or exclusive
+
+        fds = []
+        try:
+            for table in sorted(tables):
+                fd = os.open(f"{self.path_prefix}-{table}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+                fds.append(fd)
+                fcntl.flock(fd, fcntl.LOCK_EX if tables[table] else fcntl.LOCK_SH)
+            yield
+        finally:
+            # Closing a descriptor releases its lock
+            for fd in reversed(fds):
+                os.close(fd)
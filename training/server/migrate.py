@@ -0,0 +1,106 @@
+"""Apply schema migrations to a database without dropping its data.
+
+The schema version is kept in the schema_version table. A database created before the table existed
+is at version 0, and reset_db stamps the databases it creates with the latest version.
+
+    migrate upgrade
+    migrate downgrade --to 0
+    migrate current
+"""
+import logging
+import click
+from sqlalchemy import MetaData, Table, Column, Integer, select
+from training.server.base import engine
+from training.server.migrations import MIGRATIONS
+
+version_metadata = MetaData()
+schema_version = Table(
+    "schema_version", version_metadata,
+    Column("version", Integer, nullable=False)
+)
+
+def head_version():
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+def current_version(connection):
+    schema_version.create(connection, checkfirst=True)
+    version = connection.execute(select(schema_version.c.version)).scalar()
+    return 0 if version is None else version
+
+
+def set_version(connection, version):
+    connection.execute(schema_version.delete())
+    connection.execute(schema_version.insert(), {"version": version})
+
+
+def stamp(bind=engine, version=None):
+    """Record that the schema is at version (the latest by default) without running any migrations."""
+    with bind.begin() as connection:
+        schema_version.create(connection, checkfirst=True)
+        set_version(connection, head_version() if version is None else version)
+
+
+def upgrade(bind=engine, target=None):
+    """Run the up migrations after the current version, through target (the latest by default).
+
+    Each migration commits on its own along with the new version, so a failed migration leaves the
+    database at the last version that succeeded. MySQL commits DDL as it runs, so a migration that
+    fails there part way may need its finished steps undone by hand.
+    """
+    target = head_version() if target is None else target
+    with bind.begin() as connection:
+        current = current_version(connection)
+    for migration in MIGRATIONS:
+        if current < migration.version <= target:
+            logging.info(f"Upgrading the schema to version {migration.version}: {migration.description}")
+            with bind.begin() as connection:
+                migration.up(connection)
+                set_version(connection, migration.version)
+            print(f"Upgraded to version {migration.version}: {migration.description}")
+
+
+def downgrade(bind=engine, target=0):
+    """Run the down migrations from the current version back to target."""
+    with bind.begin() as connection:
+        current = current_version(connection)
+    for migration in reversed(MIGRATIONS):
+        if target < migration.version <= current:
+            logging.info(f"Downgrading the schema from version {migration.version}: {migration.description}")
+            with bind.begin() as connection:
+                migration.down(connection)
+                set_version(connection, migration.version - 1)
+            print(f"Downgraded to version {migration.version - 1}")
+
+
+@click.group()
+def main():
+    logging.basicConfig(filename="migrate.log", level=logging.DEBUG, format="%(asctime)s - %(levelname)s: %(message)s")
+
+
+@main.command("upgrade")
+@click.option("--to", "target", type=click.IntRange(0, head_version()), default=None, help="Version to stop at. Defaults to the latest.")
+def upgrade_command(target):
+    upgrade(target=target)
+
+
+@main.command("downgrade")
+@click.option("--to", "target", type=click.IntRange(0, head_version()), required=True, help="Version to go back to.")
+def downgrade_command(target):
+    downgrade(target=target)
+
+
+@main.command("current")
+def current_command():
+    with engine.begin() as connection:
+        version = current_version(connection)
+    print(f"Schema version {version} of {head_version()}")
+
+
+@main.command("history")
+def history_command():
+    for migration in MIGRATIONS:
+        print(f"{migration.version}: {migration.description}")
+
+if __name__ == "__main__":
+    main()
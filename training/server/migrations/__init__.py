@@ -0,0 +1,14 @@
+"""Schema migrations, applied in version order by training.server.migrate.
+
+Each migration module has a version number one above the previous one, a description, and up and down
+functions that take a connection and move the schema to that version or back to the one before it.
+"""
+from training.server.migrations import m0001_association_keys, m0002_row_versions, m0003_change_events, m0004_change_events_table_index, m0005_table_version_shards
+
+MIGRATIONS = [
+    m0001_association_keys,
+    m0002_row_versions,
+    m0003_change_events,
+    m0004_change_events_table_index,
+    m0005_table_version_shards
+]
@@ -0,0 +1,79 @@
+from sqlalchemy import MetaData, Table, Column, Integer, ForeignKey, Index, inspect, select, text
+
+version = 1
+description = "Primary key on vehicle_engineers, engineer_id indexes on vehicle_engineers, laptops and contact_details"
+
+# The tables as this migration leaves them, frozen here so later changes to the models don't change what it does
+metadata = MetaData()
+Table("vehicles", metadata, Column("id", Integer, primary_key=True))
+Table("engineers", metadata, Column("id", Integer, primary_key=True))
+old_association = Table(
+    "vehicle_engineers", metadata,
+    Column("vehicle_id", Integer, ForeignKey("vehicles.id")),
+    Column("engineer_id", Integer, ForeignKey("engineers.id"))
+)
+laptops = Table(
+    "laptops", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("engineer_id", Integer, ForeignKey("engineers.id"), index=True)
+)
+contact_details = Table(
+    "contact_details", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("engineer_id", Integer, ForeignKey("engineers.id"), index=True)
+)
+
+# The tables the association is rebuilt into, before it is renamed to vehicle_engineers
+keyed_association = Table(
+    "vehicle_engineers_new", metadata,
+    Column("vehicle_id", Integer, ForeignKey("vehicles.id"), primary_key=True),
+    Column("engineer_id", Integer, ForeignKey("engineers.id"), primary_key=True),
+    Index("ix_vehicle_engineers_engineer_id", "engineer_id")
+)
+unkeyed_association = Table(
+    "vehicle_engineers_unkeyed", metadata,
+    Column("vehicle_id", Integer, ForeignKey("vehicles.id")),
+    Column("engineer_id", Integer, ForeignKey("engineers.id"))
+)
+
+def has_index_on(inspector, table_name, column_name):
+    # MySQL indexes foreign key columns on its own, so there may already be an index to use
+    return any(index["column_names"][:1] == [column_name] for index in inspector.get_indexes(table_name))
+
+
+def rebuild_association(connection, new_association):
+    """Copy the distinct assignments into new_association and swap it in for vehicle_engineers.
+    The table is rebuilt rather than altered, since SQLite can't add or drop a primary key in place."""
+    new_association.create(connection)
+    old = old_association.c
+    pairs = select(old.vehicle_id, old.engineer_id).where(old.vehicle_id.isnot(None), old.engineer_id.isnot(None)).distinct()
+    connection.execute(new_association.insert().from_select(["vehicle_id", "engineer_id"], pairs))
+    connection.execute(text("DROP TABLE vehicle_engineers"))
+    connection.execute(text(f"ALTER TABLE {new_association.name} RENAME TO vehicle_engineers"))
+
+
+def up(connection):
+    """Duplicate assignments are dropped. Safe to run on a database that already has the keys and indexes."""
+    inspector = inspect(connection)
+    if not inspector.get_pk_constraint("vehicle_engineers")["constrained_columns"]:
+        rebuild_association(connection, keyed_association)
+
+    for table in [laptops, contact_details]:
+        for index in table.indexes:
+            if not has_index_on(inspector, table.name, list(index.columns)[0].name):
+                index.create(connection)
+
+
+def down(connection):
+    inspector = inspect(connection)
+    if inspector.get_pk_constraint("vehicle_engineers")["constrained_columns"]:
+        rebuild_association(connection, unkeyed_association)
+
+    # MySQL won't drop the only index on a foreign key column
+    if connection.dialect.name == "mysql":
+        return
+    for table in [laptops, contact_details]:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                index.drop(connection)
@@ -0,0 +1,34 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, inspect, text
+
+version = 2
+description = "Version columns on vehicles, engineers, laptops and contact_details, and the table_versions table"
+
+VERSIONED_TABLES = ["vehicles", "engineers", "laptops", "contact_details"]
+LOCKED_TABLES = ["contact_details", "engineers", "laptops", "vehicle_engineers", "vehicles"]
+
+# Frozen here so later changes to the models don't change what this migration does
+metadata = MetaData()
+table_versions = Table(
+    "table_versions", metadata,
+    Column("table_name", String(30), primary_key=True),
+    Column("version", Integer, nullable=False)
+)
+
+def up(connection):
+    """Existing rows start at version 1. Safe to run on a database that already has the versions."""
+    inspector = inspect(connection)
+    for table in VERSIONED_TABLES:
+        if "version" not in {column["name"] for column in inspector.get_columns(table)}:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+    if not inspector.has_table("table_versions"):
+        table_versions.create(connection)
+        connection.execute(table_versions.insert(), [{"table_name": table, "version": 1} for table in LOCKED_TABLES])
+
+
+def down(connection):
+    table_versions.drop(connection, checkfirst=True)
+    inspector = inspect(connection)
+    for table in VERSIONED_TABLES:
+        if "version" in {column["name"] for column in inspector.get_columns(table)}:
+            # SQLite only drops columns from version 3.35
+            connection.execute(text(f"ALTER TABLE {table} DROP COLUMN version"))
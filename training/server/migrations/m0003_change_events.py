@@ -0,0 +1,22 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String
+
+version = 3
+description = "change_events table"
+
+# Frozen here so later changes to the models don't change what this migration does
+metadata = MetaData()
+change_events = Table(
+    "change_events", metadata,
+    Column("seq", Integer, primary_key=True, autoincrement=True),
+    Column("table_name", String(30), nullable=False),
+    Column("event", String(6), nullable=False),
+    Column("row_id", Integer, nullable=False)
+)
+
+def up(connection):
+    """Safe to run on a database that already has the table."""
+    change_events.create(connection, checkfirst=True)
+
+
+def down(connection):
+    change_events.drop(connection, checkfirst=True)
@@ -0,0 +1,29 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, Index, inspect
+
+version = 4
+description = "table_name index on change_events"
+
+# Frozen here so later changes to the models don't change what this migration does
+metadata = MetaData()
+change_events = Table(
+    "change_events", metadata,
+    Column("seq", Integer, primary_key=True, autoincrement=True),
+    Column("table_name", String(30), nullable=False),
+    Column("event", String(6), nullable=False),
+    Column("row_id", Integer, nullable=False)
+)
+table_name_index = Index("ix_change_events_table_name", change_events.c.table_name)
+
+def has_index(connection):
+    return table_name_index.name in {index["name"] for index in inspect(connection).get_indexes("change_events")}
+
+
+def up(connection):
+    """Safe to run on a database that already has the index."""
+    if not has_index(connection):
+        table_name_index.create(connection)
+
+
+def down(connection):
+    if has_index(connection):
+        table_name_index.drop(connection)
@@ -0,0 +1,61 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, select, func, text
+
+version = 5
+description = "table_versions counts commits on several shard rows per table"
+
+SHARDS = 8
+
+# The tables before and after this migration, frozen here so later changes to the models don't change what it does
+before = MetaData()
+change_events = Table(
+    "change_events", before,
+    Column("seq", Integer, primary_key=True, autoincrement=True),
+    Column("table_name", String(30), nullable=False),
+    Column("event", String(6), nullable=False),
+    Column("row_id", Integer, nullable=False)
+)
+unsharded_versions = Table(
+    "table_versions", before,
+    Column("table_name", String(30), primary_key=True),
+    Column("version", Integer, nullable=False)
+)
+unsharded_rebuild = unsharded_versions.to_metadata(before, name="table_versions_rebuilt")
+
+after = MetaData()
+sharded_versions = Table(
+    "table_versions", after,
+    Column("table_name", String(30), primary_key=True),
+    Column("shard", Integer, primary_key=True, autoincrement=False),
+    Column("version", Integer, nullable=False)
+)
+sharded_rebuild = sharded_versions.to_metadata(after, name="table_versions_rebuilt")
+
+def swap_in(connection, rebuilt):
+    """Replace table_versions with the rebuilt table. Rebuilt rather than altered, since SQLite can't change a primary key in place."""
+    connection.execute(text("DROP TABLE table_versions"))
+    connection.execute(text(f"ALTER TABLE {rebuilt.name} RENAME TO table_versions"))
+
+
+def up(connection):
+    """Version 4 counted each table's change events towards its version, so shard 0 starts from that total."""
+    versions = dict(connection.execute(select(unsharded_versions.c.table_name, unsharded_versions.c.version)).all())
+    events = select(change_events.c.table_name, func.count()).group_by(change_events.c.table_name)
+    for table, count in connection.execute(events):
+        if table in versions:
+            versions[table] += count
+    sharded_rebuild.create(connection)
+    if versions:
+        connection.execute(sharded_rebuild.insert(), [{"table_name": table, "shard": shard, "version": version if shard == 0 else 0}
+                                                      for table, version in versions.items() for shard in range(SHARDS)])
+    swap_in(connection, sharded_rebuild)
+
+
+def down(connection):
+    """Each table keeps the sum of its shards. Version 4 adds the change events on top, so versions don't go down."""
+    sums = select(sharded_versions.c.table_name, func.sum(sharded_versions.c.version)).group_by(sharded_versions.c.table_name)
+    # MySQL sums to a Decimal
+    versions = [{"table_name": table, "version": int(version)} for table, version in connection.execute(sums)]
+    unsharded_rebuild.create(connection)
+    if versions:
+        connection.execute(unsharded_rebuild.insert(), versions)
+    swap_in(connection, unsharded_rebuild)
@@ -1,13 +1,48 @@
-from sqlalchemy import Column, Integer, String, Boolean, Date, Numeric, Table, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, Date, Numeric, Table, ForeignKey, Index, event
 from sqlalchemy.orm import relationship, backref
 from training.server.base import Base
+from training.server.locks import TABLES
 
+# The primary key also indexes lookups by vehicle, the second index covers lookups by engineer
 vehicle_engineer_association = Table(
     'vehicle_engineers', Base.metadata,
-    Column('vehicle_id', Integer, ForeignKey('vehicles.id')),
-    Column('engineer_id', Integer, ForeignKey('engineers.id'))
+    Column('vehicle_id', Integer, ForeignKey('vehicles.id'), primary_key=True),
+    Column('engineer_id', Integer, ForeignKey('engineers.id'), primary_key=True),
+    Index('ix_vehicle_engineers_engineer_id', 'engineer_id')
 )
 
+# Commits that wrote to each table, counted on VERSION_SHARDS rows per table. A commit adds one to a
+# random shard of each table it wrote, so concurrent writers seldom wait on the same row lock
+VERSION_SHARDS = 8
+
+table_versions = Table(
+    'table_versions', Base.metadata,
+    Column('table_name', String(30), primary_key=True),
+    Column('shard', Integer, primary_key=True, autoincrement=False),
+    Column('version', Integer, nullable=False)
+)
+
+@event.listens_for(table_versions, "after_create")
+def insert_table_versions(target, connection, **kw):
+    connection.execute(table_versions.insert(), [{"table_name": table, "shard": shard, "version": 0}
+                                                 for table in TABLES for shard in range(VERSION_SHARDS)])
+
+# Rows inserted, updated and deleted, numbered by the database as they are written
+change_events = Table(
+    'change_events', Base.metadata,
+    Column('seq', Integer, primary_key=True, autoincrement=True),
+    Column('table_name', String(30), nullable=False),
+    Column('event', String(6), nullable=False),
+    Column('row_id', Integer, nullable=False),
+    Index('ix_change_events_table_name', 'table_name')
+)
+
+def project(json, fields):
+    """Keep the to_json entries named in fields, or all of them if fields is None."""
+    if fields is None:
+        return json
+    return {key: value for key, value in json.items() if key in fields}
+
 class Vehicle(Base):
     __tablename__ = 'vehicles'
 
@@ -17,6 +52,8 @@ class Vehicle(Base):
     quantity = Column(Integer)
     price = Column(Numeric)
     manufacture_date = Column(Date)
+    # Counts changes to the row, its engineer assignments included
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     engineers = relationship("Engineer", secondary=vehicle_engineer_association)
 
     def __init__(self, model, quantity, price, manufacture_date):
@@ -29,9 +66,10 @@ class Vehicle(Base):
     def __str__(self):
         return f"ID: {self.id}\nModel: {self.model}\nQuantity: {self.quantity}\nPrice: {self.price}\nManufacture Date: {self.manufacture_date}"
 
-    def to_json(self):
-        engineers = [engin.name for engin in self.engineers]
-        return {
+    def to_json(self, fields=None):
+        # Related rows are only loaded when asked for
+        engineers = [engin.name for engin in self.engineers] if fields is None or "engineers" in fields else None
+        return project({
             "id": self.id,
             "data_type": "vehicle",
             "model": self.model,
@@ -40,8 +78,9 @@ class Vehicle(Base):
             "manufacture_year": self.manufacture_date.year,
             "manufacture_month": self.manufacture_date.month,
             "manufacture_date": self.manufacture_date.day,
-            "engineers": engineers
-        }
+            "engineers": engineers,
+            "version": self.version
+        }, fields)
 
 class Engineer(Base):
     __tablename__ = 'engineers'
@@ -49,6 +88,7 @@ class Engineer(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(20), unique=True)
     birthday = Column(Date)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     def __init__(self, name, birthday):
         self.name = name
@@ -57,15 +97,16 @@ class Engineer(Base):
     def __str__(self):
         return f"ID: {self.id}\nName: {self.name}\nBirthday: {self.birthday}"
 
-    def to_json(self):
-        return {
+    def to_json(self, fields=None):
+        return project({
             "id": self.id,
             "data_type": "engineer",
             "name": self.name,
             "birth_year": self.birthday.year,
             "birth_month": self.birthday.month,
-            "birth_date": self.birthday.day
-        }
+            "birth_date": self.birthday.day,
+            "version": self.version
+        }, fields)
 
 class Laptop(Base):
     __tablename__ = 'laptops'
@@ -73,7 +114,8 @@ class Laptop(Base):
     id = Column(Integer, primary_key=True)
     model = Column(String(20))
     date_loaned = Column(Date)
-    engineer_id = Column(Integer, ForeignKey("engineers.id"))
+    engineer_id = Column(Integer, ForeignKey("engineers.id"), index=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     engineer = relationship("Engineer", backref=backref("laptop", uselist=False))
 
     def __init__(self, model, date_loaned, engineer):
@@ -84,17 +126,20 @@ class Laptop(Base):
     def __str__(self):
         return f"ID: {self.id}\nModel: {self.model}\nDate Loaned: {self.date_loaned}\nEngineer: {str(self.engineer)}"
 
-    def to_json(self):
-        engin_name = "None" if self.engineer is None else self.engineer.name
-        return {
+    def to_json(self, fields=None):
+        engin_name = None
+        if fields is None or "engineer" in fields:
+            engin_name = "None" if self.engineer is None else self.engineer.name
+        return project({
             "id": self.id,
             "data_type": "laptop",
             "model": self.model,
             "loan_year": self.date_loaned.year,
             "loan_month": self.date_loaned.month,
             "loan_date": self.date_loaned.day,
-            "engineer": engin_name
-        }
+            "engineer": engin_name,
+            "version": self.version
+        }, fields)
 
 class ContactDetails(Base):
     __tablename__ = 'contact_details'
@@ -102,7 +147,8 @@ class ContactDetails(Base):
     id = Column(Integer, primary_key=True)
     phone_number = Column(String(12), unique=True)
     address = Column(String(100))
-    engineer_id = Column(Integer, ForeignKey('engineers.id'))
+    engineer_id = Column(Integer, ForeignKey('engineers.id'), index=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     engineer = relationship('Engineer', backref='contact_details')
 
     def __init__(self, phone_number, address, engineer):
@@ -113,12 +159,15 @@ class ContactDetails(Base):
     def __str__(self):
         return f"ID: {self.id}\nPhone Number: {self.phone_number}\nAddress: {self.address}\nEngineer: {str(self.engineer)}"
 
-    def to_json(self):
-        engin_name = "None" if self.engineer is None else self.engineer.name
-        return {
+    def to_json(self, fields=None):
+        engin_name = None
+        if fields is None or "engineer" in fields:
+            engin_name = "None" if self.engineer is None else self.engineer.name
+        return project({
             "id": self.id,
             "data_type": "contact_details",
             "phone_number": self.phone_number,
             "address": self.address,
-            "engineer": engin_name
-        }
\ No newline at end of file
+            "engineer": engin_name,
+            "version": self.version
+        }, fields)
\ No newline at end of file
@@ -0,0 +1,93 @@
+import logging
+import threading
+from itertools import count
+from time import monotonic
+from contextlib import contextmanager
+from sqlalchemy.exc import DBAPIError
+
+STRATEGIES = ["round-robin", "least-connections"]
+
+class ReplicaRouter:
+    """Chooses what each job's session is bound to: read jobs go to a replica, every other job to the primary.
+
+    A client that wrote within the last read_your_writes seconds keeps reading from the primary, so it sees
+    its own writes before they reach the replicas. A replica that can't be connected to is skipped for
+    retry_after seconds, and reads go to the primary while no replica is available.
+    """
+
+    def __init__(self, primary, replicas, strategy="round-robin", read_your_writes=5.0, retry_after=30.0):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.strategy = strategy
+        self.read_your_writes = read_your_writes
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.turns = count()
+        # Jobs using each replica, and when each failed replica may be tried again
+        self.in_use = [0] * len(self.replicas)
+        self.down_until = [0.0] * len(self.replicas)
+        # client key -> time of the client's last write
+        self.last_writes = {}
+
+    def note_write(self, client_key):
+        now = monotonic()
+        with self.lock:
+            self.last_writes[client_key] = now
+            # Forget clients whose writes have had time to reach the replicas
+            self.last_writes = {key: wrote for key, wrote in self.last_writes.items() if now - wrote < self.read_your_writes}
+
+    def wrote_recently(self, client_key):
+        with self.lock:
+            wrote = self.last_writes.get(client_key)
+        return wrote is not None and monotonic() - wrote < self.read_your_writes
+
+    def choose_replica(self, tried):
+        """Index of the replica to use next, counted as in use, or None if no replica is left to try."""
+        now = monotonic()
+        with self.lock:
+            available = [i for i in range(len(self.replicas)) if i not in tried and self.down_until[i] <= now]
+            if not available:
+                return None
+            if self.strategy == "least-connections":
+                replica = min(available, key=lambda i: self.in_use[i])
+            else:
+                replica = available[next(self.turns) % len(available)]
+            self.in_use[replica] += 1
+            return replica
+
+    def release(self, replica, failed=False):
+        with self.lock:
+            self.in_use[replica] -= 1
+            if failed:
+                self.down_until[replica] = monotonic() + self.retry_after
+
+    @contextmanager
+    def bind(self, read_only, client_key=None):
+        """Yield the bind for one job's session: a connection to a replica, or the primary engine."""
+        if not read_only:
+            try:
+                yield self.primary
+            finally:
+                if client_key is not None:
+                    self.note_write(client_key)
+            return
+
+        if client_key is None or not self.wrote_recently(client_key):
+            tried = set()
+            replica = self.choose_replica(tried)
+            while replica is not None:
+                try:
+                    connection = self.replicas[replica].connect()
+                except DBAPIError as err:
+                    logging.warning(f"Read replica {self.replicas[replica].url!r} is unavailable, skipping it for {self.retry_after} seconds: {err.orig}")
+                    self.release(replica, failed=True)
+                    tried.add(replica)
+                    replica = self.choose_replica(tried)
+                    continue
+                try:
+                    yield connection
+                finally:
+                    connection.close()
+                    self.release(replica)
+                return
+        yield self.primary
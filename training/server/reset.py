@@ -1,15 +1,62 @@
 from training.server.inserts import insert_default_items
 from training.server.base import Session, engine, Base
-from training.server.model import Vehicle, Laptop, ContactDetails, Engineer
+from sqlalchemy import inspect, select, update, func, text
+from training.server.model import Vehicle, Laptop, ContactDetails, Engineer, table_versions, change_events
+from training.server.locks import uses_tables, TABLES
+from training.server.migrate import stamp
+from training.server.feed import RESET
 
+def read_table_versions():
+    if not inspect(engine).has_table(table_versions.name):
+        return {}
+    with engine.connect() as connection:
+        versions = select(table_versions.c.table_name, func.sum(table_versions.c.version)).group_by(table_versions.c.table_name)
+        # MySQL sums to a Decimal
+        return {table: int(version) for table, version in connection.execute(versions)}
+
+
+def read_last_seq():
+    if not inspect(engine).has_table(change_events.name):
+        return 0
+    with engine.connect() as connection:
+        return connection.execute(select(func.max(change_events.c.seq))).scalar() or 0
+
+
+def write_reset_event(last_seq):
+    # Numbered on from the dropped events, subscribers past any of them read the tables again
+    # when the feed sends them this one. The default rows' events follow it
+    with engine.begin() as connection:
+        connection.execute(change_events.insert().values(seq=last_seq + 1, table_name=change_events.name, event=RESET, row_id=0))
+        if engine.dialect.name == "postgresql":
+            # An explicit seq doesn't move the serial column's sequence
+            connection.execute(text("SELECT setval(pg_get_serial_sequence('change_events', 'seq'), :seq)"), {"seq": last_seq + 1})
+
+
+def carry_over_table_versions(old_versions):
+    # Versions continue from where they were before the reset, so a version a client
+    # was sent before the reset can't match the reset tables
+    with engine.begin() as connection:
+        for table, version in old_versions.items():
+            connection.execute(update(table_versions).where(table_versions.c.table_name == table, table_versions.c.shard == 0)
+                               .values(version=table_versions.c.version + version))
+
+
+@uses_tables(writes=TABLES, schema=True)
 def reset_db():
     print("Attempting to reset the database")
+    old_versions = read_table_versions()
+    last_seq = read_last_seq()
     session = Session()
     Base.metadata.drop_all(engine)
     print("Called drop_all on base metadata")
     session.commit()
     print("Committed drop all")
+    Base.metadata.create_all(engine)
+    write_reset_event(last_seq)
     insert_default_items()
+    carry_over_table_versions(old_versions)
+    # create_all made the latest schema, later upgrades start from there
+    stamp(engine)
     session.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,36 @@
+"""Statements for the lookups db_utils runs on every job, built once with bound parameters.
+
+A statement built per call has to be constructed and have its cache key generated before SQLAlchemy finds
+its compiled form. These are built at import, so each call only binds its values:
+
+    session.execute(engineer_by_name, {"name": name}).scalars().first()
+"""
+from sqlalchemy import select, bindparam
+from sqlalchemy.orm import selectinload, joinedload
+from training.server.model import Vehicle, vehicle_engineer_association, Engineer, Laptop, ContactDetails
+
+vehicle_by_id = select(Vehicle).options(selectinload(Vehicle.engineers)).where(Vehicle.id == bindparam("id"))
+vehicles_by_model = select(Vehicle).options(selectinload(Vehicle.engineers)).where(Vehicle.model == bindparam("model"))
+# For reads whose fields leave out the engineers, which are then never loaded
+vehicle_by_id_without_engineers = select(Vehicle).where(Vehicle.id == bindparam("id"))
+vehicles_by_model_without_engineers = select(Vehicle).where(Vehicle.model == bindparam("model"))
+vehicles_by_engineer_id = select(Vehicle).options(selectinload(Vehicle.engineers)) \
+    .join(vehicle_engineer_association, vehicle_engineer_association.c.vehicle_id == Vehicle.id) \
+    .where(vehicle_engineer_association.c.engineer_id == bindparam("engineer_id"))
+
+engineer_by_id = select(Engineer).where(Engineer.id == bindparam("id"))
+engineer_by_name = select(Engineer).where(Engineer.name == bindparam("name")).limit(1)
+engineers_by_vehicle_model = select(Engineer) \
+    .join(vehicle_engineer_association, vehicle_engineer_association.c.engineer_id == Engineer.id) \
+    .join(Vehicle, Vehicle.id == vehicle_engineer_association.c.vehicle_id) \
+    .where(Vehicle.model == bindparam("model"))
+
+laptop_by_id = select(Laptop).options(joinedload(Laptop.engineer)).where(Laptop.id == bindparam("id"))
+laptops_by_model = select(Laptop).options(joinedload(Laptop.engineer)).where(Laptop.model == bindparam("model"))
+laptop_by_model_owner = select(Laptop).options(joinedload(Laptop.engineer)) \
+    .where(Laptop.model == bindparam("model"), Laptop.engineer_id == bindparam("engineer_id")).limit(1)
+laptop_by_owner = select(Laptop).options(joinedload(Laptop.engineer)).where(Laptop.engineer_id == bindparam("engineer_id")).limit(1)
+
+contact_details_by_id = select(ContactDetails).options(joinedload(ContactDetails.engineer)).where(ContactDetails.id == bindparam("id"))
+contact_details_by_engineer_id = select(ContactDetails).options(joinedload(ContactDetails.engineer)) \
+    .where(ContactDetails.engineer_id == bindparam("engineer_id"))
@@ -0,0 +1,58 @@
+from contextlib import contextmanager
+from sqlalchemy.exc import DBAPIError
+
+ISOLATION_LEVELS = ["READ UNCOMMITTED", "READ COMMITTED", "REPEATABLE READ", "SERIALIZABLE"]
+
+# MySQL: 1213 deadlock, 1205 lock wait timeout. Postgres: 40001 serialization failure, 40P01 deadlock.
+RETRYABLE_MYSQL_ERRORS = {1213, 1205}
+RETRYABLE_SQLSTATES = {"40001", "40P01"}
+
+def is_retryable(err):
+    """Whether the database aborted the transaction because of a conflict, so running it again may succeed."""
+    if not isinstance(err, DBAPIError) or err.orig is None:
+        return False
+    orig = err.orig
+    if getattr(orig, "pgcode", None) in RETRYABLE_SQLSTATES:
+        return True
+    if getattr(orig, "sqlstate", None) in RETRYABLE_SQLSTATES:
+        return True
+    if orig.args and orig.args[0] in RETRYABLE_MYSQL_ERRORS:
+        return True
+    # SQLite reports writer conflicts as "database is locked"
+    return "database is locked" in str(orig)
+
+
+def commit(session):
+    """Commit the session, or only flush it when its job runs as one transaction that handle_job commits."""
+    if session.info.get("unit_of_work"):
+        session.flush()
+    else:
+        session.commit()
+
+
+@contextmanager
+def savepoint(session):
+    """Context for a write that may fail on its own. Within a job's transaction it is a savepoint,
+    so a failed write is rolled back without rolling back the rest of the job.
+
+    A conflict can abort the whole transaction though, so it is noted in session.info["conflict"]
+    for handle_job to run the job again, even if the write's caller answers the client and carries on.
+    """
+    if not session.info.get("unit_of_work"):
+        yield
+        return
+    try:
+        with session.begin_nested():
+            yield
+    except DBAPIError as err:
+        # Rolling back to the savepoint fails too when the database already rolled back the transaction
+        conflict = err if is_retryable(err) else err.__context__
+        if conflict is not None and is_retryable(conflict):
+            session.info["conflict"] = conflict
+        raise
+
+
+def rollback(session):
+    # Within a job's transaction the failed write's savepoint has already been rolled back
+    if not session.info.get("unit_of_work"):
+        session.rollback()
@@ -0,0 +1,109 @@
+"""Row and table versions, kept up to date as sessions write.
+
+Each vehicle, engineer, laptop and contact details row has a version that goes up whenever the row
+changes (a vehicle's engineer assignments included), and table_versions counts the commits that
+wrote to each table. A table's count is spread over VERSION_SHARDS rows and each commit adds to a
+random one, so writers to the same table seldom wait on each other's row lock. A read job that sends
+"if_version" (null to start with) gets the sum of the versions of the tables it reads in its response,
+which only ever goes up, and is told nothing changed when it sends back the version it was given.
+
+The session events here version rows changed through the ORM and count every insert, update and
+delete run through a session against its table. Rows changed by Core statements are versioned by
+db_utils with bump_versions.
+"""
+import random
+from sqlalchemy import event, inspect, select, update, func
+from sqlalchemy.orm import Session as SessionClass
+from sqlalchemy.orm.interfaces import ONETOMANY
+from training.server.locks import uses_tables, TABLES
+from training.server.model import table_versions, VERSION_SHARDS, Vehicle, Engineer, Laptop, ContactDetails
+from training.server.transactions import commit
+
+VERSIONED = (Vehicle, Engineer, Laptop, ContactDetails)
+
+# The tables each data type's reads are built from
+READ_TABLES = {
+    "vehicle": ["vehicles", "vehicle_engineers", "engineers"],
+    "engineer": ["engineers"],
+    "laptop": ["laptops", "engineers"],
+    "contact_details": ["contact_details", "engineers"],
+    "vehicle_engineers": ["vehicles", "vehicle_engineers", "engineers"]
+}
+
+def row_changed(obj):
+    """Whether a column of obj changed, or a relationship kept in its row or in an association table.
+    Collections of other rows that refer to obj (an engineer's laptop) are not part of obj's row."""
+    state = inspect(obj)
+    for prop in state.mapper.column_attrs:
+        if state.attrs[prop.key].history.has_changes():
+            return True
+    for prop in state.mapper.relationships:
+        if prop.direction is not ONETOMANY and state.attrs[prop.key].history.has_changes():
+            return True
+    return False
+
+
+def written_tables(session):
+    return session.info.setdefault("written_tables", set())
+
+
+def bump_versions(session, model, whereclause):
+    """Raise the version of the rows of model matching whereclause, for changes made with Core statements.
+    Returns the ids of those rows."""
+    ids = session.execute(select(model.id).where(whereclause)).scalars().all()
+    if ids:
+        session.execute(update(model).where(model.id.in_(ids)).values(version=model.version + 1)
+                        .execution_options(synchronize_session="fetch"))
+    return ids
+
+
+@uses_tables()
+def read_table_version(session, tables):
+    """The sum of the versions of tables, or None if they have no versions (a schema before table_versions)."""
+    version = session.execute(select(func.sum(table_versions.c.version)).where(table_versions.c.table_name.in_(tables))).scalar()
+    commit(session)
+    # MySQL sums to a Decimal
+    return None if version is None else int(version)
+
+
+@event.listens_for(SessionClass, "before_flush")
+def version_changed_rows(session, flush_context, instances):
+    for obj in session.new:
+        if isinstance(obj, VERSIONED):
+            written_tables(session).add(obj.__table__.name)
+    for obj in session.deleted:
+        if isinstance(obj, VERSIONED):
+            written_tables(session).add(obj.__table__.name)
+    for obj in session.dirty:
+        if isinstance(obj, VERSIONED) and row_changed(obj):
+            # Incremented by the database, so concurrent changes to a row can't both get the same version
+            obj.version = type(obj).version + 1
+            written_tables(session).add(obj.__table__.name)
+
+
+@event.listens_for(SessionClass, "do_orm_execute")
+def count_statement_writes(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if getattr(table, "name", None) in TABLES:
+            written_tables(orm_execute_state.session).add(table.name)
+
+
+@event.listens_for(SessionClass, "before_commit")
+def bump_table_versions(session):
+    # Flush first, the writes it runs are counted too
+    session.flush()
+    tables = sorted(session.info.pop("written_tables", ()))
+    if tables:
+        # One shard for all the tables, locked in name order, so two commits that pick the same shard
+        # lock its rows in the same order
+        session.execute(update(table_versions)
+                        .where(table_versions.c.table_name.in_(tables), table_versions.c.shard == random.randrange(VERSION_SHARDS))
+                        .values(version=table_versions.c.version + 1))
+
+
+@event.listens_for(SessionClass, "after_transaction_end")
+def forget_written_tables(session, transaction):
+    # Rolled back, the writes never happened
+    if transaction.parent is None:
+        session.info.pop("written_tables", None)
@@ -0,0 +1,68 @@
+import os
+import logging
+import signal
+import tempfile
+import multiprocessing
+from select import select
+from sys import stdin
+from training.server.base import engine, replica_engines
+from training.server.locks import FileLockManager
+from training.sock_utils import bind_listen_socket
+
+def default_lock_prefix(listen_port):
+    return os.path.join(tempfile.gettempdir(), f"training-server-{listen_port}")
+
+
+def run_worker(server_class, sock, lock_prefix, server_args, server_kwargs):
+    # A forked engine would share the parent's pooled connections, so each worker starts its own pool
+    engine.dispose()
+    for replica in replica_engines:
+        replica.dispose()
+    server_class(*server_args, sock=sock, lock_manager=FileLockManager(lock_prefix), interactive=False, **server_kwargs)
+
+
+def run_workers(server_class, listen_port, num_workers, *server_args, lock_prefix=None, **server_kwargs):
+    """Fork num_workers server processes that all accept on one listening socket.
+
+    Each process decodes and handles jobs on its own interpreter, so jobs are not serialized by one GIL.
+    Table locks are lock files shared by every worker. Press "enter" to shut all of them down.
+    """
+    logging.basicConfig(filename="server.log", level=logging.DEBUG, format="%(asctime)s - %(levelname)s: %(message)s")
+    if lock_prefix is None:
+        lock_prefix = default_lock_prefix(listen_port)
+    sock = bind_listen_socket("localhost", listen_port)
+    logging.info(f"Bound server socket to {listen_port} for {num_workers} worker processes")
+
+    context = multiprocessing.get_context("fork")
+    workers = []
+    for _ in range(num_workers):
+        worker = context.Process(target=run_worker, args=(server_class, sock, lock_prefix, (listen_port,) + server_args, server_kwargs))
+        worker.start()
+        logging.info(f"Started server worker process {worker.pid}")
+        workers.append(worker)
+    # Only the workers accept connections
+    sock.close()
+
+    # Stopping the parent stops the workers too
+    terminated = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: terminated.append(signum))
+    print("Press \"enter\" at any time to shutdown the server.")
+    timeout = 0.5
+    while not terminated:
+        i, _, _ = select([stdin], [], [], timeout)
+        if i:
+            break
+        for worker in workers:
+            if worker.exitcode is not None and worker.exitcode != 0:
+                logging.error(f"Server worker process {worker.pid} exited with code {worker.exitcode}")
+        workers = [worker for worker in workers if worker.exitcode is None]
+        if not workers:
+            logging.error("Every server worker process has exited")
+            return
+
+    logging.info("Shutting down the server worker processes...")
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.join()
+    logging.info("Server shutdown")
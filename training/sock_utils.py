@@ -1,12 +1,34 @@
 import socket
+import struct
 import json
+import threading
+
+# Framed messages are a 4 byte big-endian payload length followed by the JSON payload.
+# Legacy messages are raw JSON terminated by the sender closing the socket, so they always start with "{".
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+LEGACY_MESSAGE_START = b"{"
+
+class EncodedList(list):
+    """A list of values already encoded as JSON bytes, sent as a JSON array without encoding them again."""
+
+
+def encode_message(msg_dict):
+    """Encode a message dictionary as JSON bytes, splicing in the values of any EncodedList as they are."""
+    if not any(isinstance(value, EncodedList) for value in msg_dict.values()):
+        return json.dumps(msg_dict).encode('utf-8')
+    members = []
+    for key, value in msg_dict.items():
+        encoded = b"[" + b", ".join(value) + b"]" if isinstance(value, EncodedList) else json.dumps(value).encode('utf-8')
+        members.append(json.dumps(key).encode('utf-8') + b": " + encoded)
+    return b"{" + b", ".join(members) + b"}"
+
 
 def send_message(host, port, msg_dict):
     """Connect to sock via host and port and sends a message to sock."""
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.connect((host, port))
-    msg_json = json.dumps(msg_dict)
-    sock.sendall(msg_json.encode('utf-8'))
+    sock.sendall(encode_message(msg_dict))
     # Close the socket so 'data' will be null in get_data_from_connection
     sock.close()
 
@@ -19,13 +41,28 @@ def decode_message_chunks(chunks):
     return json.loads(msg_str)
 
 
-def get_data_from_connection(sock):
-    """Accept a client connection and get data until they close the socket."""
+def bind_listen_socket(host, port, timeout=1):
+    """Bind and listen on host and port. Accepts on the returned socket time out after timeout seconds."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen()
+    sock.settimeout(timeout)
+    return sock
+
+
+def accept_connection(sock):
+    """Accept a client connection. Returns None if the accept timed out."""
     try:
         clientsocket, address = sock.accept()
     except socket.timeout:
-        return []
+        return None
     print("Connection from", address[0])
+    return clientsocket, address
+
+
+def read_until_closed(clientsocket):
+    """Get data from an accepted connection until the sender closes the socket."""
     message_chunks = []
     while True:
         try:
@@ -37,3 +74,88 @@ def get_data_from_connection(sock):
         message_chunks.append(data)
     clientsocket.close()
     return message_chunks
+
+
+def get_data_from_connection(sock):
+    """Accept a client connection and get data until they close the socket."""
+    connection = accept_connection(sock)
+    if connection is None:
+        return []
+    clientsocket, _ = connection
+    return read_until_closed(clientsocket)
+
+
+def is_framed_connection(clientsocket):
+    """Peek at the first byte of an accepted connection to tell framed peers from legacy ones."""
+    first_byte = clientsocket.recv(1, socket.MSG_PEEK)
+    return first_byte != b"" and first_byte != LEGACY_MESSAGE_START
+
+
+def encode_frame(msg_dict):
+    """Encode a message dictionary as a length-prefixed frame."""
+    payload = encode_message(msg_dict)
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def recv_exactly(sock, num_bytes):
+    """Read exactly num_bytes from sock. Returns None if the peer closes the socket first."""
+    chunks = []
+    remaining = num_bytes
+    while remaining:
+        data = sock.recv(min(remaining, 65536))
+        if not data:
+            return None
+        chunks.append(data)
+        remaining -= len(data)
+    return b''.join(chunks)
+
+
+def send_frame(sock, msg_dict):
+    """Send one length-prefixed message on a connected socket."""
+    sock.sendall(encode_frame(msg_dict))
+
+
+def recv_frame(sock):
+    """Receive one length-prefixed message from a connected socket. Returns None once the peer closes."""
+    header = recv_exactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    (length,) = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {length} bytes is larger than the {MAX_FRAME_SIZE} byte limit")
+    payload = recv_exactly(sock, length)
+    if payload is None:
+        return None
+    # Note: caller needs to catch errors thrown by json.loads
+    return json.loads(payload.decode("utf-8"))
+
+
+class FramedConnection:
+    """A long-lived socket carrying length-prefixed JSON messages in both directions."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.send_lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, host, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.connect((host, port))
+        return cls(sock)
+
+    def send(self, msg_dict):
+        # Several job threads may answer on the same connection, so writes must not interleave
+        frame = encode_frame(msg_dict)
+        with self.send_lock:
+            self.sock.sendall(frame)
+
+    def recv(self):
+        return recv_frame(self.sock)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
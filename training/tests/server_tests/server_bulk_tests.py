@@ -0,0 +1,87 @@
+import slash
+from training.sock_utils import FramedConnection
+from training.tests.server_tests_base import ServerTestsBase
+
+new_engineer = {"data_type": "engineer", "name": "Steven Universe", "birth_year": 2010, "birth_month": 10, "birth_date": 1}
+mixed_records = [
+    # laptops and contact details may refer to an engineer added in the same batch
+    {"data_type": "laptop", "model": "ThinkPad", "loan_year": 2020, "loan_month": 1, "loan_date": 1, "engineer": "Steven Universe"},
+    {"data_type": "contact_details", "engineer": "Steven Universe", "phone_number": "555-123-4567", "address": "1 Beach City"},
+    new_engineer,
+    {"data_type": "vehicle", "model": "Civic", "quantity": 3, "price": 23000, "manufacture_year": 2017, "manufacture_month": 4, "manufacture_date": 30},
+    {"data_type": "vehicle", "model": "Fusion", "quantity": 2, "price": 23000, "manufacture_year": 2019, "manufacture_month": 5, "manufacture_date": 5}
+]
+expected_statuses = ["success", "success", "success", "success", "updated"]
+bad_records = [
+    {"data_type": "vehicle", "model": "Rando", "quantity": -1, "price": 10000, "manufacture_year": 2021, "manufacture_month": 5, "manufacture_date": 20}, # negative quantity
+    {"data_type": "vehicle", "model": "Bad Day", "quantity": 1, "price": 10000, "manufacture_year": 2020, "manufacture_month": 2, "manufacture_date": 31}, # february 31st doesnt exist
+    {"data_type": "engineer", "name": "Cameron Foss", "birth_year": 1998, "birth_month": 12, "birth_date": 1}, # engineer already exists
+    {"data_type": "engineer", "name": "No Birthday"}, # missing fields
+    {"data_type": "contact_details", "engineer": "Garnet", "phone_number": "555-000-0000", "address": "Nowhere"}, # engineer doesn't exist
+    {"data_type": "contact_details", "engineer": "Cameron Foss", "phone_number": "989-906-0292", "address": "Duplicate"}, # phone number already exists
+    {"data_type": "vehicle_engineers"} # not a data type that can be added
+]
+
+class ServerBulkTests(ServerTestsBase):
+    def __init__(self, test_method_name, fixture_store, fixture_namespace, variation):
+        super().__init__(test_method_name, fixture_store, fixture_namespace, variation)
+        self.conn = None
+
+    def __del__(self):
+        self.listen_sock.close()
+
+    def before(self):
+        print("Resetting database before test")
+        self.request_db_reset()
+        self.conn = FramedConnection.connect("localhost", self.server_port)
+
+    def after(self):
+        self.conn.close()
+
+    def bulk_add(self, records):
+        self.conn.send({"action": "bulk_add", "records": records})
+        server_response = self.conn.recv()
+        assert self.check_server_status(server_response) == "success"
+        assert len(server_response["results"]) == len(records)
+        return [result["status"] for result in server_response["results"]]
+
+    def read(self, data_type, **entries):
+        self.conn.send({"data_type": data_type, "action": "read", **entries})
+        return self.conn.recv()
+
+    #@slash.skipped
+    def test_bulk_add_mixed_records(self):
+        assert self.bulk_add(mixed_records) == expected_statuses
+
+        engineer = self.read("engineer", name="Steven Universe")
+        assert self.check_server_status(engineer) == "success"
+        laptop = self.read("laptop", model="", engineer="Steven Universe")
+        assert laptop["laptops"][0]["model"] == "ThinkPad"
+        contacts = self.read("contact_details", engineer="Steven Universe")
+        assert [contact["phone_number"] for contact in contacts["contact_details"]] == ["555-123-4567"]
+        civic = self.read("vehicle", model="Civic")
+        assert civic["vehicles"][0]["quantity"] == 3
+        fusion = self.read("vehicle", model="Fusion")
+        assert fusion["vehicles"][0]["quantity"] == 5
+
+    #@slash.skipped
+    @slash.parametrize("record", bad_records)
+    def test_bulk_add_reports_bad_records(self, record):
+        # The bad record is skipped, the records around it are still added
+        statuses = self.bulk_add([new_engineer, record, mixed_records[3]])
+        assert statuses == ["success", "error", "success"]
+        assert self.check_server_status(self.read("engineer", name="Steven Universe")) == "success"
+        assert self.check_server_status(self.read("vehicle", model="Civic")) == "success"
+
+    #@slash.skipped
+    def test_bulk_add_duplicates_in_batch(self):
+        statuses = self.bulk_add([new_engineer, new_engineer, mixed_records[3], mixed_records[3]])
+        assert statuses == ["success", "error", "success", "updated"]
+        civic = self.read("vehicle", model="Civic")
+        assert civic["vehicles"][0]["quantity"] == 6
+
+    #@slash.skipped
+    def test_bulk_add_without_records(self):
+        self.conn.send({"action": "bulk_add"})
+        server_response = self.conn.recv()
+        assert server_response["status"] == "error"
@@ -0,0 +1,161 @@
+import slash
+from training.sock_utils import FramedConnection
+from training.tests.server_tests_base import ServerTestsBase
+
+class ServerCacheTests(ServerTestsBase):
+    def __init__(self, test_method_name, fixture_store, fixture_namespace, variation):
+        super().__init__(test_method_name, fixture_store, fixture_namespace, variation)
+        self.conn = None
+
+    def __del__(self):
+        self.listen_sock.close()
+
+    def before(self):
+        print("Resetting database before test")
+        self.request_db_reset()
+        self.conn = FramedConnection.connect("localhost", self.server_port)
+
+    def after(self):
+        self.conn.close()
+
+    def request(self, msg):
+        self.conn.send(msg)
+        return self.conn.recv()
+
+    def cache_stats(self):
+        server_response = self.request({"action": "stats"})
+        assert self.check_server_status(server_response) == "success"
+        return server_response["cache"]
+
+    def read_vehicle_engineers(self, model):
+        server_response = self.request({"data_type": "vehicle", "action": "read", "model": model})
+        assert self.check_server_status(server_response) == "success"
+        return sorted(server_response["vehicles"][0]["engineers"])
+
+    def read_engineer_id(self, name):
+        server_response = self.request({"data_type": "engineer", "action": "read", "name": name})
+        assert self.check_server_status(server_response) == "success"
+        return server_response["engineers"][0]["id"]
+
+    #@slash.skipped
+    def test_repeated_reads_hit_cache(self):
+        self.read_vehicle_engineers("Fusion")
+        before = self.cache_stats()
+        for _ in range(3):
+            assert self.read_vehicle_engineers("Fusion") == ["Jaivenkatram Harirao", "Prerna Sancheti"]
+        after = self.cache_stats()
+        assert after["hits"] - before["hits"] == 3
+        assert after["misses"] == before["misses"]
+
+    #@slash.skipped
+    def test_assignment_invalidates_vehicles(self):
+        assert self.read_vehicle_engineers("Fusion") == ["Jaivenkatram Harirao", "Prerna Sancheti"]
+        assert self.read_vehicle_engineers("Explorer") == ["Cameron Foss", "Prerna Sancheti"]
+        # Jaivenkatram is taken off the Fusion and put on the Explorer
+        engin_id = self.read_engineer_id("Jaivenkatram Harirao")
+        server_response = self.request({"data_type": "engineer", "action": "update", "id": engin_id, "vehicles": ["Bronco", "Mustang Shelby GT500", "Explorer"]})
+        assert self.check_server_status(server_response) == "success"
+        assert self.read_vehicle_engineers("Fusion") == ["Prerna Sancheti"]
+        assert self.read_vehicle_engineers("Explorer") == ["Cameron Foss", "Jaivenkatram Harirao", "Prerna Sancheti"]
+
+    #@slash.skipped
+    def test_rename_invalidates_engineer_and_vehicles(self):
+        engin_id = self.read_engineer_id("Cameron Foss")
+        assert self.read_vehicle_engineers("Explorer") == ["Cameron Foss", "Prerna Sancheti"]
+        server_response = self.request({"data_type": "engineer", "action": "update", "id": engin_id, "name": "Steven Universe"})
+        assert self.check_server_status(server_response) == "success"
+        assert self.request({"data_type": "engineer", "action": "read", "name": "Cameron Foss"})["status"] == "error"
+        assert self.check_server_status(self.request({"data_type": "engineer", "action": "read", "name": "Steven Universe"})) == "success"
+        assert self.read_vehicle_engineers("Explorer") == ["Prerna Sancheti", "Steven Universe"]
+
+    #@slash.skipped
+    def test_delete_laptop_by_id(self):
+        read_msg = {"data_type": "laptop", "action": "read", "model": "all"}
+        laptop_ids = [laptop["id"] for laptop in self.request(read_msg)["laptops"]]
+        delete_msg = {"data_type": "laptop", "action": "delete", "engineer": "", "id": laptop_ids[0]}
+        assert self.check_server_status(self.request(delete_msg)) == "success"
+        assert [laptop["id"] for laptop in self.request(read_msg)["laptops"]] == laptop_ids[1:]
+        assert self.request(delete_msg)["status"] == "error"
+
+    #@slash.skipped
+    def test_read_all_reuses_encoded_rows(self):
+        read_msg = {"data_type": "engineer", "action": "read", "name": "all"}
+        first = self.request(read_msg)
+        assert self.check_server_status(first) == "success"
+        before = self.request({"action": "stats"})["json_cache"]
+        assert self.request(read_msg)["engineers"] == first["engineers"]
+        after = self.request({"action": "stats"})["json_cache"]
+        assert after["hits"] - before["hits"] == len(first["engineers"])
+
+        engin_id = self.read_engineer_id("Cameron Foss")
+        server_response = self.request({"data_type": "engineer", "action": "update", "id": engin_id, "name": "Steven Universe"})
+        assert self.check_server_status(server_response) == "success"
+        names = [engin["name"] for engin in self.request(read_msg)["engineers"]]
+        assert "Steven Universe" in names and "Cameron Foss" not in names
+
+    #@slash.skipped
+    @slash.parametrize("data_type", ["vehicle", "laptop", "contact_details"])
+    def test_read_all_reencodes_rows_showing_renamed_engineer(self, data_type):
+        lookup, entry = {"vehicle": ("model", "vehicles"), "laptop": ("model", "laptops"), "contact_details": ("engineer", "contact_details")}[data_type]
+        read_msg = {"data_type": data_type, "action": "read", lookup: "all"}
+        first = self.request(read_msg)
+        assert self.check_server_status(first) == "success"
+        assert "Cameron Foss" in str(first[entry])
+
+        engin_id = self.read_engineer_id("Cameron Foss")
+        server_response = self.request({"data_type": "engineer", "action": "update", "id": engin_id, "name": "Steven Universe"})
+        assert self.check_server_status(server_response) == "success"
+        # The rows' own versions didn't change, their engineer's did
+        after = self.request(read_msg)
+        assert [row["version"] for row in after[entry]] == [row["version"] for row in first[entry]]
+        assert "Cameron Foss" not in str(after[entry]) and "Steven Universe" in str(after[entry])
+
+    #@slash.skipped
+    def test_read_not_modified_until_table_changes(self):
+        read_msg = {"data_type": "engineer", "action": "read", "name": "all"}
+        first = self.request({**read_msg, "if_version": None})
+        assert self.check_server_status(first) == "success"
+        assert all("version" in engin for engin in first["engineers"])
+
+        server_response = self.request({**read_msg, "if_version": first["version"]})
+        assert server_response == {"status": "not_modified", "version": first["version"]}
+
+        engin_id = self.read_engineer_id("Cameron Foss")
+        cameron = next(engin for engin in first["engineers"] if engin["id"] == engin_id)
+        server_response = self.request({"data_type": "engineer", "action": "update", "id": engin_id, "name": "Steven Universe"})
+        assert self.check_server_status(server_response) == "success"
+        server_response = self.request({**read_msg, "if_version": first["version"]})
+        assert self.check_server_status(server_response) == "success"
+        assert server_response["version"] > first["version"]
+        steven = next(engin for engin in server_response["engineers"] if engin["id"] == engin_id)
+        assert steven["version"] == cameron["version"] + 1
+
+    #@slash.skipped
+    def test_read_without_if_version_has_no_version(self):
+        server_response = self.request({"data_type": "engineer", "action": "read", "name": "all"})
+        assert self.check_server_status(server_response) == "success"
+        assert "version" not in server_response
+
+    #@slash.skipped
+    @slash.parametrize("model", ["all", "Fusion"])
+    def test_read_chosen_fields(self, model):
+        server_response = self.request({"data_type": "vehicle", "action": "read", "model": model, "fields": ["model", "quantity"]})
+        assert self.check_server_status(server_response) == "success"
+        full_response = self.request({"data_type": "vehicle", "action": "read", "model": model})
+        assert server_response["vehicles"] == [{"model": car["model"], "quantity": car["quantity"]} for car in full_response["vehicles"]]
+
+    #@slash.skipped
+    @slash.parametrize("lookup", [{"model": "", "id": 1}, {"model": "Fusion"}])
+    def test_read_without_engineers_keeps_full_reads(self, lookup):
+        full_read = {"data_type": "vehicle", "action": "read", **lookup}
+        full_response = self.request(full_read)
+        assert self.check_server_status(full_response) == "success"
+        server_response = self.request({**full_read, "fields": ["model", "quantity"]})
+        assert server_response["vehicles"] == [{"model": car["model"], "quantity": car["quantity"]} for car in full_response["vehicles"]]
+        # The vehicles read without their engineers are cached apart from those read with them
+        assert self.request(full_read) == full_response
+
+    #@slash.skipped
+    def test_read_unknown_field(self):
+        server_response = self.request({"data_type": "laptop", "action": "read", "model": "all", "fields": ["model", "owner"]})
+        assert server_response["status"] == "error"
@@ -0,0 +1,63 @@
+import os
+import tempfile
+import slash
+from sqlalchemy.pool import QueuePool, StaticPool
+from training.server.config import database_settings, create_configured_engine, create_replica_engines, DEFAULT_DATABASE_URL
+
+class ServerConfigTests(slash.Test):
+    """Database settings read from a scratch config file and environment, no server is needed."""
+
+    def before(self):
+        self.config_dir = tempfile.TemporaryDirectory()
+        self.config_file = os.path.join(self.config_dir.name, "training.ini")
+
+    def after(self):
+        self.config_dir.cleanup()
+
+    def write_config(self, text):
+        with open(self.config_file, "w") as config:
+            config.write(text)
+
+    #@slash.skipped
+    def test_defaults_without_config(self):
+        assert database_settings(environ={}, config_file=self.config_file) == {"url": DEFAULT_DATABASE_URL}
+
+    #@slash.skipped
+    def test_config_file_settings(self):
+        self.write_config("[database]\nurl = sqlite:///training.db\npool_size = 4\nmax_overflow = 2\npool_pre_ping = yes\n")
+        assert database_settings(environ={}, config_file=self.config_file) == {
+            "url": "sqlite:///training.db", "pool_size": 4, "max_overflow": 2, "pool_pre_ping": True
+        }
+
+    #@slash.skipped
+    def test_environment_overrides_config_file(self):
+        self.write_config("[database]\nurl = sqlite:///training.db\npool_size = 4\n")
+        environ = {"TRAINING_DATABASE_URL": "sqlite:///other.db", "TRAINING_POOL_RECYCLE": "3600", "TRAINING_POOL_PRE_PING": "off"}
+        assert database_settings(environ=environ, config_file=self.config_file) == {
+            "url": "sqlite:///other.db", "pool_size": 4, "pool_recycle": 3600, "pool_pre_ping": False
+        }
+
+    #@slash.skipped
+    def test_config_file_from_environment(self):
+        self.write_config("[database]\nurl = sqlite:///training.db\n")
+        assert database_settings(environ={"TRAINING_CONFIG": self.config_file})["url"] == "sqlite:///training.db"
+
+    #@slash.skipped
+    @slash.parametrize(("setting", "value"), [("pool_size", "four"), ("pool_pre_ping", "maybe"), ("pool_timeout", "30")])
+    def test_invalid_settings(self, setting, value):
+        self.write_config(f"[database]\n{setting} = {value}\n")
+        with slash.assert_raises(ValueError):
+            database_settings(environ={}, config_file=self.config_file)
+
+    #@slash.skipped
+    def test_sqlite_engines(self):
+        memory = create_configured_engine({"url": "sqlite://"})
+        pooled = create_configured_engine({"url": "sqlite:///training.db", "pool_size": 4})
+        assert isinstance(memory.pool, StaticPool)
+        assert isinstance(pooled.pool, QueuePool) and pooled.pool.size() == 4
+
+    #@slash.skipped
+    def test_replica_engines(self):
+        replicas = create_replica_engines({"url": "sqlite://", "replica_urls": "sqlite:///replica1.db, sqlite:///replica2.db,"})
+        assert [replica.url.database for replica in replicas] == ["replica1.db", "replica2.db"]
+        assert all(replica.pool._pre_ping for replica in replicas)
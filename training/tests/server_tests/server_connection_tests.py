@@ -0,0 +1,143 @@
+import slash
+from training.sock_utils import FramedConnection
+from training.tests.server_tests_base import ServerTestsBase
+
+vehicle_reads = ["Fusion", "Explorer", "Bronco", "Mustang Shelby GT500", "all"]
+pipeline_depths = [1, 5, 25]
+
+class ServerConnectionTests(ServerTestsBase):
+    def __init__(self, test_method_name, fixture_store, fixture_namespace, variation):
+        super().__init__(test_method_name, fixture_store, fixture_namespace, variation)
+        self.conn = None
+
+    def __del__(self):
+        self.listen_sock.close()
+
+    def before(self):
+        print("Resetting database before test")
+        self.request_db_reset()
+        self.conn = FramedConnection.connect("localhost", self.server_port)
+
+    def after(self):
+        self.conn.close()
+
+    def read_vehicles_msg(self, model):
+        return {
+            "data_type": "vehicle",
+            "action": "read",
+            "model": model
+        }
+
+    #@slash.skipped
+    @slash.parametrize("model", vehicle_reads)
+    def test_in_band_read(self, model):
+        # No "port" entry, so the response comes back on the same connection
+        self.conn.send(self.read_vehicles_msg(model))
+        server_response = self.conn.recv()
+        assert server_response
+        assert self.check_server_status(server_response) == "success"
+        assert "port" not in server_response
+
+    #@slash.skipped
+    def test_many_requests_one_connection(self):
+        for model in vehicle_reads:
+            self.conn.send(self.read_vehicles_msg(model))
+            server_response = self.conn.recv()
+            assert self.check_server_status(server_response) == "success"
+            if model != "all":
+                assert [car["model"] for car in server_response["vehicles"]] == [model]
+
+    #@slash.skipped
+    @slash.parametrize("depth", pipeline_depths)
+    def test_pipelined_reads(self, depth):
+        expected_models = {}
+        for request_id in range(depth):
+            model = vehicle_reads[request_id % len(vehicle_reads)]
+            expected_models[request_id] = model
+            self.conn.send({**self.read_vehicles_msg(model), "request_id": request_id})
+
+        # Responses may come back in any order, but each one echoes its request_id
+        responses = {}
+        for _ in range(depth):
+            server_response = self.conn.recv()
+            assert server_response
+            responses[server_response["request_id"]] = server_response
+
+        assert set(responses) == set(expected_models)
+        for request_id, model in expected_models.items():
+            assert self.check_server_status(responses[request_id]) == "success"
+            if model != "all":
+                assert responses[request_id]["vehicles"][0]["model"] == model
+
+    #@slash.skipped
+    def test_pipelined_prompt(self):
+        add_msg = {
+            "data_type": "engineer",
+            "action": "add",
+            "request_id": "add",
+            "name": "Steven Universe",
+            "birth_year": 2010,
+            "birth_month": 10,
+            "birth_date": 1
+        }
+        self.conn.send(add_msg)
+        self.conn.send({"data_type": "engineer", "action": "read", "name": "all", "request_id": "read"})
+
+        responses = {}
+        for _ in range(2):
+            server_response = self.conn.recv()
+            responses[server_response["request_id"]] = server_response
+        assert self.check_server_status(responses["add"]) == "success"
+        assert self.check_server_status(responses["read"]) == "success"
+
+        # The follow-up response is routed to the waiting add job by its request_id
+        self.conn.send({"request_id": "add", "response": "y", "vehicles": ["Fusion"]})
+        server_response = self.conn.recv()
+        assert server_response["request_id"] == "add"
+        assert server_response["assigned"] == ["Fusion"]
+
+    #@slash.skipped
+    @slash.parametrize("limit", [1, 3, 4, 10])
+    def test_paged_read(self, limit):
+        models = []
+        after_id = None
+        while True:
+            read_msg = {**self.read_vehicles_msg("all"), "limit": limit}
+            if after_id is not None:
+                read_msg["after_id"] = after_id
+            self.conn.send(read_msg)
+            server_response = self.conn.recv()
+            assert self.check_server_status(server_response) == "success"
+            assert 0 < len(server_response["vehicles"]) <= limit
+            models.extend(car["model"] for car in server_response["vehicles"])
+            if "next_after_id" not in server_response:
+                break
+            after_id = server_response["next_after_id"]
+            assert after_id == server_response["vehicles"][-1]["id"]
+        assert sorted(models) == sorted(self.default_vehicle_models)
+
+    #@slash.skipped
+    @slash.parametrize("chunk_size", [1, 3, 4, 10])
+    def test_streamed_read(self, chunk_size):
+        self.conn.send({**self.read_vehicles_msg("all"), "stream": True, "chunk_size": chunk_size})
+        models = []
+        frames = 0
+        more = True
+        while more:
+            server_response = self.conn.recv()
+            assert self.check_server_status(server_response) == "success"
+            assert len(server_response["vehicles"]) <= chunk_size
+            models.extend(car["model"] for car in server_response["vehicles"])
+            more = server_response["more"]
+            frames += 1
+        assert frames == max(1, -(-len(self.default_vehicle_models) // chunk_size))
+        assert sorted(models) == sorted(self.default_vehicle_models)
+
+    #@slash.skipped
+    @slash.parametrize("entries", [{"limit": 0}, {"limit": True}, {"limit": 2, "after_id": False}, {"stream": True, "chunk_size": True}])
+    def test_paged_read_bad_limit(self, entries):
+        self.conn.send({**self.read_vehicles_msg("all"), **entries})
+        server_response = self.conn.recv()
+        assert server_response["status"] == "error"
+        # The last entry is the bad one
+        assert f"\"{list(entries)[-1]}\"" in server_response["text"]
@@ -0,0 +1,229 @@
+import os
+import tempfile
+from datetime import date
+from contextlib import contextmanager
+import slash
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from training.server.base import Base
+from training.server.config import create_configured_engine
+from training.server import statements
+from training.server.db_utils import VehicleUtils, EngineerUtils, LaptopUtils, ContactDetailsUtils
+from training.server.model import Vehicle, Engineer, Laptop, ContactDetails, vehicle_engineer_association
+
+class ServerDbUtilsTests(slash.Test):
+    """db_utils run against a scratch SQLite database holding the default rows, no server is needed."""
+
+    def before(self):
+        self.scratch_file = os.path.join(tempfile.gettempdir(), "db_utils_tests.db")
+        if os.path.exists(self.scratch_file):
+            os.remove(self.scratch_file)
+        self.bind = create_configured_engine({"url": f"sqlite:///{self.scratch_file}"})
+        Base.metadata.create_all(self.bind)
+        self.fill()
+        # Like a job's session
+        self.session = Session(bind=self.bind, expire_on_commit=False)
+        self.car_utils = VehicleUtils()
+        self.engin_utils = EngineerUtils()
+        self.laptop_utils = LaptopUtils()
+        self.contact_utils = ContactDetailsUtils()
+
+    def after(self):
+        self.session.close()
+        self.bind.dispose()
+        os.remove(self.scratch_file)
+
+    def fill(self):
+        session = Session(bind=self.bind)
+        cameron = Engineer("Cameron Foss", date(1998, 12, 1))
+        prerna = Engineer("Prerna Sancheti", date(1992, 8, 13))
+        jaiven = Engineer("Jaivenkatram Harirao", date(1990, 3, 26))
+        fusion = Vehicle("Fusion", 3, 23170, date(2019, 10, 5))
+        explorer = Vehicle("Explorer", 1, 32765, date(2019, 6, 15))
+        bronco = Vehicle("Bronco", 0, 26820, date(2018, 12, 20))
+        mustang = Vehicle("Mustang Shelby GT500", 10, 73995, date(2019, 3, 30))
+        fusion.engineers = [prerna, jaiven]
+        explorer.engineers = [cameron, prerna]
+        bronco.engineers = [jaiven]
+        mustang.engineers = [cameron, prerna, jaiven]
+        session.add_all([fusion, explorer, bronco, mustang,
+                         ContactDetails("989-906-0292", "302 W Davis Ave Ann Arbor MI", cameron),
+                         ContactDetails("555-999-9999", "1123 Example St", prerna),
+                         ContactDetails("555-777-7777", "432 Example Work Address", prerna),
+                         ContactDetails("555-333-3333", "888 Another Example St", jaiven),
+                         Laptop("Macbook Air", date(2016, 9, 1), cameron),
+                         Laptop("Surface Pro 7", date(2018, 12, 10), prerna),
+                         Laptop("Dell Latitude", date(2017, 7, 11), jaiven)])
+        session.commit()
+        session.close()
+
+    @contextmanager
+    def count_queries(self):
+        """Yields a list that ends up holding the statements run inside the block."""
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            # The BEGIN the engine runs itself is not a query
+            if statement != "BEGIN":
+                statements.append(statement)
+
+        event.listen(self.bind, "before_cursor_execute", count)
+        try:
+            yield statements
+        finally:
+            event.remove(self.bind, "before_cursor_execute", count)
+
+    def add_vehicles(self, num_vehicles):
+        session = Session(bind=self.bind)
+        engineers = session.query(Engineer).all()
+        session.add_all([Vehicle(f"Model {i}", 1, 20000, date(2020, 1, 1)) for i in range(num_vehicles)])
+        session.flush()
+        for car in session.query(Vehicle).filter(Vehicle.model.like("Model %")):
+            car.engineers = engineers
+        session.commit()
+        session.close()
+
+    #@slash.skipped
+    def test_read_all_vehicles_runs_fixed_queries(self):
+        with self.count_queries() as few_rows:
+            [car.to_json() for car in self.car_utils.read_vehicles_all(self.session)]
+        self.session.expunge_all()
+        self.add_vehicles(20)
+        with self.count_queries() as many_rows:
+            cars = [car.to_json() for car in self.car_utils.read_vehicles_all(self.session)]
+        assert len(cars) == 24
+        assert len(many_rows) == len(few_rows)
+        fusion = next(car for car in cars if car["model"] == "Fusion")
+        assert sorted(fusion["engineers"]) == ["Jaivenkatram Harirao", "Prerna Sancheti"]
+
+    #@slash.skipped
+    @slash.parametrize(("model", "names"), [("Explorer", ["Cameron Foss", "Prerna Sancheti"]), ("Bronco", ["Jaivenkatram Harirao"]), ("Civic", [])])
+    def test_assigned_engineers_by_model(self, model, names):
+        with self.count_queries() as queries:
+            engins = self.car_utils.read_assigned_engineers_by_model(self.session, model)
+        assert sorted(engin.name for engin in engins) == names
+        assert len(queries) == 1
+
+    #@slash.skipped
+    def test_assigned_vehicles_by_name(self):
+        cars = self.engin_utils.read_assigned_vehicles_by_name(self.session, "Jaivenkatram Harirao")
+        assert sorted(car.model for car in cars) == ["Bronco", "Fusion", "Mustang Shelby GT500"]
+
+    #@slash.skipped
+    def test_laptop_and_contact_reads_load_their_engineer(self):
+        with self.count_queries() as queries:
+            laptops = self.laptop_utils.read_laptops_by_model(self.session, "Surface Pro 7")
+            contacts = self.contact_utils.read_contact_details_by_engin_id(self.session, laptops[0].engineer_id)
+            names = [laptop.to_json()["engineer"] for laptop in laptops] + [contact.to_json()["engineer"] for contact in contacts]
+        assert names == ["Prerna Sancheti"] * 3
+        assert len(queries) == 2, queries
+
+    def engineer_id(self, name):
+        return self.session.query(Engineer.id).filter(Engineer.name == name).scalar()
+
+    def vehicle_versions(self):
+        return dict(self.session.query(Vehicle.model, Vehicle.version).all())
+
+    def assigned_models(self, engineer_id):
+        with self.bind.connect() as connection:
+            return sorted(connection.execute(select(Vehicle.model)
+                                             .join(vehicle_engineer_association, vehicle_engineer_association.c.vehicle_id == Vehicle.id)
+                                             .where(vehicle_engineer_association.c.engineer_id == engineer_id)).scalars())
+
+    #@slash.skipped
+    def test_reassign_vehicles(self):
+        cameron = self.engineer_id("Cameron Foss")
+        before = self.vehicle_versions()
+        assigned, unassigned = self.engin_utils.set_assigned_vehicles_by_id(self.session, cameron, ["Fusion", "Civic", "Explorer", "Fusion"])
+        assert assigned == ["Fusion", "Explorer"]
+        assert unassigned == ["Mustang Shelby GT500"]
+        assert self.assigned_models(cameron) == ["Explorer", "Fusion"]
+        self.session.expire_all()
+        after = self.vehicle_versions()
+        # Only the vehicles whose engineers changed
+        assert {model for model in after if after[model] != before[model]} == {"Fusion", "Mustang Shelby GT500"}
+
+    #@slash.skipped
+    def test_reassign_leaves_other_engineers(self):
+        prerna = self.engineer_id("Prerna Sancheti")
+        self.engin_utils.set_assigned_vehicles_by_id(self.session, self.engineer_id("Jaivenkatram Harirao"), [])
+        assert self.assigned_models(self.engineer_id("Jaivenkatram Harirao")) == []
+        assert self.assigned_models(prerna) == ["Explorer", "Fusion", "Mustang Shelby GT500"]
+
+    #@slash.skipped
+    def test_reassign_same_vehicles_changes_nothing(self):
+        prerna = self.engineer_id("Prerna Sancheti")
+        before = self.vehicle_versions()
+        with self.count_queries() as queries:
+            assigned, unassigned = self.engin_utils.set_assigned_vehicles_by_id(self.session, prerna, ["Mustang Shelby GT500", "Explorer", "Fusion"])
+        assert assigned == ["Mustang Shelby GT500", "Explorer", "Fusion"]
+        assert unassigned == []
+        assert not any(query.startswith(("INSERT", "UPDATE", "DELETE")) for query in queries)
+        self.session.expire_all()
+        assert self.vehicle_versions() == before
+
+    def vehicle_stock(self, model):
+        with self.bind.connect() as connection:
+            return connection.execute(select(Vehicle.quantity, Vehicle.in_stock, Vehicle.version).where(Vehicle.model == model)).one()
+
+    #@slash.skipped
+    def test_add_new_vehicle(self):
+        car = self.car_utils.add_vehicle_db(self.session, "Civic", 2, 22000, date(2021, 1, 1))
+        assert car is not None and car.model == "Civic"
+        assert tuple(self.vehicle_stock("Civic")) == (2, True, 1)
+
+    #@slash.skipped
+    @slash.parametrize(("model", "quantity", "stock"), [
+        ("Fusion", 2, (5, True)), ("Bronco", 4, (4, True)), ("Bronco", 0, (0, False))
+    ])
+    def test_add_existing_vehicle_merges_quantity(self, model, quantity, stock):
+        version = self.vehicle_stock(model).version
+        assert self.car_utils.add_vehicle_db(self.session, model, quantity, 1, date(2021, 1, 1)) is None
+        assert tuple(self.vehicle_stock(model)) == stock + (version + 1,)
+        assert self.session.query(Vehicle).filter(Vehicle.model == model).count() == 1
+
+    #@slash.skipped
+    def test_repeated_adds_keep_every_quantity(self):
+        self.car_utils.add_vehicle_db(self.session, "Civic", 1, 22000, date(2021, 1, 1))
+        for _ in range(3):
+            self.car_utils.add_vehicle_db(self.session, "Civic", 2, 22000, date(2021, 1, 1))
+        assert tuple(self.vehicle_stock("Civic")) == (7, True, 4)
+
+    def statement_cases(self):
+        """The parameters of each prebuilt statement and the rows the ORM loads for it."""
+        query = self.session.query
+        fusion = query(Vehicle.id).filter(Vehicle.model == "Fusion").scalar()
+        prerna = self.engineer_id("Prerna Sancheti")
+        surface = query(Laptop.id).filter(Laptop.model == "Surface Pro 7").scalar()
+        contact = query(ContactDetails.id).filter(ContactDetails.phone_number == "555-777-7777").scalar()
+        return {
+            "vehicle_by_id": ({"id": fusion}, query(Vehicle).filter(Vehicle.id == fusion).all()),
+            "vehicles_by_model": ({"model": "Fusion"}, query(Vehicle).filter(Vehicle.model == "Fusion").all()),
+            "vehicle_by_id_without_engineers": ({"id": fusion}, query(Vehicle).filter(Vehicle.id == fusion).all()),
+            "vehicles_by_model_without_engineers": ({"model": "Fusion"}, query(Vehicle).filter(Vehicle.model == "Fusion").all()),
+            "vehicles_by_engineer_id": ({"engineer_id": prerna}, query(Vehicle).filter(Vehicle.engineers.any(Engineer.id == prerna)).all()),
+            "engineer_by_id": ({"id": prerna}, query(Engineer).filter(Engineer.id == prerna).all()),
+            "engineer_by_name": ({"name": "Prerna Sancheti"}, query(Engineer).filter(Engineer.name == "Prerna Sancheti").limit(1).all()),
+            "engineers_by_vehicle_model": ({"model": "Mustang Shelby GT500"}, query(Vehicle).filter(Vehicle.model == "Mustang Shelby GT500").one().engineers),
+            "laptop_by_id": ({"id": surface}, query(Laptop).filter(Laptop.id == surface).all()),
+            "laptops_by_model": ({"model": "Surface Pro 7"}, query(Laptop).filter(Laptop.model == "Surface Pro 7").all()),
+            "laptop_by_model_owner": ({"model": "Surface Pro 7", "engineer_id": prerna},
+                                      query(Laptop).filter(Laptop.model == "Surface Pro 7", Laptop.engineer_id == prerna).limit(1).all()),
+            "laptop_by_owner": ({"engineer_id": prerna}, query(Laptop).filter(Laptop.engineer_id == prerna).limit(1).all()),
+            "contact_details_by_id": ({"id": contact}, query(ContactDetails).filter(ContactDetails.id == contact).all()),
+            "contact_details_by_engineer_id": ({"engineer_id": prerna}, query(ContactDetails).filter(ContactDetails.engineer_id == prerna).all())
+        }
+
+    #@slash.skipped
+    @slash.parametrize("name", [
+        "vehicle_by_id", "vehicles_by_model", "vehicle_by_id_without_engineers", "vehicles_by_model_without_engineers",
+        "vehicles_by_engineer_id", "engineer_by_id", "engineer_by_name", "engineers_by_vehicle_model", "laptop_by_id",
+        "laptops_by_model", "laptop_by_model_owner", "laptop_by_owner", "contact_details_by_id", "contact_details_by_engineer_id"
+    ])
+    def test_statement_returns_orm_rows(self, name):
+        params, orm_rows = self.statement_cases()[name]
+        expected = sorted((row.id, str(row.to_json())) for row in orm_rows)
+        self.session.expunge_all()
+        rows = self.session.execute(getattr(statements, name), params).scalars().all()
+        assert expected
+        assert sorted((row.id, str(row.to_json())) for row in rows) == expected
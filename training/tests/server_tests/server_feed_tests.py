@@ -0,0 +1,128 @@
+import slash
+from training.sock_utils import FramedConnection
+from training.tests.server_tests_base import ServerTestsBase
+
+new_records = [
+    {"data_type": "engineer", "name": "Steven Universe", "birth_year": 2010, "birth_month": 10, "birth_date": 1},
+    {"data_type": "laptop", "model": "ThinkPad", "loan_year": 2020, "loan_month": 1, "loan_date": 1, "engineer": "Steven Universe"},
+    {"data_type": "contact_details", "engineer": "Steven Universe", "phone_number": "555-123-4567", "address": "1 Beach City"},
+    {"data_type": "vehicle", "model": "Civic", "quantity": 3, "price": 23000, "manufacture_year": 2017, "manufacture_month": 4, "manufacture_date": 30},
+    {"data_type": "vehicle", "model": "Fusion", "quantity": 2, "price": 23000, "manufacture_year": 2019, "manufacture_month": 5, "manufacture_date": 5}
+]
+
+class ServerFeedTests(ServerTestsBase):
+    def __init__(self, test_method_name, fixture_store, fixture_namespace, variation):
+        super().__init__(test_method_name, fixture_store, fixture_namespace, variation)
+        self.conn = None
+        self.subscriber = None
+
+    def __del__(self):
+        self.listen_sock.close()
+
+    def before(self):
+        print("Resetting database before test")
+        self.request_db_reset()
+        self.conn = FramedConnection.connect("localhost", self.server_port)
+        self.subscriber = self.connect_subscriber()
+
+    def after(self):
+        self.conn.close()
+        self.subscriber.close()
+
+    def connect_subscriber(self):
+        subscriber = FramedConnection.connect("localhost", self.server_port)
+        # Fail instead of hanging when an event never comes
+        subscriber.sock.settimeout(5)
+        return subscriber
+
+    def request(self, msg):
+        self.conn.send(msg)
+        return self.conn.recv()
+
+    def subscribe(self, subscriber, **entries):
+        subscriber.send({"action": "subscribe", **entries})
+        server_response = subscriber.recv()
+        assert self.check_server_status(server_response) == "subscribed"
+        return server_response["seq"]
+
+    def next_event(self):
+        return self.subscriber.recv()
+
+    def bulk_add(self, records):
+        server_response = self.request({"action": "bulk_add", "records": records})
+        assert self.check_server_status(server_response) == "success"
+
+    def add_engineer(self, name):
+        self.bulk_add([{"data_type": "engineer", "name": name, "birth_year": 1995, "birth_month": 5, "birth_date": 5}])
+
+    def read_engineer_id(self, name):
+        server_response = self.request({"data_type": "engineer", "action": "read", "name": name})
+        assert self.check_server_status(server_response) == "success"
+        return server_response["engineers"][0]["id"]
+
+    #@slash.skipped
+    def test_subscriber_receives_committed_changes(self):
+        seq = self.subscribe(self.subscriber, data_types=["engineer"])
+        self.add_engineer("Steven Universe")
+        engin_id = self.read_engineer_id("Steven Universe")
+        server_response = self.request({"data_type": "engineer", "action": "update", "id": engin_id, "name": "Connie Maheswaran"})
+        assert self.check_server_status(server_response) == "success"
+
+        assert self.next_event() == {"status": "event", "seq": seq + 1, "data_type": "engineer", "event": "insert", "id": engin_id}
+        assert self.next_event() == {"status": "event", "seq": seq + 2, "data_type": "engineer", "event": "update", "id": engin_id}
+
+    #@slash.skipped
+    def test_subscriber_only_receives_chosen_data_types(self):
+        self.subscribe(self.subscriber, data_types=["vehicle"])
+        self.add_engineer("Steven Universe")
+        # Prerna is assigned the Bronco, only the vehicle's assignments change
+        engin_id = self.read_engineer_id("Prerna Sancheti")
+        server_response = self.request({"data_type": "engineer", "action": "update", "id": engin_id, "vehicles": ["Fusion", "Explorer", "Mustang Shelby GT500", "Bronco"]})
+        assert self.check_server_status(server_response) == "success"
+        event = self.next_event()
+        assert event["data_type"] == "vehicle" and event["event"] == "update"
+
+    #@slash.skipped
+    def test_bulk_add_events(self):
+        seq = self.subscribe(self.subscriber)
+        self.bulk_add(new_records)
+        events = [self.next_event() for _ in range(len(new_records))]
+        assert [event["seq"] for event in events] == list(range(seq + 1, seq + 1 + len(new_records)))
+        changes = sorted((event["data_type"], event["event"]) for event in events)
+        assert changes == [("contact_details", "insert"), ("engineer", "insert"), ("laptop", "insert"), ("vehicle", "insert"), ("vehicle", "update")]
+
+    #@slash.skipped
+    def test_resume_after_reconnect(self):
+        seq = self.subscribe(self.subscriber, data_types=["engineer"])
+        self.subscriber.close()
+        self.add_engineer("Steven Universe")
+        self.add_engineer("Connie Maheswaran")
+
+        self.subscriber = self.connect_subscriber()
+        assert self.subscribe(self.subscriber, data_types=["engineer"], after_seq=seq) == seq
+        events = [(event["seq"], event["id"]) for event in [self.next_event() for _ in range(2)]]
+        assert events == [(seq + 1, self.read_engineer_id("Steven Universe")), (seq + 2, self.read_engineer_id("Connie Maheswaran"))]
+
+    #@slash.skipped
+    def test_resume_past_last_event(self):
+        seq = self.subscribe(self.subscriber)
+        self.subscriber.send({"action": "subscribe", "after_seq": seq + 100})
+        assert self.subscriber.recv()["status"] == "error"
+
+    #@slash.skipped
+    @slash.parametrize("after_seq", [-1, False, "0"])
+    def test_resume_after_bad_seq(self, after_seq):
+        self.subscriber.send({"action": "subscribe", "after_seq": after_seq})
+        assert self.subscriber.recv()["status"] == "error"
+
+    #@slash.skipped
+    def test_resume_after_reset_resyncs(self):
+        self.subscribe(self.subscriber)
+        self.add_engineer("Steven Universe")
+        seq = self.next_event()["seq"]
+        self.subscriber.close()
+        self.request_db_reset()
+
+        self.subscriber = self.connect_subscriber()
+        self.subscribe(self.subscriber, after_seq=seq)
+        assert self.check_server_status(self.subscriber.recv()) == "resync"
@@ -0,0 +1,142 @@
+import os
+import tempfile
+import threading
+import multiprocessing
+import slash
+from training.server.locks import LockManager, FileLockManager
+
+# Long enough for a lock that could be granted to be granted
+GRANT_WAIT = 0.3
+
+class Holder:
+    """Holds requests from a lock manager on its own thread until released."""
+
+    def __init__(self, manager, requests, granted_order=None):
+        self.granted = threading.Event()
+        self.release = threading.Event()
+        self.thread = threading.Thread(target=self.hold, args=(manager, requests, granted_order))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def hold(self, manager, requests, granted_order):
+        with manager.hold(requests):
+            if granted_order is not None:
+                granted_order.append(self)
+            self.granted.set()
+            self.release.wait()
+
+    def is_granted(self):
+        return self.granted.wait(GRANT_WAIT)
+
+    def done(self):
+        self.release.set()
+        self.thread.join(5)
+
+
+def hold_in_process(path_prefix, requests, granted, release):
+    # Like a --workers process holding the locks of a job
+    with FileLockManager(path_prefix).hold(requests):
+        granted.set()
+        release.wait(10)
+
+
+class ServerLockTests(slash.Test):
+    """Lock managers used directly, no server is needed."""
+
+    def before(self):
+        self.holders = []
+
+    def after(self):
+        for holder in self.holders:
+            holder.done()
+
+    def hold(self, manager, requests, granted_order=None):
+        holder = Holder(manager, requests, granted_order)
+        self.holders.append(holder)
+        return holder
+
+    #@slash.skipped
+    def test_row_lock_conflicts_with_same_row_and_whole_table(self):
+        manager = LockManager()
+        writer = self.hold(manager, {"schema": "S", "vehicles": "IX", ("vehicles", "Fusion"): "X"})
+        assert writer.is_granted()
+        same_row = self.hold(manager, {"schema": "S", "vehicles": "IS", ("vehicles", "Fusion"): "S"})
+        other_row = self.hold(manager, {"schema": "S", "vehicles": "IS", ("vehicles", "Bronco"): "S"})
+        whole_table = self.hold(manager, {"schema": "S", "vehicles": "S"})
+        other_table = self.hold(manager, {"schema": "S", "engineers": "X"})
+        assert other_row.is_granted()
+        assert other_table.is_granted()
+        assert not same_row.is_granted()
+        assert not whole_table.is_granted()
+        writer.done()
+        assert same_row.is_granted()
+        assert whole_table.is_granted()
+
+    #@slash.skipped
+    @slash.parametrize(("held", "requested", "compatible"), [
+        ("IS", "IS", True), ("IS", "IX", True), ("IS", "S", True), ("IS", "X", False),
+        ("IX", "IX", True), ("IX", "S", False), ("IX", "X", False),
+        ("S", "S", True), ("S", "X", False), ("X", "X", False)
+    ])
+    def test_table_mode_compatibility(self, held, requested, compatible):
+        manager = LockManager()
+        assert self.hold(manager, {"vehicles": held}).is_granted()
+        assert self.hold(manager, {"vehicles": requested}).is_granted() == compatible
+
+    #@slash.skipped
+    def test_waiting_writer_is_not_overtaken_by_later_readers(self):
+        manager = LockManager()
+        granted_order = []
+        reader = self.hold(manager, {"schema": "S", "vehicles": "S"}, granted_order)
+        assert reader.is_granted()
+        writer = self.hold(manager, {"schema": "S", "vehicles": "X"}, granted_order)
+        assert not writer.is_granted()
+        later_reader = self.hold(manager, {"schema": "S", "vehicles": "S"}, granted_order)
+        # Compatible with the lock held, but the writer asked first
+        assert not later_reader.is_granted()
+        reader.done()
+        assert writer.is_granted()
+        assert not later_reader.is_granted()
+        writer.done()
+        assert later_reader.is_granted()
+        assert granted_order == [reader, writer, later_reader]
+
+    #@slash.skipped
+    def test_schema_lock_excludes_every_job(self):
+        manager = LockManager()
+        reset = self.hold(manager, {"schema": "X", "vehicles": "X"})
+        assert reset.is_granted()
+        job = self.hold(manager, {"schema": "S", "laptops": "S"})
+        assert not job.is_granted()
+        reset.done()
+        assert job.is_granted()
+
+    def hold_in_other_process(self, path_prefix, requests):
+        context = multiprocessing.get_context("fork")
+        granted, release = context.Event(), context.Event()
+        process = context.Process(target=hold_in_process, args=(path_prefix, requests, granted, release))
+        process.start()
+        assert granted.wait(5)
+        return process, release
+
+    #@slash.skipped
+    @slash.parametrize(("held", "requested", "compatible"), [
+        ({"vehicles": "X"}, {"vehicles": "S"}, False),
+        ({"vehicles": "S"}, {"vehicles": "S"}, True),
+        ({"vehicles": "S"}, {"vehicles": "IX", ("vehicles", "Fusion"): "X"}, False),
+        ({"vehicles": "X"}, {"engineers": "X"}, True)
+    ])
+    def test_file_locks_exclude_other_processes(self, held, requested, compatible):
+        with tempfile.TemporaryDirectory() as lock_dir:
+            path_prefix = os.path.join(lock_dir, "training")
+            process, release = self.hold_in_other_process(path_prefix, held)
+            try:
+                waiter = self.hold(FileLockManager(path_prefix), requested)
+                assert waiter.is_granted() == compatible
+                release.set()
+                process.join(5)
+                assert waiter.is_granted()
+                waiter.done()
+            finally:
+                release.set()
+                process.join(5)
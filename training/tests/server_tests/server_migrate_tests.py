@@ -0,0 +1,84 @@
+import os
+import tempfile
+from datetime import date
+import slash
+from sqlalchemy import inspect, select, func
+from sqlalchemy.orm import Session
+from training.server.base import Base
+from training.server.config import create_configured_engine
+from training.server.migrate import stamp, upgrade, downgrade, current_version, head_version
+from training.server.model import Vehicle, Engineer, Laptop, ContactDetails, vehicle_engineer_association, table_versions
+
+class ServerMigrateTests(slash.Test):
+    """Migrations run against a scratch SQLite database, no server is needed."""
+
+    def before(self):
+        self.scratch_file = os.path.join(tempfile.gettempdir(), "migrate_tests.db")
+        if os.path.exists(self.scratch_file):
+            os.remove(self.scratch_file)
+        self.bind = create_configured_engine({"url": f"sqlite:///{self.scratch_file}"})
+        Base.metadata.create_all(self.bind)
+        stamp(self.bind)
+        session = Session(bind=self.bind)
+        engineer = Engineer("Prerna Sancheti", date(1990, 1, 1))
+        vehicle = Vehicle("Fusion", 3, 20000, date(2020, 1, 1))
+        vehicle.engineers = [engineer]
+        session.add_all([vehicle, Laptop("ThinkPad", date(2020, 1, 1), engineer), ContactDetails("000000000000", "Address", engineer)])
+        session.commit()
+        session.close()
+
+    def after(self):
+        self.bind.dispose()
+        os.remove(self.scratch_file)
+
+    def schema(self):
+        inspector = inspect(self.bind)
+        return {
+            table: (
+                sorted(column["name"] for column in inspector.get_columns(table)),
+                sorted(inspector.get_pk_constraint(table)["constrained_columns"]),
+                sorted((index["name"], tuple(index["column_names"])) for index in inspector.get_indexes(table))
+            )
+            for table in inspector.get_table_names()
+        }
+
+    def version(self):
+        with self.bind.begin() as connection:
+            return current_version(connection)
+
+    #@slash.skipped
+    def test_downgrade_and_upgrade_round_trip(self):
+        latest = self.schema()
+        downgrade(self.bind, target=0)
+        assert self.version() == 0
+        assert "change_events" not in self.schema()
+        assert self.schema()["vehicle_engineers"][1] == []
+        upgrade(self.bind)
+        assert self.version() == head_version()
+        assert self.schema() == latest
+
+        with self.bind.connect() as connection:
+            assert connection.execute(select(Vehicle.model, Vehicle.version)).all() == [("Fusion", 1)]
+            assert connection.execute(select(vehicle_engineer_association)).all() == [(1, 1)]
+            assert connection.execute(select(Laptop.model, Laptop.engineer_id)).all() == [("ThinkPad", 1)]
+
+    #@slash.skipped
+    @slash.parametrize("target", [1, 2, 3, 4])
+    def test_downgrade_to_each_version(self, target):
+        latest = self.schema()
+        downgrade(self.bind, target=target)
+        assert self.version() == target
+        upgrade(self.bind)
+        assert self.schema() == latest
+
+    #@slash.skipped
+    def test_table_versions_survive_sharding_round_trip(self):
+        versions = select(table_versions.c.table_name, func.sum(table_versions.c.version)).group_by(table_versions.c.table_name)
+        with self.bind.connect() as connection:
+            before = dict(connection.execute(versions).all())
+        downgrade(self.bind, target=4)
+        upgrade(self.bind)
+        with self.bind.connect() as connection:
+            after = dict(connection.execute(versions).all())
+        assert after.keys() == before.keys()
+        assert all(after[table] >= before[table] for table in before)
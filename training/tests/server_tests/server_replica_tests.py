@@ -0,0 +1,72 @@
+import os
+import tempfile
+from time import sleep
+import slash
+from training.server.config import create_configured_engine
+from training.server.replicas import ReplicaRouter
+
+class ServerReplicaTests(slash.Test):
+    """Routing between scratch SQLite databases, no server is needed."""
+
+    def before(self):
+        self.db_dir = tempfile.TemporaryDirectory()
+        self.primary = self.engine("primary.db")
+        self.replica = self.engine("replica.db")
+        # SQLite can't create a database file in a directory that doesn't exist
+        self.down_replica = self.engine(os.path.join("missing", "replica.db"))
+
+    def after(self):
+        for engine in [self.primary, self.replica, self.down_replica]:
+            engine.dispose()
+        self.db_dir.cleanup()
+
+    def engine(self, name):
+        return create_configured_engine({"url": f"sqlite:///{os.path.join(self.db_dir.name, name)}"})
+
+    def read_bind(self, router, client_key=None):
+        """The engine a read job of client_key is sent to."""
+        with router.bind(True, client_key) as bind:
+            return getattr(bind, "engine", bind)
+
+    def write(self, router, client_key):
+        with router.bind(False, client_key) as bind:
+            assert bind is self.primary
+
+    #@slash.skipped
+    def test_reads_go_to_replica(self):
+        router = ReplicaRouter(self.primary, [self.replica])
+        assert self.read_bind(router) is self.replica
+        assert self.read_bind(router, "client") is self.replica
+
+    #@slash.skipped
+    def test_client_reads_its_writes_from_primary(self):
+        router = ReplicaRouter(self.primary, [self.replica], read_your_writes=0.5)
+        self.write(router, "writer")
+        assert self.read_bind(router, "writer") is self.primary
+        assert self.read_bind(router, "reader") is self.replica
+        sleep(0.6)
+        assert self.read_bind(router, "writer") is self.replica
+
+    #@slash.skipped
+    def test_unavailable_replica_is_skipped(self):
+        router = ReplicaRouter(self.primary, [self.down_replica, self.replica], retry_after=0.5)
+        assert [self.read_bind(router) for _ in range(4)] == [self.replica] * 4
+        assert router.down_until[0] > 0
+
+    #@slash.skipped
+    def test_reads_fall_back_to_primary_without_replicas(self):
+        router = ReplicaRouter(self.primary, [self.down_replica])
+        assert self.read_bind(router) is self.primary
+        assert self.read_bind(router) is self.primary
+
+    #@slash.skipped
+    def test_least_connections(self):
+        other_replica = self.engine("other_replica.db")
+        router = ReplicaRouter(self.primary, [self.replica, other_replica], strategy="least-connections")
+        try:
+            with router.bind(True) as busy:
+                assert self.read_bind(router) is not busy.engine
+                assert self.read_bind(router) is not busy.engine
+            assert router.in_use == [0, 0]
+        finally:
+            other_replica.dispose()
@@ -0,0 +1,69 @@
+import slash
+from training.sock_utils import FramedConnection
+from training.tests.server_tests_base import ServerTestsBase
+
+class ServerTransactionTests(ServerTestsBase):
+    def __init__(self, test_method_name, fixture_store, fixture_namespace, variation):
+        super().__init__(test_method_name, fixture_store, fixture_namespace, variation)
+        self.conn = None
+
+    def __del__(self):
+        self.listen_sock.close()
+
+    def before(self):
+        print("Resetting database before test")
+        self.request_db_reset()
+        self.conn = FramedConnection.connect("localhost", self.server_port)
+        if self.request({"action": "stats"}).get("transaction_scope") != "job":
+            self.conn.close()
+            slash.skip_test("The server doesn't run each job as one transaction (--transaction-scope job)")
+
+    def after(self):
+        self.conn.close()
+
+    def request(self, msg):
+        self.conn.send(msg)
+        return self.conn.recv()
+
+    def read_engineer(self, name):
+        server_response = self.request({"data_type": "engineer", "action": "read", "name": name})
+        assert self.check_server_status(server_response) == "success"
+        return server_response["engineers"][0]
+
+    def read_vehicle(self, model):
+        server_response = self.request({"data_type": "vehicle", "action": "read", "model": model})
+        assert self.check_server_status(server_response) == "success"
+        return server_response["vehicles"][0]
+
+    #@slash.skipped
+    def test_failed_job_rolls_back_every_write(self):
+        cameron = self.read_engineer("Cameron Foss")
+        bronco = self.read_vehicle("Bronco")
+        explorer = self.read_vehicle("Explorer")
+        # The vehicles are reassigned before the birthday turns out to be invalid
+        server_response = self.request({"data_type": "engineer", "action": "update", "id": cameron["id"], "name": "Steven Universe",
+                                        "vehicles": ["Bronco"], "birth_month": 13})
+        assert server_response["status"] == "error"
+        assert self.read_engineer("Cameron Foss") == cameron
+        assert self.read_vehicle("Bronco") == bronco
+        assert self.read_vehicle("Explorer") == explorer
+
+    #@slash.skipped
+    def test_failed_write_rolls_back_to_its_savepoint(self):
+        fusion = self.read_vehicle("Fusion")
+        # Renaming the Fusion to a model that exists fails after its quantity and engineers were changed
+        server_response = self.request({"data_type": "vehicle", "action": "update", "id": fusion["id"], "model": "Explorer",
+                                        "quantity": 99, "engineers": ["Cameron Foss"]})
+        assert server_response["status"] == "error"
+        assert self.read_vehicle("Fusion") == fusion
+        # The job carries on after the savepoint, so the connection still answers in order
+        assert self.read_vehicle("Explorer")["model"] == "Explorer"
+
+    #@slash.skipped
+    def test_aborted_job_sends_no_deferred_replies(self):
+        prerna = self.read_engineer("Prerna Sancheti")
+        server_response = self.request({"data_type": "engineer", "action": "update", "id": prerna["id"], "vehicles": [], "birth_month": 13})
+        assert server_response["status"] == "error"
+        # Had the job's replies been sent anyway, the next job would get them instead of its own
+        assert self.request({"action": "stats"})["transaction_scope"] == "job"
+        assert self.read_engineer("Prerna Sancheti") == prerna
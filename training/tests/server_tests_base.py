@@ -1,7 +1,7 @@
 from json.decoder import JSONDecodeError
 import slash
 import socket
-from training.sock_utils import send_message, get_data_from_connection, decode_message_chunks
+from training.sock_utils import get_data_from_connection, decode_message_chunks, FramedConnection
 
 class ServerTestsBase(slash.Test):
     listen_port = 6001
@@ -28,7 +28,14 @@ class ServerTestsBase(slash.Test):
         msg = {
             "action": "reset"
         }
-        send_message("localhost", self.server_port, msg)
+        # The server answers on a framed connection once the reset is done
+        conn = FramedConnection.connect("localhost", self.server_port)
+        try:
+            conn.send(msg)
+            server_response = conn.recv()
+        finally:
+            conn.close()
+        assert self.check_server_status(server_response) == "success"
 
     def get_server_response(self):
         server_response = None